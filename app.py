@@ -1,19 +1,92 @@
 # Fichero: app.py (Versión corregida completa)
-from flask import Flask, render_template, request
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
 import pandas as pd
+import numpy as np
+import heapq
 import json
-import random
+import math
 from datetime import datetime, timedelta, time
 import pytz
 import requests
 import io
-from collections import defaultdict
+from collections import defaultdict, deque, namedtuple, OrderedDict
+from bisect import bisect_left, bisect_right
+from time import monotonic, perf_counter
+from contextlib import contextmanager
+import hashlib
+import copy
+import re
+import unicodedata
+import gzip
+import threading
+import logging
+import logging.handlers
+import queue
+import contextvars
+import sys
 import os
 
 app = Flask(__name__)
 
 # --- CONFIGURACIÓN ---
-GOOGLE_SHEET_URL = "https://docs.google.com/spreadsheets/d/1QConknaQ2O762EV3701kPtu2zsJBkYW6/export?format=csv&gid=151783393"
+GOOGLE_SHEET_URL = os.environ.get("GOOGLE_SHEET_URL", "https://docs.google.com/spreadsheets/d/1QConknaQ2O762EV3701kPtu2zsJBkYW6/export?format=csv&gid=151783393")
+# Segundos entre comprobaciones de cambios en la hoja (0 desactiva la recarga en segundo plano)
+INTERVALO_RECARGA_S = int(os.environ.get("INTERVALO_RECARGA_S", 300))
+# Con gunicorn y preload_app (gunicorn.conf.py) el proceso que importa la app solo carga la hoja y
+# no sirve: la recarga en segundo plano la arranca cada worker en post_fork
+RECARGA_SOLO_EN_WORKERS = os.environ.get("RECARGA_SOLO_EN_WORKERS", "") == "1"
+# Caché de búsquedas: número máximo de consultas guardadas y su vida en segundos
+CACHE_BUSQUEDAS_MAX = int(os.environ.get("CACHE_BUSQUEDAS_MAX", 256))
+CACHE_BUSQUEDAS_TTL_S = int(os.environ.get("CACHE_BUSQUEDAS_TTL_S", 600))
+# Resultados que se muestran por criterio (llegada, transbordos, precio); 0 = todos
+RESULTADOS_POR_CRITERIO = int(os.environ.get("RESULTADOS_POR_CRITERIO", 10))
+# Horas hacia delante que cubre una búsqueda "desde ahora" (p. ej. 48 para ver también pasado mañana)
+HORIZONTE_BUSQUEDA_H = int(os.environ.get("HORIZONTE_BUSQUEDA_H", 24))
+# Tiempos mínimos de transbordo por parada y compañías: otra pestaña de la hoja (URL de exportación
+# CSV) o, si no se da, un CSV local. Sin tabla se usa TIEMPO_TRANSBORDO_MIN en todas partes.
+TRANSBORDOS_URL = os.environ.get("TRANSBORDOS_URL", "")
+TRANSBORDOS_CSV = os.environ.get("TRANSBORDOS_CSV", os.path.join(os.path.dirname(os.path.abspath(__file__)), "transbordos.csv"))
+# Una descarga sin estas columnas o con más de esta fracción de filas rechazadas no es la hoja de
+# horarios (una página de error, la hoja vaciada): no se publica y se sigue con la versión en uso
+COLUMNAS_OBLIGATORIAS = ('Origen', 'Destino', 'Tipo_Horario')
+RECHAZO_MAXIMO = float(os.environ.get("RECHAZO_MAXIMO", 0.9))
+# Copia local de la hoja ya limpia: arranque en frío sin red y respaldo si Google no responde
+CACHE_HORARIOS = os.environ.get("CACHE_HORARIOS", os.path.join(os.path.dirname(os.path.abspath(__file__)), "horarios_cache.bin"))
+
+# --- Registro (logging) ---
+# Nivel por defecto INFO: el detalle de depuración no se formatea salvo con LOG_LEVEL=DEBUG
+# o con la traza activada en una petición concreta (?traza=1, campo "traza" o cabecera X-Traza).
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+_traza_peticion = contextvars.ContextVar('traza_peticion', default=False)
+
+class LoggerRuta(logging.Logger):
+    def isEnabledFor(self, level):
+        if level >= logging.DEBUG and _traza_peticion.get():
+            return True
+        return super().isEnabledFor(level)
+
+logging.setLoggerClass(LoggerRuta)
+logger = logging.getLogger("mi_ruta")
+logging.setLoggerClass(logging.Logger)
+logger.setLevel(LOG_LEVEL)
+logger.propagate = False
+# Los hilos de petición solo encolan; un hilo aparte escribe en stdout
+_cola_registro = queue.SimpleQueue()
+logger.addHandler(logging.handlers.QueueHandler(_cola_registro))
+_escritor_registro = None
+
+def iniciar_registro():
+    # Un QueueListener por proceso: tras un fork el hilo del padre no existe en el hijo
+    global _escritor_registro
+    if _escritor_registro is not None and _escritor_registro[0] == os.getpid():
+        return
+    salida = logging.StreamHandler(sys.stdout)
+    salida.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(process)d] %(message)s"))
+    oyente = logging.handlers.QueueListener(_cola_registro, salida)
+    oyente.start()
+    _escritor_registro = (os.getpid(), oyente)
+
+iniciar_registro()
 
 # --- Funciones de Ayuda ---
 def get_icon_for_compania(compania, transporte=None):
@@ -36,319 +109,1796 @@ def format_timedelta(td):
     if hours > 0: return f"{hours}h {minutes}min"
     return f"{minutes}min"
 
-def clean_minutes_column(series):
-    def to_minutes(val):
-        if pd.isna(val) or val == '': return 0
-        if isinstance(val, (int, float)): return val
-        if isinstance(val, str):
-            try:
-                parts = list(map(int, val.split(':')))
-                if len(parts) >= 2: return parts[0] * 60 + parts[1]
-            except: return 0
-        if isinstance(val, time): return val.hour * 60 + val.minute
-        return 0
-    return series.apply(to_minutes)
+def formato_hora(dt, hoy):
+    # HH:MM, con "(+1)" si ya es del día siguiente
+    dias = (dt.date() - hoy).days
+    return dt.strftime('%H:%M') + (f" (+{dias})" if dias > 0 else "")
+
+def minuto_del_dia(dt):
+    return dt.hour * 60 + dt.minute + (dt.second + dt.microsecond / 1e6) / 60
+
+def columna_minutos(series):
+    # Minutos de una columna de texto, en bloque: número ("12", "12,5") o H:MM[:SS]. Vacío = 0;
+    # lo que no se entiende queda NaN para que la validación lo rechace en vez de valer 0.
+    texto = series.astype(str).str.strip()
+    horas = texto.str.extract(r'^(\d+):(\d{1,2})(?::\d{1,2})?$').astype(float)
+    minutos = pd.to_numeric(texto.str.replace(',', '.', regex=False), errors='coerce').astype(float)
+    minutos = minutos.where(horas[0].isna(), horas[0] * 60 + horas[1])
+    return minutos.where(texto != '', 0.0)
+
+def parse_horas_a_minutos(series):
+    # 'HH:MM' -> minutos desde medianoche; -1 si la hora no es válida
+    horas = pd.to_datetime(series, format='%H:%M', errors='coerce')
+    return (horas.dt.hour * 60 + horas.dt.minute).fillna(-1).astype('int32').to_numpy(copy=True)
+
+# --- Índice de Rutas ---
+# Salidas de un servicio fijo en un día, ordenadas. `anclas` son las (salida, tramo) que pueden
+# abrir una ruta: las que otra salida posterior del mismo servicio no mejora. `mejor[j]` es, de
+# las salidas j en adelante, la que antes llega; `precio_unico`, si todas cuestan lo mismo.
+ServicioFijo = namedtuple('ServicioFijo', ['destino', 'salidas', 'tramos', 'anclas', 'mejor', 'precio_unico'])
+
+class VentanasServicio:
+    # Intervalos [inicio, fin] en minutos del día, ordenados y sin solapes. Un horario que cruza
+    # la medianoche (H_Primer > H_Ultim) se parte en [H_Primer, 24:00) y [00:00, H_Ultim].
+    __slots__ = ('inicios', 'fines', 'filas')
+
+    def __init__(self, intervalos, filas):
+        self.inicios, self.fines = [], []
+        for inicio, fin in sorted(intervalos):
+            if self.fines and inicio <= self.fines[-1]:
+                self.fines[-1] = max(self.fines[-1], fin)
+            else:
+                self.inicios.append(inicio)
+                self.fines.append(fin)
+        self.filas = filas
+
+    def contiene(self, minuto):
+        k = bisect_right(self.inicios, minuto) - 1
+        return k >= 0 and minuto <= self.fines[k]
+
+def intervalos_servicio(h_primer, h_ultim):
+    if h_primer < 0 or h_ultim < 0:
+        return []
+    if h_primer > h_ultim:
+        return [(h_primer, 1440), (0, h_ultim)]
+    return [(h_primer, h_ultim)]
+
+class SalidasFrecuencia:
+    # Salidas de una fila de frecuencia: cada `cada` minutos desde H_Primer hasta H_Ultim (del día
+    # siguiente si cruza la medianoche), los días de su máscara. Se generan en aritmética sobre la
+    # línea de tiempo absoluta de la consulta: minuto 0 = medianoche del día consultado. `clave`
+    # es igual para filas con las mismas salidas.
+    __slots__ = ('inicio', 'fin', 'cada', 'mascara', 'clave')
+
+    def __init__(self, inicio, fin, cada, mascara):
+        self.inicio = inicio
+        self.fin = fin + 1440 if fin < inicio else fin
+        self.cada = cada if cada > 0 else 0
+        self.mascara = int(mascara)
+        self.clave = (self.inicio, self.fin, self.cada, self.mascara)
+
+    def _ventana(self, dia, k):
+        # Ventana del día de servicio k (relativo al consultado), o None si ese día no circula
+        if not (self.mascara >> ((dia + k) % 7)) & 1:
+            return None
+        return k * 1440 + self.inicio, k * 1440 + self.fin
+
+    def siguiente(self, minuto, dia, hasta):
+        # Primera salida >= minuto que no pase de `hasta`
+        k = int(minuto // 1440) - 1
+        while k * 1440 + self.inicio <= hasta:
+            ventana = self._ventana(dia, k)
+            if ventana and minuto <= ventana[1]:
+                inicio, fin = ventana
+                if minuto <= inicio:
+                    return inicio if inicio <= hasta else None
+                salida = inicio + math.ceil((minuto - inicio) / self.cada) * self.cada if self.cada else minuto
+                if salida <= fin:
+                    return salida if salida <= hasta else None
+            k += 1
+        return None
+
+    def anterior(self, minuto, dia, desde):
+        # Última salida <= minuto que no sea anterior a `desde`
+        k = int(minuto // 1440)
+        while k * 1440 + self.fin >= desde:
+            ventana = self._ventana(dia, k)
+            if ventana and minuto >= ventana[0]:
+                inicio, fin = ventana
+                limite = min(minuto, fin)
+                salida = inicio + math.floor((limite - inicio) / self.cada) * self.cada if self.cada else limite
+                return salida if salida >= desde else None
+            k -= 1
+        return None
+
+def anclas_utiles(salidas, llegadas, precios, tramos):
+    # Saliendo del origen (sin tramos de frecuencia previos que encajar) la dominancia entre las
+    # salidas de un servicio no depende de la consulta: una salida sobra si otra posterior llega
+    # antes o a la vez (adelantamientos). Con precios distintos en el servicio se conservan todas.
+    # Con tramos previos la espera máxima puede impedir la posterior (ver anclas_que_encajan).
+    if len(salidas) > 1 and precios.min() == precios.max():
+        minimo_posterior = np.append(np.minimum.accumulate(llegadas[::-1])[::-1][1:], np.iinfo(np.int32).max)
+        utiles = np.flatnonzero(llegadas < minimo_posterior)
+    else:
+        utiles = np.arange(len(salidas))
+    return [(int(salidas[k]), tramos[k]) for k in utiles]
+
+def mejores_llegadas(llegadas):
+    # Índice de la llegada mínima de cada sufijo; con empates, la primera salida
+    n = len(llegadas)
+    claves = llegadas.astype(np.int64) * n + np.arange(n)
+    return (np.minimum.accumulate(claves[::-1])[::-1] % n).tolist()
+
+def salidas_utiles(servicio, j, hasta, llegadas, precios):
+    # Salidas que merece la pena tomar desde la primera alcanzable `j`, sin pasar de `hasta` (None:
+    # sin límite). No basta con la primera: en un mismo grupo una salida posterior puede llegar
+    # antes (un expreso tras un regional). Con precios distintos, también las que llegan más tarde
+    # pero cuestan menos.
+    salidas, tramos = servicio.salidas, servicio.tramos
+    if servicio.precio_unico:
+        m = servicio.mejor[j]
+        if hasta is None or salidas[m] <= hasta:
+            return (m,)
+    fin = len(salidas) if hasta is None else bisect_right(salidas, hasta, j)
+    utiles, precio_minimo = [], math.inf
+    for k in sorted(range(j, fin), key=lambda k: (llegadas[tramos[k]], precios[tramos[k]])):
+        if precios[tramos[k]] < precio_minimo:
+            utiles.append(k)
+            precio_minimo = precios[tramos[k]]
+    return utiles
+
+# Bit i = día de la semana i (0 = lunes). Códigos desconocidos o vacíos no circulan ningún día.
+MASCARAS_DIAS = {'L-D': 0b1111111, 'L-V': 0b0011111, 'S-D': 0b1100000, 'S': 0b0100000, 'D': 0b1000000}
+
+def mascara_dias_seguidos(dia, n):
+    mascara = 0
+    for k in range(n):
+        mascara |= 1 << ((dia + k) % 7)
+    return mascara
+
+def calcular_saltos(directo):
+    # Alcance en k tramos = alcance en k - 1 por la matriz de adyacencia (producto en float32, que
+    # va por BLAS); cada par se queda con el primer k en que aparece.
+    saltos = np.full(directo.shape, MAX_TRAMOS + 1, dtype=np.uint8)
+    np.fill_diagonal(saltos, 0)
+    alcance = directo
+    for k in range(1, MAX_TRAMOS + 1):
+        if k > 1:
+            alcance = np.minimum(alcance @ directo, 1)
+        saltos[(alcance > 0) & (saltos > k)] = k
+    saltos.setflags(write=False)
+    return saltos
+
+class TablaTransbordos:
+    # Minutos mínimos de transbordo. Columnas: Parada, Compania_Llegada, Compania_Salida, Minutos
+    # (número o H:MM). Una celda vacía vale para cualquiera y manda la regla más concreta: parada y
+    # las dos compañías, luego una sola, luego solo la parada; una fila sin parada vale para todas.
+    def __init__(self, texto=''):
+        self.huella = hashlib.sha256(texto.encode('utf-8')).hexdigest() if texto.strip() else ''
+        self.reglas = {}
+        if not self.huella:
+            return
+        df = pd.read_csv(io.StringIO(texto), dtype=str).fillna('')
+        df.columns = df.columns.str.strip()
+        df.rename(columns={'Compañía_Llegada': 'Compania_Llegada', 'Compañía_Salida': 'Compania_Salida'}, inplace=True)
+        for col in ('Parada', 'Compania_Llegada', 'Compania_Salida'):
+            if col not in df.columns:
+                df[col] = ''
+        valores = df['Minutos'].str.strip() if 'Minutos' in df.columns else pd.Series('', index=df.index)
+        minutos = columna_minutos(valores).where(valores != '')
+        for parada, llegada, salida, m in zip(df['Parada'], df['Compania_Llegada'], df['Compania_Salida'], minutos):
+            if pd.notna(m):
+                self.reglas[(parada.strip() or None, llegada.strip() or None, salida.strip() or None)] = float(m)
+
+    def minutos(self, parada, compania_llegada, compania_salida):
+        for p in (parada, None):
+            for clave in ((p, compania_llegada, compania_salida), (p, compania_llegada, None),
+                          (p, None, compania_salida), (p, None, None)):
+                minutos = self.reglas.get(clave)
+                if minutos is not None:
+                    return minutos
+        return TIEMPO_TRANSBORDO_MIN
+
+# Abreviaturas habituales en los nombres de parada, para que "Sta." y "Santa" sean lo mismo
+ABREVIATURAS_PARADAS = {'sta': 'santa', 'sto': 'santo', 'plz': 'plaza', 'pza': 'plaza', 'avda': 'avenida',
+                        'av': 'avenida', 'ctra': 'carretera', 'univ': 'universidad', 'hosp': 'hospital'}
+# Parecido mínimo por trigramas (Jaccard) para dar un nombre por bueno, y ventaja sobre el segundo
+UMBRAL_PARECIDO_PARADA = 0.45
+MARGEN_PARECIDO_PARADA = 0.1
+
+def normalizar_parada(nombre):
+    # Minúsculas, sin tildes ni signos y con las abreviaturas desarrolladas
+    texto = unicodedata.normalize('NFKD', str(nombre)).encode('ascii', 'ignore').decode('ascii').lower()
+    return ' '.join(ABREVIATURAS_PARADAS.get(p, p) for p in re.findall(r'[a-z0-9]+', texto))
+
+def trigramas(normalizado):
+    # Trigramas de cada palabra con relleno ("  sa", " sa", "san", ...), como pg_trgm
+    conjunto = set()
+    for palabra in normalizado.split():
+        relleno = f"  {palabra} "
+        conjunto.update(relleno[i:i + 3] for i in range(len(relleno) - 2))
+    return conjunto
+
+class IndiceNombres:
+    # Nombres de parada normalizados, con una lista ordenada de prefijos (el nombre entero y cada
+    # palabra) para el autocompletado por bisección y listas invertidas de trigramas para las
+    # erratas. Se construye una vez por carga; buscar no recorre todas las paradas.
+    def __init__(self, paradas):
+        self.paradas = list(paradas)
+        self.exactos = set(self.paradas)
+        self.normalizados = [normalizar_parada(p) for p in self.paradas]
+        self.por_normalizado = defaultdict(list)
+        prefijos = []
+        self.trigramas = []
+        self.con_trigrama = defaultdict(list)
+        for i, normalizado in enumerate(self.normalizados):
+            self.por_normalizado[normalizado].append(i)
+            palabras = normalizado.split()
+            prefijos.append((normalizado, 0, i))
+            prefijos.extend((' '.join(palabras[k:]), 1, i) for k in range(1, len(palabras)))
+            propios = trigramas(normalizado)
+            self.trigramas.append(len(propios))
+            for trigrama in propios:
+                self.con_trigrama[trigrama].append(i)
+        prefijos.sort()
+        self.prefijos = [p for p, _, _ in prefijos]
+        self.prefijos_parada = [(tipo, i) for _, tipo, i in prefijos]
+
+    def _con_prefijo(self, normalizado):
+        # {parada: 0 si el nombre empieza así, 1 si empieza así alguna de sus palabras}
+        encontradas = {}
+        for k in range(bisect_left(self.prefijos, normalizado), len(self.prefijos)):
+            if not self.prefijos[k].startswith(normalizado):
+                break
+            tipo, i = self.prefijos_parada[k]
+            encontradas[i] = min(tipo, encontradas.get(i, tipo))
+        return encontradas
+
+    def _parecidas(self, normalizado):
+        # {parada: parecido de Jaccard por trigramas}, solo de las que comparten alguno
+        propios = trigramas(normalizado)
+        comunes = defaultdict(int)
+        for trigrama in propios:
+            for i in self.con_trigrama.get(trigrama, ()):
+                comunes[i] += 1
+        return {i: n / (len(propios) + self.trigramas[i] - n) for i, n in comunes.items()}
+
+    def resolver(self, nombre):
+        # El nombre de parada que corresponde a lo escrito, o None si no hay uno claro
+        if not nombre or nombre in self.exactos:
+            return nombre or None
+        normalizado = normalizar_parada(nombre)
+        if not normalizado:
+            return None
+        exactas = self.por_normalizado.get(normalizado)
+        if exactas:
+            return self.paradas[exactas[0]] if len(exactas) == 1 else None
+        # Un prefijo que solo encaja con una parada ("cartu"), con al menos tres letras
+        con_prefijo = self._con_prefijo(normalizado) if len(normalizado) >= 3 else {}
+        if len(con_prefijo) == 1:
+            return self.paradas[next(iter(con_prefijo))]
+        ranking = sorted(self._parecidas(normalizado).items(), key=lambda par: par[1], reverse=True)
+        if ranking and ranking[0][1] >= UMBRAL_PARECIDO_PARADA and (
+                len(ranking) == 1 or ranking[0][1] - ranking[1][1] >= MARGEN_PARECIDO_PARADA):
+            return self.paradas[ranking[0][0]]
+        return None
+
+    def sugerencias(self, texto, n=8):
+        # Primero las que empiezan por lo escrito, luego alguna palabra, luego las más parecidas
+        normalizado = normalizar_parada(texto)
+        if not normalizado:
+            return []
+        con_prefijo = self._con_prefijo(normalizado)
+        parecidas = self._parecidas(normalizado)
+        candidatas = set(con_prefijo) | {i for i, parecido in parecidas.items() if parecido >= UMBRAL_PARECIDO_PARADA / 2}
+        orden = sorted(candidatas, key=lambda i: (con_prefijo.get(i, 2), -parecidas.get(i, 0.0), self.paradas[i]))
+        return [self.paradas[i] for i in orden[:n]]
+
+def filas_a_registros(df):
+    # Lo mismo que df.to_dict('records') (tipos nativos de Python) pero columna a columna: to_dict
+    # convierte valor a valor y era la mitad de la carga de una hoja grande, desde red o desde caché
+    columnas = list(df.columns)
+    return [dict(zip(columnas, fila)) for fila in zip(*(df[c].tolist() for c in columnas))]
+
+class IndiceRutas:
+    # Grafo precompilado al cargar la hoja: paradas internadas como enteros, tramos en arrays
+    # compactos y adyacencia por origen ya filtrada para cada día de la semana. Las horas son
+    # minutos desde la medianoche; la fecha solo se añade al formatear la respuesta.
+    def __init__(self, df, transbordos=None, anterior=None, filas_anteriores=None):
+        # `anterior`: índice de la versión previa de la hoja, del que se reutiliza lo que no depende
+        # de lo que ha cambiado (registros de las filas iguales según `filas_anteriores`, nombres de
+        # parada, matrices de alcance de grafos que se repiten)
+        self.paradas = []
+        self.id_parada = {}
+        self.registros = []
+        n = len(df)
+        if df.empty or 'Origen' not in df.columns or 'Destino' not in df.columns:
+            n = 0
+        origenes = df['Origen'].to_numpy() if n else []
+        destinos = df['Destino'].to_numpy() if n else []
+        self.origen = np.fromiter((self._internar(o) for o in origenes), dtype=np.int32, count=n)
+        self.destino = np.fromiter((self._internar(d) for d in destinos), dtype=np.int32, count=n)
+
+        if n and 'Dias' in df.columns:
+            dias = df['Dias'].fillna('L-D').str.strip()
+            self.mascara_dias = dias.map(MASCARAS_DIAS).fillna(0).astype('uint8').to_numpy()
+        else:
+            self.mascara_dias = np.full(n, 0b1111111, dtype=np.uint8)
+
+        tipos = df['Tipo_Horario'].to_numpy() if n and 'Tipo_Horario' in df.columns else np.full(n, '', dtype=object)
+        self.es_fijo = tipos == 'Fijo'
+        self.salida_min = parse_horas_a_minutos(df['Salida']) if n and 'Salida' in df.columns else np.full(n, -1, dtype=np.int32)
+        self.llegada_min = parse_horas_a_minutos(df['Llegada']) if n and 'Llegada' in df.columns else np.full(n, -1, dtype=np.int32)
+
+        # Un fijo que llega "antes" de salir cruza la medianoche: la llegada es del día siguiente
+        fijos_validos = self.es_fijo & (self.salida_min >= 0) & (self.llegada_min >= 0)
+        self.llegada_min[fijos_validos & (self.llegada_min < self.salida_min)] += 1440
+
+        # Registros de salida: una sola conversión a dict por carga, no por petición.
+        # Las rutas fijas llevan ya la duración calculada desde Salida/Llegada.
+        # Los de filas que no han cambiado se toman del índice anterior (nunca se modifican).
+        if n and anterior is not None and filas_anteriores is not None:
+            nuevas = np.flatnonzero(filas_anteriores < 0)
+            self.registros = [anterior.registros[k] if k >= 0 else None for k in filas_anteriores.tolist()]
+            for i, r in zip(nuevas.tolist(), filas_a_registros(df.iloc[nuevas])):
+                self.registros[i] = r
+        else:
+            nuevas = np.arange(n)
+            self.registros = filas_a_registros(df) if n else []
+        for i in nuevas[fijos_validos[nuevas]].tolist():
+            self.registros[i]['Duracion_Trayecto_Min'] = float(self.llegada_min[i] - self.salida_min[i])
+        for i in nuevas.tolist():
+            self.registros[i]['icono'] = get_icon_for_compania(self.registros[i].get('Compania'))
+
+        # Transbordos: compañía de cada tramo y minutos ya resueltos por (parada, compañías), que se
+        # van rellenando según los pide el motor
+        self.transbordos = transbordos or TablaTransbordos()
+        self.transbordo_maximo = max([TIEMPO_TRANSBORDO_MIN, *self.transbordos.reglas.values()])
+        misma_red = anterior is not None and anterior.paradas == self.paradas
+        self.nombres = anterior.nombres if misma_red else IndiceNombres(self.paradas)
+        self.compania_tramo = [r.get('Compania') if isinstance(r.get('Compania'), str) and r.get('Compania').strip() else None
+                               for r in self.registros]
+        self._minutos_transbordo = {}
+
+        # Listas Python para el bucle del motor (el acceso escalar a numpy es lento)
+        self.destinos = self.destino.tolist()
+        self.llegadas = self.llegada_min.tolist()
+        self.duraciones = [float(r.get('Duracion_Trayecto_Min') or 0) for r in self.registros]
+        self.precios = [float(r.get('Precio') or 0) for r in self.registros]
+        precios_np = np.array(self.precios, dtype=np.float64)
+
+        # Adyacencia por día en formato CSR: tramos del origen p = orden[inicio[p]:inicio[p + 1]]
+        self.adyacencia = []
+        for dia in range(7):
+            activos = np.flatnonzero((self.mascara_dias >> dia) & 1)
+            orden = activos[np.argsort(self.origen[activos], kind='stable')]
+            inicio = np.searchsorted(self.origen[orden], np.arange(len(self.paradas) + 1))
+            self.adyacencia.append((inicio, orden))
+
+        # Ventanas de servicio de los tramos de frecuencia, por (origen, destino, compañía) y por fila,
+        # y las salidas de cada fila según su Frecuencia_Min. La clave con compañía None reúne todas
+        # las compañías, para segmentos sin compañía.
+        h_primer = parse_horas_a_minutos(df['H_Primer']).tolist() if n and 'H_Primer' in df.columns else [-1] * n
+        h_ultim = parse_horas_a_minutos(df['H_Ultim']).tolist() if n and 'H_Ultim' in df.columns else [-1] * n
+        filas_por_clave = defaultdict(list)
+        self.ventanas_por_tramo = {}
+        self.salidas_frecuencia = {}
+        for t in np.flatnonzero(tipos == 'Frecuencia').tolist():
+            compania = self.registros[t].get('Compania')
+            o, d = int(self.origen[t]), int(self.destino[t])
+            filas_por_clave[(o, d, None)].append(t)
+            if pd.notna(compania) and str(compania).strip() != '':
+                filas_por_clave[(o, d, compania)].append(t)
+            intervalos = intervalos_servicio(h_primer[t], h_ultim[t])
+            if intervalos:
+                self.ventanas_por_tramo[t] = VentanasServicio(intervalos, 1)
+                self.salidas_frecuencia[t] = SalidasFrecuencia(h_primer[t], h_ultim[t],
+                                                               float(self.registros[t].get('Frecuencia_Min') or 0),
+                                                               self.mascara_dias[t])
+        self.ventanas_servicio = {
+            clave: VentanasServicio([i for t in filas for i in intervalos_servicio(h_primer[t], h_ultim[t])], len(filas))
+            for clave, filas in filas_por_clave.items()
+        }
+
+        # Servicios fijos agrupados como las anclas de siempre (origen, destino, compañía, transporte),
+        # con sus salidas ordenadas para buscar la primera alcanzable por bisección.
+        grupos_fijos = defaultdict(list)
+        ids_fijos = np.flatnonzero(fijos_validos)
+        for t in ids_fijos[np.argsort(self.salida_min[ids_fijos], kind='stable')].tolist():
+            r = self.registros[t]
+            grupos_fijos[(self.destinos[t], r.get('Compania', ''), r.get('Transporte', ''), int(self.origen[t]))].append(t)
+        self.servicios_fijos = []
+        self.tramos_flexibles = []
+        for dia in range(7):
+            servicios = defaultdict(list)
+            for (id_destino, _, _, id_origen), tramos in grupos_fijos.items():
+                del_dia = [t for t in tramos if (self.mascara_dias[t] >> dia) & 1]
+                if del_dia:
+                    llegadas, precios = self.llegada_min[del_dia], precios_np[del_dia]
+                    servicios[id_origen].append(ServicioFijo(id_destino, self.salida_min[del_dia].tolist(), del_dia,
+                                                             anclas_utiles(self.salida_min[del_dia], llegadas,
+                                                                           precios, del_dia),
+                                                             mejores_llegadas(llegadas),
+                                                             bool(precios.min() == precios.max())))
+            flexibles = defaultdict(list)
+            for t in self.adyacencia[dia][1].tolist():
+                if not self.es_fijo[t]:
+                    flexibles[int(self.origen[t])].append(t)
+            self.servicios_fijos.append(servicios)
+            self.tramos_flexibles.append(flexibles)
+
+        # Todo lo anterior se comparte entre peticiones e hilos sin copiarse: de solo lectura
+        for array in (self.origen, self.destino, self.mascara_dias, self.es_fijo, self.salida_min, self.llegada_min,
+                      *(a for par in self.adyacencia for a in par)):
+            array.setflags(write=False)
+
+        # Alcance: mínimo de tramos entre cada par de paradas. Se precalcula para cada día junto con
+        # el siguiente (lo que abarca una búsqueda de un día) y para la semana entera; otras
+        # combinaciones de días se calculan la primera vez que se piden.
+        self._saltos = {}
+        self._saltos_por_grafo = {}
+        self._lock_saltos = threading.Lock()
+        # Con las mismas paradas la clave de cada grafo es comparable: un cambio de horas no cambia
+        # el grafo y las matrices del índice anterior valen tal cual
+        self._saltos_anteriores = anterior._saltos_por_grafo if misma_red else {}
+        for dia in range(7):
+            self.saltos(mascara_dias_seguidos(dia, 2))
+        self.saltos(0b1111111)
+        self._saltos_anteriores = {}
+
+    def _internar(self, nombre):
+        id_ = self.id_parada.get(nombre)
+        if id_ is None:
+            id_ = self.id_parada[nombre] = len(self.paradas)
+            self.paradas.append(nombre)
+        return id_
+
+    def en_servicio(self, tramo, minuto):
+        # ¿Hay alguna fila de frecuencia del mismo trayecto (y compañía) en servicio a esa hora?
+        # Sin filas coincidentes no hay nada que comprobar.
+        compania = self.registros[tramo].get('Compania')
+        if not (pd.notna(compania) and str(compania).strip() != ''):
+            compania = None
+        ventanas = self.ventanas_servicio.get((int(self.origen[tramo]), self.destinos[tramo], compania))
+        return ventanas is None or ventanas.contiene(minuto)
+
+    def tramos_desde(self, id_parada, dia):
+        inicio, orden = self.adyacencia[dia]
+        return orden[inicio[id_parada]:inicio[id_parada + 1]]
+
+    def transbordo(self, tramo_llegada, tramo_salida):
+        # Minutos mínimos entre llegar con un tramo y salir con el siguiente, en la parada que los une
+        if not self.transbordos.reglas:
+            return TIEMPO_TRANSBORDO_MIN
+        clave = (self.destinos[tramo_llegada], self.compania_tramo[tramo_llegada], self.compania_tramo[tramo_salida])
+        minutos = self._minutos_transbordo.get(clave)
+        if minutos is None:
+            minutos = self._minutos_transbordo[clave] = self.transbordos.minutos(self.paradas[clave[0]], clave[1], clave[2])
+        return minutos
+
+    def saltos(self, dias):
+        # saltos[i, j]: mínimo de tramos de la parada i a la j con lo que circula algún día de la
+        # máscara `dias`; MAX_TRAMOS + 1 si no se llega. Días con el mismo grafo comparten matriz.
+        matriz = self._saltos.get(dias)
+        if matriz is None:
+            with self._lock_saltos:
+                matriz = self._saltos.get(dias)
+                if matriz is None:
+                    n = len(self.paradas)
+                    activos = (self.mascara_dias & dias) != 0
+                    directo = np.zeros((n, n), dtype=np.float32)
+                    directo[self.origen[activos], self.destino[activos]] = 1
+                    clave = np.packbits(directo.astype(bool)).tobytes()
+                    matriz = self._saltos_por_grafo.get(clave)
+                    if matriz is None:
+                        matriz = self._saltos_anteriores.get(clave)
+                        if matriz is None:
+                            matriz = calcular_saltos(directo)
+                        self._saltos_por_grafo[clave] = matriz
+                    self._saltos[dias] = matriz
+        return matriz
+
+    def intercambiadores(self, id_origen, id_destino, dias):
+        # Paradas intermedias por las que se puede ir de origen a destino sin pasar de MAX_TRAMOS,
+        # de menos a más tramos en total
+        saltos = self.saltos(dias).astype(np.int16)
+        total = saltos[id_origen, :] + saltos[:, id_destino]
+        candidatas = [p for p in np.flatnonzero(total <= MAX_TRAMOS).tolist() if p not in (id_origen, id_destino)]
+        return sorted(candidatas, key=lambda p: (total[p], self.paradas[p]))
+
+# --- Motor de Búsqueda ---
+TIEMPO_TRANSBORDO_MIN = 10
+MAX_TRAMOS = 3
+# Espera máxima a la siguiente salida de una frecuencia, o a un fijo del día siguiente
+ESPERA_MAXIMA_MIN = 180
+
+# Las horas van en una línea de tiempo absoluta: minuto 0 = medianoche del día `dia`, así que un
+# tramo de mañana sale en 1440 + HH*60 + MM. Las jornadas empiezan en [desde, desde + horizonte)
+# (su primer tramo fijo) y ninguna dura más de un día.
+ConsultaRuta = namedtuple('ConsultaRuta', ['origen', 'destino', 'dia', 'lugares_a_evitar', 'desde', 'horizonte'],
+                          defaults=(0, 1440))
+# tramos: lista de (id_tramo, salida_min, llegada_min). En jornadas solo de frecuencia no hay
+# horas fijas: salida/llegada son None y se resuelven al formatear (ahora o 07:00).
+Jornada = namedtuple('Jornada', ['tramos', 'salida', 'llegada', 'duracion', 'transbordos', 'precio'])
+
+MOTORES_BUSQUEDA = {}
+
+def encajar_hacia_atras(indice, tramos, limite, dia, desde):
+    # Horas de los tramos de frecuencia que preceden al primer tramo fijo: de atrás hacia delante,
+    # cada uno toma la última salida que llega a tiempo (`limite`, con el transbordo ya descontado)
+    # sin esperar más de ESPERA_MAXIMA_MIN, como al avanzar. None si alguno no tiene salida posible
+    # desde `desde`.
+    horas = []
+    for i in range(len(tramos) - 1, -1, -1):
+        t = tramos[i]
+        salida = limite - indice.duraciones[t]
+        salidas = indice.salidas_frecuencia.get(t)
+        if salidas is not None:
+            salida = salidas.anterior(salida, dia, max(desde, salida - ESPERA_MAXIMA_MIN))
+            if salida is None:
+                return None
+        elif salida < desde:
+            return None
+        horas.append((salida, salida + indice.duraciones[t]))
+        if i:
+            limite = salida - indice.transbordo(tramos[i - 1], t)
+    horas.reverse()
+    return horas
+
+def anclas_que_encajan(indice, servicio, base, previos, espera, duracion, dia, desde, hasta):
+    # (salida del tramo, tramo, horas de los previos) de las salidas del servicio que pueden abrir
+    # la ruta. Sin tramos previos bastan las anclas de carga. Con ellos no: una salida posterior que
+    # llega antes puede no encajar por la espera máxima, y entonces la que descartaba vuelve a
+    # contar. Se prueban todas de la última a la primera, saltando las que otra ya encajada mejora.
+    candidatas = zip(servicio.salidas, servicio.tramos) if previos else servicio.anclas
+    encajadas, llegada_minima = [], math.inf
+    for salida_ancla, t in reversed(list(candidatas)):
+        if servicio.precio_unico and indice.llegadas[t] >= llegada_minima:
+            continue
+        salida_tramo = base + salida_ancla
+        # Sin tiempo para los tramos previos y el transbordo no hay nada que encajar
+        if not desde <= salida_tramo - espera - duracion or salida_tramo >= hasta:
+            continue
+        horas = encajar_hacia_atras(indice, previos, salida_tramo - espera, dia, desde)
+        if horas is None:
+            continue
+        encajadas.append((salida_tramo, t, horas))
+        llegada_minima = min(llegada_minima, indice.llegadas[t])
+    encajadas.reverse()
+    return encajadas
+
+def registrar_motor(nombre):
+    def decorador(cls):
+        MOTORES_BUSQUEDA[nombre] = cls
+        return cls
+    return decorador
+
+class Etiqueta:
+    # Ruta parcial que llega a `parada`. Las horas son None mientras solo haya tramos de frecuencia
+    # (etiqueta "flotante"): entonces cuentan la duración acumulada, las salidas de cada tramo
+    # (`grupo`, las `clave` de sus SalidasFrecuencia) y lo que dura cada tramo y cada transbordo
+    # (`tiempos`). Con hora, `grupo` es la compañía con la que se llega si el transbordo depende de
+    # ella, o None si da igual.
+    __slots__ = ('parada', 'tramo', 'padre', 'salida', 'llegada', 'salida_tramo', 'duracion', 'n_tramos', 'precio',
+                 'grupo', 'tiempos', 'viva')
+
+    def __init__(self, parada, tramo, padre, salida, llegada, salida_tramo, duracion, n_tramos, precio,
+                 grupo=None, tiempos=()):
+        self.parada = parada
+        self.tramo = tramo
+        self.padre = padre
+        self.salida = salida
+        self.llegada = llegada
+        self.salida_tramo = salida_tramo
+        self.duracion = duracion
+        self.n_tramos = n_tramos
+        self.precio = precio
+        self.grupo = grupo
+        self.tiempos = tiempos
+        self.viva = True
+
+    def domina(self, otra):
+        # Mejor o igual en todo: salir más tarde, llegar antes, menos tramos y menos precio
+        if self.n_tramos > otra.n_tramos or self.precio > otra.precio:
+            return False
+        if self.salida is None or otra.salida is None:
+            # Al encajarlas hacia atrás cada flotante cae en las ventanas y la rejilla de salidas de
+            # sus tramos: solo se comparan con las mismas frecuencias, y entonces tramo a tramo
+            return (self.salida is None and otra.salida is None and self.grupo == otra.grupo
+                    and all(a <= b for a, b in zip(self.tiempos, otra.tiempos)))
+        # Llegar antes no sirve de nada si el transbordo que toca es más largo
+        if self.grupo is not None and self.grupo != otra.grupo:
+            return False
+        return self.salida >= otra.salida and self.llegada <= otra.llegada
+
+@registrar_motor('pareto')
+class MotorPareto:
+    # Búsqueda de llegada más temprana dependiente del tiempo, por rondas (una por tramo, estilo RAPTOR).
+    # Cada parada guarda una bolsa de etiquetas no dominadas; lo dominado se poda al generarse,
+    # así que no hace falta ningún límite de iteraciones. Devuelve el frente de Pareto en
+    # (salida, llegada, transbordos, precio) de todas las jornadas que llegan al destino.
+    # Si se pasa `estadisticas` (dict), se rellena con los contadores de la búsqueda.
+    def buscar(self, indice, consulta, estadisticas=None):
+        id_origen = indice.id_parada.get(consulta.origen)
+        id_destino = indice.id_parada.get(consulta.destino)
+        if id_origen is None or id_destino is None or id_origen == id_destino:
+            return []
+        ids_a_evitar = {indice.id_parada[l] for l in consulta.lugares_a_evitar if l in indice.id_parada}
+        dia = consulta.dia
+        fin_salidas = consulta.desde + consulta.horizonte
+        fin = fin_salidas + 1440
+        dias_anclas = range(consulta.desde // 1440, (fin_salidas - 1) // 1440 + 1)
+        # Tramos que le faltan como mínimo a cada parada para llegar al destino con los servicios
+        # de los días que abarca la búsqueda: lo que no puede llegar se poda sin expandirlo
+        dias_busqueda = range(consulta.desde // 1440, (fin - 1) // 1440 + 1)
+        faltan = indice.saltos(mascara_dias_seguidos(dia + dias_busqueda[0], len(dias_busqueda)))[:, id_destino].tolist()
+        if faltan[id_origen] > MAX_TRAMOS:
+            return []
+
+        # Con transbordos por compañía las etiquetas con hora solo se comparan entre las que llegan
+        # con la misma (en el destino ya no hay transbordo); las flotantes llevan la compañía de
+        # cada tramo junto a sus salidas
+        con_reglas = bool(indice.transbordos.reglas)
+
+        def grupo_llegada(t, parada):
+            return (indice.compania_tramo[t],) if con_reglas and parada != id_destino else None
+
+        bolsas = defaultdict(list)
+        cola = deque([Etiqueta(id_origen, -1, None, None, None, None, 0.0, 0, 0.0, (), ())])
+        contadores = {'etiquetas_generadas': 0, 'etiquetas_podadas': 0, 'etiquetas_procesadas': 0,
+                      'etiquetas_sin_alcance': 0}
+
+        def anadir(etiqueta):
+            # Poda por alcance, contra lo ya encontrado en el destino y contra la bolsa de su parada
+            contadores['etiquetas_generadas'] += 1
+            if faltan[etiqueta.parada] > MAX_TRAMOS - etiqueta.n_tramos:
+                contadores['etiquetas_sin_alcance'] += 1
+                return
+            if any(e.domina(etiqueta) for e in bolsas[id_destino]):
+                contadores['etiquetas_podadas'] += 1
+                return
+            bolsa = bolsas[etiqueta.parada]
+            if any(e.domina(etiqueta) for e in bolsa):
+                contadores['etiquetas_podadas'] += 1
+                return
+            supervivientes = []
+            for e in bolsa:
+                if etiqueta.domina(e):
+                    e.viva = False
+                else:
+                    supervivientes.append(e)
+            supervivientes.append(etiqueta)
+            bolsas[etiqueta.parada] = supervivientes
+            if etiqueta.parada != id_destino:
+                cola.append(etiqueta)
+
+        while cola:
+            etiqueta = cola.popleft()
+            if not etiqueta.viva or etiqueta.n_tramos >= MAX_TRAMOS:
+                continue
+            if etiqueta.n_tramos and etiqueta.parada in ids_a_evitar:
+                continue
+            contadores['etiquetas_procesadas'] += 1
+
+            visitadas = set()
+            previos = []
+            e = etiqueta
+            while e is not None:
+                visitadas.add(e.parada)
+                if e.padre is not None:
+                    previos.append(e.tramo)
+                e = e.padre
+            previos.reverse()
+            n_tramos = etiqueta.n_tramos + 1
+
+            def transbordo(t):
+                return indice.transbordo(etiqueta.tramo, t) if etiqueta.n_tramos else 0
+
+            if etiqueta.salida is None:
+                for t in indice.tramos_flexibles[dia].get(etiqueta.parada, ()):
+                    siguiente = indice.destinos[t]
+                    if siguiente not in visitadas:
+                        espera, duracion = transbordo(t), indice.duraciones[t]
+                        salidas = indice.salidas_frecuencia.get(t)
+                        anadir(Etiqueta(siguiente, t, etiqueta, None, None, None,
+                                        etiqueta.duracion + espera + duracion, n_tramos,
+                                        etiqueta.precio + indice.precios[t],
+                                        etiqueta.grupo + ((salidas.clave if salidas is not None else None,
+                                                           indice.compania_tramo[t] if con_reglas else None),),
+                                        etiqueta.tiempos + (espera, duracion)))
+
+                # Primer tramo fijo: cada salida útil dentro del horizonte es un ancla distinta y los
+                # tramos de frecuencia anteriores se encajan hacia atrás desde ella.
+                for k in dias_anclas:
+                    base = k * 1440
+                    for servicio in indice.servicios_fijos[(dia + k) % 7].get(etiqueta.parada, ()):
+                        siguiente = servicio.destino
+                        if siguiente in visitadas:
+                            continue
+                        # Todas las salidas de un servicio son de la misma compañía: mismo transbordo
+                        espera = transbordo(servicio.tramos[0])
+                        for salida_tramo, t, horas in anclas_que_encajan(indice, servicio, base, previos, espera,
+                                                                         etiqueta.duracion, dia, consulta.desde,
+                                                                         fin_salidas):
+                            salida = horas[0][0] if horas else salida_tramo
+                            llegada = base + indice.llegadas[t]
+                            anadir(Etiqueta(siguiente, t, etiqueta, salida, llegada, salida_tramo,
+                                            llegada - salida, n_tramos, etiqueta.precio + indice.precios[t],
+                                            grupo_llegada(t, siguiente)))
+                continue
+
+            # Con hora conocida, cada tramo toma la primera salida tras su transbordo, aunque sea ya
+            # del día siguiente (llegadas pasada la medianoche). El día en que se está listo depende
+            # del transbordo de cada tramo: se miran los días entre la llegada y el transbordo más largo.
+            k = int(etiqueta.llegada // 1440)
+            ultimo = int((etiqueta.llegada + indice.transbordo_maximo) // 1440)
+            for dia_servicio in range(k, ultimo + 1):
+                for t in indice.tramos_flexibles[(dia + dia_servicio) % 7].get(etiqueta.parada, ()):
+                    siguiente = indice.destinos[t]
+                    if siguiente in visitadas:
+                        continue
+                    listo = etiqueta.llegada + transbordo(t)
+                    if int(listo // 1440) != dia_servicio:
+                        continue
+                    hasta = min(fin, listo + ESPERA_MAXIMA_MIN)
+                    salidas = indice.salidas_frecuencia.get(t)
+                    salida_tramo = listo if salidas is None else salidas.siguiente(listo, dia, hasta)
+                    if salida_tramo is None:
+                        continue
+                    llegada = salida_tramo + indice.duraciones[t]
+                    if llegada <= fin:
+                        anadir(Etiqueta(siguiente, t, etiqueta, etiqueta.salida, llegada, salida_tramo,
+                                        llegada - etiqueta.salida, n_tramos, etiqueta.precio + indice.precios[t],
+                                        grupo_llegada(t, siguiente)))
+
+            # Los fijos del día siguiente al de estar listo solo cuentan dentro de la espera máxima
+            for dia_servicio in range(k, ultimo + 2):
+                base = dia_servicio * 1440
+                for servicio in indice.servicios_fijos[(dia + dia_servicio) % 7].get(etiqueta.parada, ()):
+                    siguiente = servicio.destino
+                    if siguiente in visitadas:
+                        continue
+                    listo = etiqueta.llegada + transbordo(servicio.tramos[0])
+                    dia_listo = int(listo // 1440)
+                    if not dia_listo <= dia_servicio <= dia_listo + 1:
+                        continue
+                    j = bisect_left(servicio.salidas, listo - base)
+                    if j == len(servicio.salidas):
+                        continue
+                    hasta = listo + ESPERA_MAXIMA_MIN - base if dia_servicio > dia_listo else None
+                    for j in salidas_utiles(servicio, j, hasta, indice.llegadas, indice.precios):
+                        t = servicio.tramos[j]
+                        llegada = base + indice.llegadas[t]
+                        if llegada > fin:
+                            continue
+                        anadir(Etiqueta(siguiente, t, etiqueta, etiqueta.salida, llegada, base + servicio.salidas[j],
+                                        llegada - etiqueta.salida, n_tramos, etiqueta.precio + indice.precios[t],
+                                        grupo_llegada(t, siguiente)))
+
+        if estadisticas is not None:
+            estadisticas.update(contadores)
+        return [self._a_jornada(indice, consulta, e) for e in bolsas[id_destino]]
+
+    def _a_jornada(self, indice, consulta, etiqueta):
+        cadena = []
+        e = etiqueta
+        while e.padre is not None:
+            cadena.append(e)
+            e = e.padre
+        cadena.reverse()
+        tramos = [(e.tramo, e.salida_tramo, e.llegada) for e in cadena]
+        # Los tramos de frecuencia previos al ancla se encajan hacia atrás desde su salida
+        ancla = next((i for i, tramo in enumerate(tramos) if tramo[1] is not None), None)
+        if ancla:
+            horas = encajar_hacia_atras(indice, [t for t, _, _ in tramos[:ancla]],
+                                        tramos[ancla][1] - indice.transbordo(tramos[ancla - 1][0], tramos[ancla][0]),
+                                        consulta.dia, consulta.desde)
+            tramos[:ancla] = [(t, salida, llegada) for (t, _, _), (salida, llegada) in zip(tramos, horas)]
+        return Jornada(tramos, etiqueta.salida, etiqueta.llegada, etiqueta.duracion,
+                       etiqueta.n_tramos - 1, etiqueta.precio)
+
+motor_busqueda = MOTORES_BUSQUEDA[os.environ.get('MOTOR_BUSQUEDA', 'pareto')]()
+
+class ResultadoMotor:
+    # Jornadas de una consulta con sus horas en arrays de minutos, para filtrar en bloque sin
+    # construir dicts. No depende de la fecha: las filas para la plantilla se guardan bajo
+    # demanda por fecha con `formateadas_de`.
+    def __init__(self, jornadas, indice):
+        self.jornadas = jornadas
+        self.flotantes = np.array([j.salida is None for j in jornadas], dtype=bool)
+        self.salidas = np.array([j.salida or 0 for j in jornadas], dtype=np.float64)
+        self.llegadas = np.array([j.llegada or 0 for j in jornadas], dtype=np.float64)
+        self.duraciones = np.array([j.duracion for j in jornadas], dtype=np.float64)
+        self.transbordos = np.array([j.transbordos for j in jornadas], dtype=np.int16)
+        self.precios = np.array([j.precio for j in jornadas], dtype=np.float64)
+        # Compañías de cada jornada, para reconocer la misma combinación por tramos distintos
+        self.companias = [tuple(indice.registros[t].get('Compania', '') for t, _, _ in j.tramos) for j in jornadas]
+        # "A tu aire": un único tramo de frecuencia, sin hora; ningún filtro horario lo descarta
+        self.a_tu_aire = np.array([len(j.tramos) == 1 and j.salida is None and
+                                   indice.registros[j.tramos[0][0]].get('Tipo_Horario') == 'Frecuencia'
+                                   for j in jornadas], dtype=bool)
+        self._formateadas = (None, [])
+
+    def formateadas_de(self, fecha):
+        fecha_formateadas, formateadas = self._formateadas
+        if fecha_formateadas != fecha:
+            formateadas = [None] * len(self.jornadas)
+            self._formateadas = (fecha, formateadas)
+        return formateadas
+
+    def horas(self, inicio_flotante):
+        # Las jornadas flotantes empiezan en `inicio_flotante` (ahora o las 07:00)
+        salidas = np.where(self.flotantes, inicio_flotante, self.salidas)
+        llegadas = np.where(self.flotantes, inicio_flotante + self.duraciones, self.llegadas)
+        return salidas, llegadas
+
+    def seleccionar(self, inicio_flotante, salida_minima=None, hora_salida_minima=None, hora_llegada_maxima=None):
+        # `salida_minima` va en la línea de tiempo de la búsqueda (ahora); las horas de los filtros
+        # son del día en que sale cada jornada, que desde ahora puede ser ya mañana
+        salidas, llegadas = self.horas(inicio_flotante)
+        inicio_dia = np.floor(salidas / 1440) * 1440
+        mascara = np.ones(len(self.jornadas), dtype=bool)
+        if salida_minima is not None:
+            mascara &= salidas >= salida_minima
+        if hora_salida_minima is not None:
+            mascara &= salidas - inicio_dia >= hora_salida_minima
+        if hora_llegada_maxima is not None:
+            mascara &= llegadas <= inicio_dia + hora_llegada_maxima
+        return np.flatnonzero(mascara | self.a_tu_aire)
+
+    def clasificar(self, seleccion, inicio_flotante, por_criterio):
+        # Quita repetidas (misma salida, llegada y compañías) y se queda con las `por_criterio`
+        # mejores por llegada, por transbordos y por precio (desempate por llegada), más las
+        # "A tu aire". Antes de formatear nada: solo se construyen las filas que se van a mostrar.
+        salidas, llegadas = self.horas(inicio_flotante)
+        vistas, unicas = set(), []
+        for i in seleccion.tolist():
+            clave = (round(salidas[i]), round(llegadas[i]), self.companias[i])
+            if clave not in vistas:
+                vistas.add(clave)
+                unicas.append(i)
+        if por_criterio <= 0 or len(unicas) <= por_criterio:
+            return unicas
+        elegidas = {i for i in unicas if self.a_tu_aire[i]}
+        elegidas.update(heapq.nsmallest(por_criterio, unicas, key=lambda i: (llegadas[i], i)))
+        elegidas.update(heapq.nsmallest(por_criterio, unicas, key=lambda i: (self.transbordos[i], llegadas[i], i)))
+        elegidas.update(heapq.nsmallest(por_criterio, unicas, key=lambda i: (self.precios[i], llegadas[i], i)))
+        return [i for i in unicas if i in elegidas]
 
 # --- Carga de Datos ---
-try:
-    headers = {"User-Agent": "Mozilla/5.0", "Cache-Control": "no-cache"}
-    response = requests.get(GOOGLE_SHEET_URL, headers=headers, timeout=15)
-    response.raise_for_status()
-    response.encoding = 'utf-8'
-    csv_content = response.text
-    csv_data_io = io.StringIO(csv_content)
-    rutas_df_global = pd.read_csv(csv_data_io, dtype=str).fillna('')
+def limpiar_hoja(csv_content):
+    rutas_df = pd.read_csv(io.StringIO(csv_content), dtype=str).fillna('')
     column_mapping = {'Parada': 'Parada_Origen', 'Parada.1': 'Parada_Destino'}
-    rutas_df_global.rename(columns=column_mapping, inplace=True)
-    rutas_df_global.columns = rutas_df_global.columns.str.strip()
-    if 'Compañía' in rutas_df_global.columns:
-        rutas_df_global.rename(columns={'Compañía': 'Compania'}, inplace=True)
+    rutas_df.rename(columns=column_mapping, inplace=True)
+    rutas_df.columns = rutas_df.columns.str.strip()
+    if 'Compañía' in rutas_df.columns:
+        rutas_df.rename(columns={'Compañía': 'Compania'}, inplace=True)
     for col in ['Duracion_Trayecto_Min', 'Frecuencia_Min']:
-        if col in rutas_df_global.columns:
-            rutas_df_global[col] = clean_minutes_column(rutas_df_global[col])
-    if 'Precio' in rutas_df_global.columns:
-        rutas_df_global['Precio'] = rutas_df_global['Precio'].astype(str).str.replace(',', '.').str.replace('€', '').str.strip()
-    rutas_df_global['Precio'] = pd.to_numeric(rutas_df_global['Precio'], errors='coerce').fillna(0)
-    print(f"✓ Datos cargados correctamente: {len(rutas_df_global)} rutas")
-except Exception as e:
-    print(f"--- ERROR CRÍTICO EN CARGA DE DATOS: {e} ---")
-    rutas_df_global = pd.DataFrame()
+        if col in rutas_df.columns:
+            rutas_df[col] = columna_minutos(rutas_df[col])
+    if 'Precio' in rutas_df.columns:
+        rutas_df['Precio'] = rutas_df['Precio'].astype(str).str.replace(',', '.').str.replace('€', '').str.strip()
+        # Vacío = gratis; un precio mal escrito queda NaN y lo rechaza validar_hoja
+        rutas_df['Precio'] = pd.to_numeric(rutas_df['Precio'], errors='coerce').where(rutas_df['Precio'] != '', 0.0)
+    else:
+        rutas_df['Precio'] = 0.0
+    return rutas_df
+
+def validar_hoja(rutas_df):
+    # Comprobaciones en bloque sobre la hoja ya limpia. Devuelve (filas válidas, rechazadas): las
+    # rechazadas no llegan al índice, en vez de quedarse con duración 0 o sin horas, y cada una se
+    # informa con su fila en la hoja (la 1 es la cabecera) y el primer motivo que falla.
+    if rutas_df.empty:
+        return rutas_df, []
+    textos = {}
+    def columna(nombre):
+        # Cada columna se pasa a texto una sola vez aunque la usen varias comprobaciones
+        if nombre not in textos:
+            textos[nombre] = (rutas_df[nombre].astype(str).str.strip() if nombre in rutas_df.columns
+                              else pd.Series('', index=rutas_df.index))
+        return textos[nombre]
+    def mal_escrita(horas):
+        return (horas != '') & pd.to_datetime(horas, format='%H:%M', errors='coerce').isna()
+    def minutos(nombre):
+        return rutas_df[nombre] if nombre in rutas_df.columns else pd.Series(0.0, index=rutas_df.index)
+    tipo = columna('Tipo_Horario')
+    fijo, frecuencia = tipo == 'Fijo', tipo == 'Frecuencia'
+    dias = columna('Dias') if 'Dias' in rutas_df.columns else pd.Series('L-D', index=rutas_df.index)
+    comprobaciones = [
+        ("Falta el origen o el destino", (columna('Origen') == '') | (columna('Destino') == '')),
+        ("Origen y destino son la misma parada", columna('Origen') == columna('Destino')),
+        ("Dias vacío o desconocido", ~dias.isin(list(MASCARAS_DIAS))),
+        ("Precio no válido", rutas_df['Precio'].isna() | (rutas_df['Precio'] < 0)),
+        ("Salida o Llegada no es una hora HH:MM",
+         fijo & (mal_escrita(columna('Salida')) | mal_escrita(columna('Llegada')) |
+                 (columna('Salida') == '') | (columna('Llegada') == ''))),
+        ("H_Primer o H_Ultim no es una hora HH:MM", frecuencia & (mal_escrita(columna('H_Primer')) | mal_escrita(columna('H_Ultim')))),
+        ("Frecuencia_Min no válida", frecuencia & ~(minutos('Frecuencia_Min') >= 0)),
+        ("Duracion_Trayecto_Min vacía o no válida", ~fijo & ~(minutos('Duracion_Trayecto_Min') > 0)),
+    ]
+    motivo = pd.Series('', index=rutas_df.index)
+    for texto, falla in comprobaciones:
+        motivo = motivo.mask((motivo == '') & falla, texto)
+    rechazo = motivo != ''
+    rechazadas = [{'fila': int(i) + 2, 'motivo': m, 'origen': o, 'destino': d}
+                  for i, m, o, d in zip(np.flatnonzero(rechazo.to_numpy()), motivo[rechazo],
+                                        columna('Origen')[rechazo], columna('Destino')[rechazo])]
+    validas = rutas_df[~rechazo].reset_index(drop=True)
+    # Lo que no se usa en su tipo de fila (la duración de un fijo sale de sus horas) no debe quedar NaN
+    for col in ['Duracion_Trayecto_Min', 'Frecuencia_Min']:
+        if col in validas.columns:
+            validas[col] = validas[col].fillna(0.0)
+    return validas, rechazadas
+
+def huellas_rutas(rutas_df):
+    # Huella del contenido de cada ruta (Origen, Destino), lo que se compara entre recargas, y las
+    # posiciones de sus filas
+    if rutas_df.empty or 'Origen' not in rutas_df.columns or 'Destino' not in rutas_df.columns:
+        return {}, {}
+    filas = pd.util.hash_pandas_object(rutas_df, index=False).to_numpy()
+    grupos = rutas_df.groupby(['Origen', 'Destino'], sort=False).indices
+    return ({ruta: hashlib.sha256(filas[posiciones].tobytes()).hexdigest()[:16] for ruta, posiciones in grupos.items()},
+            grupos)
+
+def filas_reutilizables(anterior, huellas, posiciones, n):
+    # Para cada fila, la fila idéntica del snapshot anterior (misma ruta sin cambios, mismo orden
+    # dentro de ella) o -1 si es nueva o ha cambiado
+    filas = np.full(n, -1, dtype=np.int64)
+    for ruta, huella in huellas.items():
+        if anterior.rutas.get(ruta) == huella:
+            filas[posiciones[ruta]] = anterior.posiciones_rutas[ruta]
+    return filas
+
+def diferencias_rutas(anteriores, nuevas):
+    # Rutas nuevas, eliminadas y modificadas entre dos versiones de la hoja, como "Origen → Destino"
+    formato = lambda rutas: sorted(f"{o} → {d}" for o, d in rutas)
+    return {'nuevas': formato(nuevas.keys() - anteriores.keys()),
+            'eliminadas': formato(anteriores.keys() - nuevas.keys()),
+            'modificadas': formato(r for r in nuevas.keys() & anteriores.keys() if nuevas[r] != anteriores[r])}
+
+def cargar_tabla_transbordos(anterior=None):
+    # De TRANSBORDOS_URL si está configurada, si no del CSV local (opcional). Si falla la descarga
+    # se sigue con la tabla anterior.
+    try:
+        if TRANSBORDOS_URL:
+            response = requests.get(TRANSBORDOS_URL, headers={"User-Agent": "Mozilla/5.0"}, timeout=15)
+            response.raise_for_status()
+            response.encoding = 'utf-8'
+            return TablaTransbordos(response.text)
+        if os.path.exists(TRANSBORDOS_CSV):
+            with open(TRANSBORDOS_CSV, encoding='utf-8') as f:
+                return TablaTransbordos(f.read())
+        return TablaTransbordos()
+    except Exception as e:
+        logger.warning("No se pudo cargar la tabla de transbordos: %s", e)
+        return anterior or TablaTransbordos()
+
+# --- Paquete de Horarios para el Cliente ---
+# Lo que necesita static/motor.js para buscar sin conexión, en JSON columnar: un manifiesto con la
+# versión, las constantes del motor y la tabla de transbordos, y un trozo por parada de origen con
+# sus tramos. Cada trozo se nombra por el hash de su contenido y no cambia nunca: tras una recarga
+# el service worker solo descarga los trozos que han cambiado.
+FORMATO_PAQUETE = 1
+CuerpoPaquete = namedtuple('CuerpoPaquete', ['huella', 'json', 'gzip'])
+
+def _cuerpo_paquete(datos, anteriores=None):
+    # Con los trozos del paquete anterior, uno idéntico se reutiliza sin volver a comprimirlo
+    cuerpo = json.dumps(datos, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    huella = hashlib.sha256(cuerpo).hexdigest()[:16]
+    if anteriores and huella in anteriores:
+        return anteriores[huella]
+    return CuerpoPaquete(huella, cuerpo, gzip.compress(cuerpo, mtime=0))
+
+def _numero(valor):
+    valor = float(valor)
+    return int(valor) if valor.is_integer() else valor
+
+class PaqueteHorarios:
+    # Tipos: 'F' fijo (salida/llegada en minutos, la llegada ya pasada la medianoche si cruza),
+    # 'Q' frecuencia (salida/llegada = primera y última salida, -1 sin horario; `cada` minutos) y
+    # 'O' cualquier otro tramo flexible. Los fijos sin horas válidos no se usan y no se envían.
+    COLUMNAS = ('id', 'destino', 'dias', 'tipo', 'salida', 'llegada', 'cada', 'duracion', 'precio',
+                'compania', 'transporte', 'linea')
+
+    def __init__(self, indice, version, anterior=None, filas_anteriores=None):
+        # Un origen con todas sus filas iguales y en la misma posición que en el paquete anterior
+        # tiene el mismo trozo: se reutiliza sin volver a construirlo
+        self.filas_por_origen = {indice.paradas[p]: int(n) for p, n in enumerate(np.bincount(indice.origen)) if n}
+        reutilizados = {}
+        if anterior is not None and filas_anteriores is not None:
+            en_su_sitio = filas_anteriores == np.arange(len(filas_anteriores))
+            iguales = np.bincount(indice.origen[en_su_sitio], minlength=len(indice.paradas))
+            for origen, n in self.filas_por_origen.items():
+                huella = anterior.trozo_de.get(origen)
+                if huella and anterior.filas_por_origen.get(origen) == n == iguales[indice.id_parada[origen]]:
+                    reutilizados[origen] = anterior.trozos[huella]
+        por_origen = defaultdict(lambda: {c: [] for c in self.COLUMNAS})
+        for t, r in enumerate(indice.registros):
+            if indice.paradas[indice.origen[t]] in reutilizados:
+                continue
+            salida, llegada = int(indice.salida_min[t]), int(indice.llegada_min[t])
+            if indice.es_fijo[t]:
+                if salida < 0 or llegada < 0:
+                    continue
+                tipo, cada = 'F', 0
+            else:
+                salidas = indice.salidas_frecuencia.get(t)
+                tipo = 'Q' if r.get('Tipo_Horario') == 'Frecuencia' else 'O'
+                salida, llegada, cada = (salidas.inicio, salidas.fin, salidas.cada) if salidas else (-1, -1, 0)
+            columnas = por_origen[indice.paradas[indice.origen[t]]]
+            for columna, valor in zip(self.COLUMNAS, (
+                    t, indice.paradas[indice.destinos[t]], int(indice.mascara_dias[t]), tipo, salida, llegada,
+                    _numero(cada), _numero(indice.duraciones[t]), _numero(indice.precios[t]),
+                    r.get('Compania', ''), r.get('Transporte', ''), r.get('Linea', ''))):
+                columnas[columna].append(valor)
+        self.trozos = {}
+        self.trozo_de = {}
+        for origen in self.filas_por_origen:
+            if origen in reutilizados:
+                cuerpo = reutilizados[origen]
+            elif origen in por_origen:
+                cuerpo = _cuerpo_paquete({'origen': origen, 'tramos': por_origen[origen]}, anterior and anterior.trozos)
+            else:
+                continue
+            self.trozos[cuerpo.huella] = cuerpo
+            self.trozo_de[origen] = cuerpo.huella
+        self.manifiesto = _cuerpo_paquete({
+            'formato': FORMATO_PAQUETE, 'version': version,
+            'constantes': {'transbordo_min': TIEMPO_TRANSBORDO_MIN, 'max_tramos': MAX_TRAMOS,
+                           'espera_maxima_min': ESPERA_MAXIMA_MIN, 'horizonte_h': HORIZONTE_BUSQUEDA_H,
+                           'resultados_por_criterio': RESULTADOS_POR_CRITERIO},
+            'transbordos': [[p, llegada, salida, _numero(m)] for (p, llegada, salida), m in indice.transbordos.reglas.items()],
+            'trozos': self.trozo_de})
+
+class SnapshotHorarios:
+    # Una versión completa de la hoja y todo lo derivado de ella. Nunca se modifica: cada recarga
+    # construye uno nuevo fuera de las peticiones y lo publica con una sola asignación, así que
+    # una petición que lee `snapshot_actual` una vez ve siempre datos coherentes. Con `anterior`
+    # (el snapshot en uso) se reutiliza lo derivado que no haya cambiado y se anotan las rutas
+    # que sí; `rechazadas` es el informe de validar_hoja de esta carga.
+    def __init__(self, df, huella='', etag=None, last_modified=None, transbordos=None, anterior=None, rechazadas=None):
+        self.df = df
+        self.rutas, self.posiciones_rutas = huellas_rutas(df)
+        self.cambios = diferencias_rutas(anterior.rutas, self.rutas) if anterior is not None else None
+        self.rechazadas = rechazadas or []
+        filas_anteriores = None
+        if anterior is not None and list(df.columns) == list(anterior.df.columns):
+            filas_anteriores = filas_reutilizables(anterior, self.rutas, self.posiciones_rutas, len(df))
+        self.indice = IndiceRutas(df, transbordos, anterior.indice if anterior is not None else None, filas_anteriores)
+        self.huella = huella
+        self.version = (huella[:12] or 'vacio') + (f"-{self.indice.transbordos.huella[:6]}" if self.indice.transbordos.huella else '')
+        self.etag = etag
+        self.last_modified = last_modified
+        self.cargado_en = monotonic()
+        # Lista de paradas de la portada: se ordena una vez por versión, no en cada visita
+        self.lugares = sorted(self.indice.paradas)
+        self.paquete = PaqueteHorarios(self.indice, self.version, anterior.paquete if anterior is not None else None,
+                                       filas_anteriores)
+
+    def con_cabeceras(self, huella, etag, last_modified, rechazadas):
+        # La hoja descargada es otra pero sus filas válidas son las mismas (solo han cambiado filas
+        # rechazadas, por ejemplo): se conserva todo lo derivado, y la versión con ello
+        copia = copy.copy(self)
+        copia.huella, copia.etag, copia.last_modified, copia.rechazadas = huella, etag, last_modified, rechazadas
+        copia.cambios = diferencias_rutas(self.rutas, self.rutas)
+        copia.cargado_en = monotonic()
+        return copia
+
+# --- Caché de Horarios en Disco ---
+# Fichero columnar mapeable en memoria: MAGIA + longitud de cabecera (uint32) + cabecera JSON,
+# y después un bloque alineado por columna: las numéricas en binario, las de texto como offsets
+# int64 + bytes UTF-8. Solo guarda la hoja validada: al leerla se reconstruyen el DataFrame (pandas
+# copia las columnas, no quedan vistas sobre el mmap), el IndiceRutas y el paquete del navegador,
+# así que cada worker paga casi lo mismo que una carga desde red menos la descarga y el parseo.
+MAGIA_CACHE = b'MIRUTA\x00\x00'
+FORMATO_CACHE = 2   # 2: solo filas validadas, con el informe de rechazadas en la cabecera
+ALINEACION_CACHE = 64
+
+def _alinear(n):
+    return -(-n // ALINEACION_CACHE) * ALINEACION_CACHE
+
+def guardar_cache_horarios(snapshot, ruta=CACHE_HORARIOS):
+    df = snapshot.df
+    bloques, columnas, posicion = [], [], 0
+    for nombre in df.columns:
+        serie = df[nombre]
+        if serie.dtype.kind in 'biuf':
+            datos = np.ascontiguousarray(serie.to_numpy())
+            columnas.append({'nombre': nombre, 'tipo': datos.dtype.str, 'offset': posicion})
+            bloques.append(datos.tobytes())
+        else:
+            codificados = [str(v).encode('utf-8') for v in serie.tolist()]
+            offsets = np.zeros(len(codificados) + 1, dtype='<i8')
+            np.cumsum([len(c) for c in codificados], out=offsets[1:])
+            columnas.append({'nombre': nombre, 'tipo': 'texto', 'offset': posicion,
+                             'offset_texto': posicion + _alinear(offsets.nbytes), 'bytes_texto': int(offsets[-1])})
+            bloques.append(offsets.tobytes() + b'\x00' * (_alinear(offsets.nbytes) - offsets.nbytes) + b''.join(codificados))
+        posicion += _alinear(len(bloques[-1]))
+    cabecera = json.dumps({'formato': FORMATO_CACHE, 'filas': len(df), 'columnas': columnas, 'huella': snapshot.huella,
+                           'etag': snapshot.etag, 'last_modified': snapshot.last_modified,
+                           'rechazadas': snapshot.rechazadas}).encode('utf-8')
+    inicio_datos = _alinear(len(MAGIA_CACHE) + 4 + len(cabecera))
+    temporal = f"{ruta}.{os.getpid()}.tmp"
+    with open(temporal, 'wb') as f:
+        f.write(MAGIA_CACHE + np.uint32(len(cabecera)).tobytes() + cabecera)
+        f.write(b'\x00' * (inicio_datos - f.tell()))
+        for bloque in bloques:
+            f.write(bloque + b'\x00' * (_alinear(len(bloque)) - len(bloque)))
+    # Sustitución atómica: otro worker leyendo a la vez ve el fichero viejo o el nuevo, nunca medio
+    os.replace(temporal, ruta)
+
+def leer_cache_horarios(ruta=CACHE_HORARIOS, transbordos=None):
+    # None si no hay caché o es de otro formato; nunca lanza, la red sigue siendo la fuente de verdad
+    try:
+        buffer = np.memmap(ruta, dtype=np.uint8, mode='r')
+        if bytes(buffer[:len(MAGIA_CACHE)]) != MAGIA_CACHE:
+            return None
+        largo = int(np.frombuffer(buffer, dtype='<u4', count=1, offset=len(MAGIA_CACHE))[0])
+        cabecera = json.loads(bytes(buffer[len(MAGIA_CACHE) + 4:len(MAGIA_CACHE) + 4 + largo]))
+        if cabecera.get('formato') != FORMATO_CACHE:
+            return None
+        filas = cabecera['filas']
+        inicio_datos = _alinear(len(MAGIA_CACHE) + 4 + largo)
+        datos = {}
+        for col in cabecera['columnas']:
+            offset = inicio_datos + col['offset']
+            if col['tipo'] == 'texto':
+                offsets = np.frombuffer(buffer, dtype='<i8', count=filas + 1, offset=offset).tolist()
+                inicio_texto = inicio_datos + col['offset_texto']
+                texto = bytes(buffer[inicio_texto:inicio_texto + col['bytes_texto']])
+                datos[col['nombre']] = pd.Series([texto[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(filas)], dtype=str)
+            else:
+                datos[col['nombre']] = np.frombuffer(buffer, dtype=col['tipo'], count=filas, offset=offset)
+        df = pd.DataFrame(datos, copy=False)
+        return SnapshotHorarios(df, cabecera['huella'], cabecera.get('etag'), cabecera.get('last_modified'), transbordos,
+                                rechazadas=cabecera.get('rechazadas'))
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.warning("Caché de horarios ilegible, se ignora: %s", e)
+        return None
+
+_transbordos_iniciales = cargar_tabla_transbordos()
+snapshot_actual = leer_cache_horarios(transbordos=_transbordos_iniciales) or SnapshotHorarios(pd.DataFrame(), transbordos=_transbordos_iniciales)
+_lock_recarga = threading.Lock()
+
+def recargar_horarios():
+    # Devuelve True si se ha publicado un snapshot nuevo
+    global snapshot_actual
+    with _lock_recarga:
+        actual = snapshot_actual
+        transbordos = cargar_tabla_transbordos(actual.indice.transbordos)
+        headers = {"User-Agent": "Mozilla/5.0", "Cache-Control": "no-cache"}
+        if actual.etag: headers["If-None-Match"] = actual.etag
+        if actual.last_modified: headers["If-Modified-Since"] = actual.last_modified
+        response = requests.get(GOOGLE_SHEET_URL, headers=headers, timeout=15)
+        if response.status_code != 304:
+            response.raise_for_status()
+        # Sin ETag fiable (Google no siempre lo manda) comparamos el contenido
+        huella = None if response.status_code == 304 else hashlib.sha256(response.content).hexdigest()
+        if huella is None or huella == actual.huella:
+            if transbordos.huella == actual.indice.transbordos.huella:
+                return False
+            # Misma hoja, otros transbordos: se reindexa lo que ya había
+            snapshot_actual = SnapshotHorarios(actual.df, actual.huella, actual.etag, actual.last_modified, transbordos,
+                                               actual, actual.rechazadas)
+            logger.info("Tabla de transbordos actualizada: %d reglas (versión %s)",
+                        len(transbordos.reglas), snapshot_actual.version)
+            return True
+        response.encoding = 'utf-8'
+        limpia = limpiar_hoja(response.text)
+        faltan = [c for c in COLUMNAS_OBLIGATORIAS if c not in limpia.columns]
+        if faltan:
+            raise ValueError(f"la descarga no es la hoja de horarios (faltan {', '.join(faltan)}); "
+                             f"se sigue con la versión {actual.version}")
+        df, rechazadas = validar_hoja(limpia)
+        if df.empty or len(rechazadas) > RECHAZO_MAXIMO * len(limpia):
+            raise ValueError(f"la hoja descargada solo tiene {len(df)} filas válidas de {len(limpia)}; "
+                             f"se sigue con la versión {actual.version}")
+        if rechazadas:
+            motivos = defaultdict(int)
+            for r in rechazadas:
+                motivos[r['motivo']] += 1
+            logger.warning("Filas de la hoja rechazadas: %d (%s). Detalle en /horarios/informe", len(rechazadas),
+                           ", ".join(f"{m}: {n}" for m, n in motivos.items()))
+        if (huellas_rutas(df)[0] == actual.rutas and list(df.columns) == list(actual.df.columns)
+                and transbordos.huella == actual.indice.transbordos.huella):
+            snapshot_actual = actual.con_cabeceras(huella, response.headers.get("ETag"),
+                                                   response.headers.get("Last-Modified"), rechazadas)
+            logger.info("La hoja ha cambiado pero sus filas válidas no: se conserva la versión %s", actual.version)
+            _guardar_cache_horarios_o_avisar(snapshot_actual)
+            return False
+        nuevo = SnapshotHorarios(df, huella, response.headers.get("ETag"), response.headers.get("Last-Modified"),
+                                 transbordos, actual, rechazadas)
+        snapshot_actual = nuevo
+        logger.info("Datos cargados correctamente: %d rutas, %d paradas (versión %s)",
+                    len(nuevo.df), len(nuevo.indice.paradas), nuevo.version)
+        logger.info("Cambios respecto a la versión %s: %d rutas nuevas, %d eliminadas, %d modificadas", actual.version,
+                    len(nuevo.cambios['nuevas']), len(nuevo.cambios['eliminadas']), len(nuevo.cambios['modificadas']))
+        logger.debug("Rutas cambiadas: %s", nuevo.cambios)
+        _guardar_cache_horarios_o_avisar(nuevo)
+        return True
+
+def _guardar_cache_horarios_o_avisar(snapshot):
+    try:
+        guardar_cache_horarios(snapshot)
+    except Exception as e:
+        logger.warning("No se pudo guardar la caché de horarios: %s", e)
+
+def _bucle_recarga(parada, comprobar_ya):
+    # Arrancando desde la caché en disco, la primera comprobación contra la hoja es inmediata
+    espera = 0 if comprobar_ya else INTERVALO_RECARGA_S
+    while not parada.wait(espera):
+        espera = INTERVALO_RECARGA_S
+        try:
+            recargar_horarios()
+        except Exception as e:
+            # Se mantiene el snapshot anterior; se reintenta en el siguiente ciclo
+            logger.warning("No se pudo recargar la hoja: %s", e)
+
+_recargador = None
+
+def iniciar_recargador(comprobar_ya=False):
+    # Un hilo por proceso: tras un fork el hilo del padre no existe en el hijo
+    global _recargador
+    if INTERVALO_RECARGA_S <= 0:
+        return
+    if _recargador is not None and _recargador[0] == os.getpid() and _recargador[1].is_alive():
+        return
+    hilo = threading.Thread(target=_bucle_recarga, args=(threading.Event(), comprobar_ya), name="recarga-hoja", daemon=True)
+    hilo.start()
+    _recargador = (os.getpid(), hilo)
+
+desde_cache = snapshot_actual.huella != ''
+if desde_cache:
+    logger.info("Horarios cargados desde caché local: %d rutas (versión %s)", len(snapshot_actual.df), snapshot_actual.version)
+if not desde_cache or INTERVALO_RECARGA_S <= 0:
+    try:
+        recargar_horarios()
+    except Exception as e:
+        if desde_cache:
+            logger.warning("Hoja no disponible, se usa la caché local: %s", e)
+        else:
+            logger.error("ERROR CRÍTICO EN CARGA DE DATOS: %s", e)
+if not RECARGA_SOLO_EN_WORKERS:
+    iniciar_recargador(comprobar_ya=desde_cache)
 
 # --- Carga de frases motivadoras ---
 try:
     with open("frases_motivadoras.json", "r", encoding="utf-8") as f:
         frases = json.load(f)
-    print(f"✓ Frases motivadoras cargadas: {len(frases)} frases")
+    logger.info("Frases motivadoras cargadas: %d frases", len(frases))
 except Exception as e:
-    print(f"⚠ No se pudieron cargar frases motivadoras: {e}")
+    logger.warning("No se pudieron cargar frases motivadoras: %s", e)
     frases = ["El esfuerzo de hoy es el éxito de mañana."]
+if not frases:
+    frases = ["El esfuerzo de hoy es el éxito de mañana."]
+# La lista completa no va en la portada: se sirve aparte en /frases.json, serializada una sola
+# vez y con un ETag de su contenido para que el navegador la guarde y la revalide con un 304
+frases_json = json.dumps(frases, ensure_ascii=False).encode('utf-8')
+etag_frases = hashlib.sha256(frases_json).hexdigest()[:16]
+
+# --- Caché de Búsquedas ---
+class CacheBusquedas:
+    # LRU con caducidad. La clave incluye la versión del snapshot, así que una recarga de la hoja
+    # deja las entradas viejas inalcanzables y acaban saliendo por LRU o por TTL.
+    def __init__(self, max_entradas, ttl_s):
+        self.max_entradas = max_entradas
+        self.ttl_s = ttl_s
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.expulsiones = 0
+        self.caducadas = 0
+
+    def obtener(self, clave):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None and monotonic() - entrada[0] > self.ttl_s:
+                del self._entradas[clave]
+                self.caducadas += 1
+                entrada = None
+            if entrada is None:
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[1]
+
+    def guardar(self, clave, valor):
+        if self.max_entradas <= 0:
+            return
+        with self._lock:
+            self._entradas[clave] = (monotonic(), valor)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+                self.expulsiones += 1
+
+    def estadisticas(self):
+        with self._lock:
+            return {'entradas': len(self._entradas), 'max_entradas': self.max_entradas, 'ttl_s': self.ttl_s,
+                    'aciertos': self.aciertos, 'fallos': self.fallos,
+                    'expulsiones': self.expulsiones, 'caducadas': self.caducadas}
+
+cache_busquedas = CacheBusquedas(CACHE_BUSQUEDAS_MAX, CACHE_BUSQUEDAS_TTL_S)
+
+# --- Métricas ---
+# Exposición en formato de texto de Prometheus. Cada worker de gunicorn lleva sus propias
+# métricas; el scraper las distingue por instancia.
+ETAPAS_BUSQUEDA = ('cache', 'motor', 'filtrado', 'clasificacion', 'formateo', 'render')
+LIMITES_HISTOGRAMA_S = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+class Histograma:
+    def __init__(self, limites):
+        self.limites = limites
+        self.cubos = [0] * (len(limites) + 1)
+        self.suma = 0.0
+        self.cuenta = 0
+
+    def observar(self, valor):
+        self.cubos[bisect_left(self.limites, valor)] += 1
+        self.suma += valor
+        self.cuenta += 1
+
+class Metricas:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.etapas = {etapa: Histograma(LIMITES_HISTOGRAMA_S) for etapa in ETAPAS_BUSQUEDA}
+        self.contadores = defaultdict(int)
+
+    def observar(self, etapa, segundos):
+        with self._lock:
+            self.etapas[etapa].observar(segundos)
+
+    def sumar(self, **valores):
+        with self._lock:
+            for nombre, valor in valores.items():
+                self.contadores[nombre] += valor
+
+    @contextmanager
+    def medir(self, etapa):
+        inicio = perf_counter()
+        try:
+            yield
+        finally:
+            self.observar(etapa, perf_counter() - inicio)
+
+    def exportar(self, snapshot, cache):
+        lineas = ['# HELP mi_ruta_etapa_segundos Duración de cada etapa de /buscar',
+                  '# TYPE mi_ruta_etapa_segundos histogram']
+        with self._lock:
+            for etapa, h in self.etapas.items():
+                acumulado = 0
+                for limite, n in zip([repr(l) for l in h.limites] + ['+Inf'], h.cubos):
+                    acumulado += n
+                    lineas.append(f'mi_ruta_etapa_segundos_bucket{{etapa="{etapa}",le="{limite}"}} {acumulado}')
+                lineas.append(f'mi_ruta_etapa_segundos_sum{{etapa="{etapa}"}} {h.suma:.6f}')
+                lineas.append(f'mi_ruta_etapa_segundos_count{{etapa="{etapa}"}} {h.cuenta}')
+            contadores = dict(self.contadores)
+        for nombre in sorted(contadores):
+            lineas.append(f'# TYPE mi_ruta_{nombre}_total counter')
+            lineas.append(f'mi_ruta_{nombre}_total {contadores[nombre]}')
+        estado_cache = cache.estadisticas()
+        for nombre in ('aciertos', 'fallos', 'expulsiones', 'caducadas'):
+            lineas.append(f'# TYPE mi_ruta_cache_busquedas_{nombre}_total counter')
+            lineas.append(f'mi_ruta_cache_busquedas_{nombre}_total {estado_cache[nombre]}')
+        lineas += ['# TYPE mi_ruta_cache_busquedas_entradas gauge',
+                   f'mi_ruta_cache_busquedas_entradas {estado_cache["entradas"]}',
+                   '# HELP mi_ruta_snapshot_edad_segundos Segundos desde que se cargó el snapshot de horarios en uso',
+                   '# TYPE mi_ruta_snapshot_edad_segundos gauge',
+                   f'mi_ruta_snapshot_edad_segundos {monotonic() - snapshot.cargado_en:.3f}',
+                   '# TYPE mi_ruta_snapshot_rutas gauge',
+                   f'mi_ruta_snapshot_rutas{{version="{snapshot.version}"}} {len(snapshot.df)}',
+                   '# HELP mi_ruta_snapshot_filas_rechazadas Filas de la hoja descartadas por la validación en la última carga',
+                   '# TYPE mi_ruta_snapshot_filas_rechazadas gauge',
+                   f'mi_ruta_snapshot_filas_rechazadas {len(snapshot.rechazadas)}']
+        return '\n'.join(lineas) + '\n'
+
+metricas = Metricas()
+
+# --- Procesos hijos ---
+# Con gunicorn --preload el master carga la hoja una vez y los workers la heredan por fork (páginas
+# compartidas copy-on-write). Los hilos del master no pasan al hijo: si alguno tenía cogido un lock
+# en ese momento, en el hijo quedaría cerrado para siempre, así que se recrean. Los hilos propios de
+# cada worker los arranca gunicorn.conf.py (post_fork).
+def _reiniciar_locks_tras_fork():
+    global _lock_recarga
+    _lock_recarga = threading.Lock()
+    cache_busquedas._lock = threading.Lock()
+    metricas._lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reiniciar_locks_tras_fork)
 
 # --- Rutas de la Aplicación ---
+@app.before_request
+def activar_traza():
+    # Traza de depuración solo para esta petición, para diagnosticar una consulta concreta
+    if request.args.get('traza') or request.form.get('traza') or request.headers.get('X-Traza'):
+        request.environ['mi_ruta.traza'] = _traza_peticion.set(True)
+
+@app.teardown_request
+def desactivar_traza(exc=None):
+    token = request.environ.pop('mi_ruta.traza', None)
+    if token is not None:
+        _traza_peticion.reset(token)
+
+# Portada renderizada: (clave, etag, html). Solo cambia con la versión de la hoja y con la frase
+# del día, así que se renderiza una vez por combinación y a quien ya la tiene se le responde 304.
+_portada = (None, None, None)
+
 @app.route("/")
 def index():
-    lugares = []
-    if not rutas_df_global.empty:
-        lugares = sorted(pd.concat([rutas_df_global["Origen"], rutas_df_global["Destino"]]).dropna().unique())
-    frase = random.choice(frases)
-    return render_template("index.html", lugares=lugares, frase=frase, frases=frases)
+    global _portada
+    snapshot = snapshot_actual
+    hoy = datetime.now(pytz.timezone('Europe/Madrid')).date()
+    clave = (snapshot.version, hoy)
+    portada = _portada
+    if portada[0] != clave:
+        frase = frases[hoy.toordinal() % len(frases)]
+        html = render_template("index.html", lugares=snapshot.lugares, frase=frase)
+        portada = _portada = (clave, hashlib.sha256(html.encode('utf-8')).hexdigest()[:16], html)
+    respuesta = Response(portada[2], mimetype='text/html')
+    respuesta.set_etag(portada[1])
+    respuesta.cache_control.no_cache = True
+    return respuesta.make_conditional(request)
+
+@app.route("/frases.json")
+def frases_motivadoras():
+    respuesta = Response(frases_json, mimetype='application/json')
+    respuesta.set_etag(etag_frases)
+    respuesta.cache_control.public = True
+    respuesta.cache_control.max_age = 86400
+    return respuesta.make_conditional(request)
+
+def respuesta_paquete(cuerpo, inmutable=False):
+    # JSON ya serializado (y comprimido) del paquete de horarios, con ETag por contenido
+    comprimir = 'gzip' in request.accept_encodings
+    respuesta = Response(cuerpo.gzip if comprimir else cuerpo.json, mimetype='application/json')
+    if comprimir:
+        respuesta.headers['Content-Encoding'] = 'gzip'
+    respuesta.vary.add('Accept-Encoding')
+    respuesta.set_etag(cuerpo.huella)
+    if inmutable:
+        respuesta.cache_control.public = True
+        respuesta.cache_control.max_age = 31536000
+        respuesta.cache_control.immutable = True
+    else:
+        respuesta.cache_control.no_cache = True
+    return respuesta.make_conditional(request)
+
+@app.route("/api/v1/horarios")
+def api_horarios():
+    # Manifiesto del paquete de horarios: se revalida siempre (304 si no ha cambiado la versión)
+    return respuesta_paquete(snapshot_actual.paquete.manifiesto)
+
+@app.route("/api/v1/horarios/<huella>.json")
+def api_horarios_trozo(huella):
+    cuerpo = snapshot_actual.paquete.trozos.get(huella)
+    if cuerpo is None:
+        return jsonify({'error': f"Trozo desconocido: {huella}"}), 404
+    return respuesta_paquete(cuerpo, inmutable=True)
+
+@app.route("/sw.js")
+def service_worker():
+    # Desde la raíz para que el service worker controle toda la app, no solo /static/
+    respuesta = app.send_static_file('sw.js')
+    respuesta.cache_control.no_cache = True
+    return respuesta
+
+DIAS_SEMANA = {0: "Lunes", 1: "Martes", 2: "Miércoles", 3: "Jueves", 4: "Viernes", 5: "Sábado", 6: "Domingo"}
+
+# Parámetros ya normalizados de una búsqueda (los mismos campos que el formulario de index.html).
+# Las horas van en minutos desde la medianoche del día elegido. `desde`/`horizonte` acotan las salidas que
+# busca el motor: el día elegido entero, o desde ahora hasta HORIZONTE_BUSQUEDA_H horas después.
+# `fecha` es la del día elegido: hoy o el próximo con ese día de la semana. `salida_minima` es
+# ahora (desde ahora); los filtros salir después / llegar antes son horas del día en que se sale.
+# Con `indice`, origen, destino y lugares a evitar se resuelven a nombres de parada de la hoja
+# ("santa justa" -> "Sta. Justa"); lo que no se reconoce se queda como se escribió.
+ParametrosBusqueda = namedtuple('ParametrosBusqueda', ['origen', 'destino', 'dia_seleccionado', 'dia', 'nombre_dia',
+                                                       'lugares_a_evitar', 'desde_ahora', 'inicio_flotante',
+                                                       'salida_minima', 'hora_salida_minima', 'hora_llegada_maxima',
+                                                       'desde', 'horizonte', 'now',
+                                                       'fecha'])
+
+def interpretar_busqueda(datos, indice=None):
+    origen = datos.get("origen")
+    destino = datos.get("destino")
+    if indice is not None:
+        origen = indice.nombres.resolver(origen) or origen
+        destino = indice.nombres.resolver(destino) or destino
+    tz = pytz.timezone('Europe/Madrid')
+    now_aware = datetime.now(tz)
+    now = now_aware.replace(tzinfo=None)
+
+    dia_seleccionado = str(datos.get('dia_semana_selector', 'hoy'))
+    if dia_seleccionado != 'hoy':
+        try: target_weekday = int(dia_seleccionado) % 7
+        except: target_weekday = now.weekday()
+    else:
+        target_weekday = now.weekday()
+
+    lugares_a_evitar = []
+    if datos.get('evitar_sj'): lugares_a_evitar.append('Sta. Justa')
+    if datos.get('evitar_pa'): lugares_a_evitar.append('Plz. Armas')
+    if indice is not None:
+        lugares_a_evitar = [indice.nombres.resolver(l) or l for l in lugares_a_evitar]
+    logger.debug("Lugares a evitar: %s", lugares_a_evitar)
+
+    is_desde_ahora = bool(datos.get('desde_ahora')) and dia_seleccionado == 'hoy'
+    ahora_min = minuto_del_dia(now)
+    salida_minima = ahora_min if is_desde_ahora else None
+    hora_salida_minima = hora_llegada_maxima = None
+    if datos.get('salir_despues_check'):
+        try:
+            hora_minima = time(int(datos.get('salir_despues_hora', 7)), int(datos.get('salir_despues_minuto', 0)))
+            logger.debug("Filtro salir después de: %s", hora_minima)
+            hora_salida_minima = hora_minima.hour * 60 + hora_minima.minute
+        except Exception as e:
+            logger.warning("Error aplicando filtro salir_despues: %s", e)
+    if datos.get('llegar_antes_check'):
+        try:
+            hora_maxima = time(int(datos.get('llegar_antes_hora', 9)), int(datos.get('llegar_antes_minuto', 0)))
+            logger.debug("Filtro llegar antes de: %s", hora_maxima)
+            hora_llegada_maxima = hora_maxima.hour * 60 + hora_maxima.minute
+        except Exception as e:
+            logger.warning("Error aplicando filtro llegar_antes: %s", e)
+
+    # Desde ahora, redondeado al cuarto de hora para que la caché sirva a las búsquedas cercanas
+    desde, horizonte = (int(ahora_min) // 15 * 15, HORIZONTE_BUSQUEDA_H * 60) if is_desde_ahora else (0, 1440)
+
+    return ParametrosBusqueda(origen, destino, dia_seleccionado, target_weekday, DIAS_SEMANA[target_weekday],
+                              lugares_a_evitar, is_desde_ahora, ahora_min if is_desde_ahora else 7 * 60,
+                              salida_minima, hora_salida_minima, hora_llegada_maxima, desde, horizonte, now,
+                              now.date() + timedelta(days=(target_weekday - now.weekday()) % 7))
+
+def ejecutar_busqueda(params, snapshot):
+    # Caché + motor + filtros horarios. Devuelve el ResultadoMotor y los índices de las jornadas que pasan.
+    # Lo cacheado solo depende de la hoja y la consulta (horas en minutos, sin fecha);
+    # los filtros horarios y "desde ahora" se aplican encima en cada petición.
+    clave_cache = (snapshot.version, params.origen, params.destino, params.dia,
+                   tuple(sorted(params.lugares_a_evitar)), params.desde, params.horizonte)
+    with metricas.medir('cache'):
+        resultado_motor = cache_busquedas.obtener(clave_cache)
+    if resultado_motor is None:
+        consulta = ConsultaRuta(params.origen, params.destino, params.dia, params.lugares_a_evitar,
+                                params.desde, params.horizonte)
+        estadisticas = {}
+        with metricas.medir('motor'):
+            jornadas = motor_busqueda.buscar(snapshot.indice, consulta, estadisticas)
+            resultado_motor = ResultadoMotor(jornadas, snapshot.indice)
+        metricas.sumar(busquedas_motor=1, jornadas_encontradas=len(jornadas), **estadisticas)
+        logger.debug("Jornadas no dominadas encontradas: %d (%s)", len(jornadas), estadisticas)
+        cache_busquedas.guardar(clave_cache, resultado_motor)
+    else:
+        logger.debug("Resultado de caché: %d jornadas", len(resultado_motor.jornadas))
+
+    # Filtros horarios sobre los minutos de cada jornada, antes de construir ninguna fila
+    with metricas.medir('filtrado'):
+        seleccion = resultado_motor.seleccionar(params.inicio_flotante, params.salida_minima,
+                                                params.hora_salida_minima, params.hora_llegada_maxima)
+    return resultado_motor, seleccion
 
 @app.route("/buscar", methods=["POST"])
 def buscar():
     try:
+        # Un único snapshot para toda la petición, aunque se publique otro mientras tanto
+        snapshot = snapshot_actual
         form_data = request.form.to_dict()
         origen = form_data.get("origen")
         destino = form_data.get("destino")
         
-        print(f"\n{'='*60}")
-        print(f"→ BÚSQUEDA: {origen} → {destino}")
-        print(f"  Filtros recibidos: {form_data}")
-        
-        origenes_disponibles = rutas_df_global['Origen'].unique()
-        destinos_disponibles = rutas_df_global['Destino'].unique()
-        print(f"  ¿'{origen}' existe como origen? {origen in origenes_disponibles}")
-        print(f"  ¿'{destino}' existe como destino? {destino in destinos_disponibles}")
+        logger.debug("BÚSQUEDA: %s → %s | filtros: %s", origen, destino, form_data)
         
-        if origen not in origenes_disponibles:
-            print(f"  ⚠️ PROBLEMA: '{origen}' no encontrado en orígenes")
-            print(f"  Orígenes similares: {[o for o in origenes_disponibles if origen.lower() in o.lower() or o.lower() in origen.lower()]}")
-        if destino not in destinos_disponibles:
-            print(f"  ⚠️ PROBLEMA: '{destino}' no encontrado en destinos")
-            print(f"  Destinos similares: {[d for d in destinos_disponibles if destino.lower() in d.lower() or d.lower() in destino.lower()]}")
-        
-        tz = pytz.timezone('Europe/Madrid')
-        now_aware = datetime.now(tz)
-        now = now_aware.replace(tzinfo=None)
-
-        dia_seleccionado = form_data.get('dia_semana_selector', 'hoy')
-        if dia_seleccionado != 'hoy':
-            try: target_weekday = int(dia_seleccionado)
-            except: target_weekday = now.weekday()
-        else:
-            target_weekday = now.weekday()
+        params = interpretar_busqueda(form_data, snapshot.indice)
+        if logger.isEnabledFor(logging.DEBUG):
+            for escrito, parada in ((origen, params.origen), (destino, params.destino)):
+                if parada not in snapshot.indice.id_parada:
+                    logger.debug("'%s' no encontrado en las paradas. Similares: %s", escrito,
+                                 snapshot.indice.nombres.sugerencias(escrito or ''))
+                elif parada != escrito:
+                    logger.debug("'%s' resuelto como '%s'", escrito, parada)
+        now = params.now
+        resultado_motor, seleccion = ejecutar_busqueda(params, snapshot)
 
-        dias_semana_map = {0: "Lunes", 1: "Martes", 2: "Miércoles", 3: "Jueves", 4: "Viernes", 5: "Sábado", 6: "Domingo"}
-        nombre_dia = dias_semana_map[target_weekday]
-
-        rutas_hoy_df = rutas_df_global.copy()
-        if 'Dias' in rutas_hoy_df.columns:
-            rutas_hoy_df['Dias'] = rutas_hoy_df['Dias'].fillna('L-D').str.strip()
-            is_weekday = target_weekday < 5; is_saturday = target_weekday == 5; is_sunday = target_weekday == 6
-            mask = (rutas_hoy_df['Dias'] == 'L-D') | (is_weekday & (rutas_hoy_df['Dias'] == 'L-V')) | ((is_saturday or is_sunday) & (rutas_hoy_df['Dias'] == 'S-D')) | (is_saturday & (rutas_hoy_df['Dias'] == 'S')) | (is_sunday & (rutas_hoy_df['Dias'] == 'D'))
-            rutas_hoy_df = rutas_hoy_df[mask]
-        
-        # CRÍTICO: Calcular duraciones para rutas fijas ANTES de buscar rutas
-        today_date = now.date()
-        mask_fijas = rutas_hoy_df['Tipo_Horario'] == 'Fijo'
-        if mask_fijas.any():
-            salida_times = pd.to_datetime(rutas_hoy_df.loc[mask_fijas, 'Salida'], format='%H:%M', errors='coerce').dt.time
-            llegada_times = pd.to_datetime(rutas_hoy_df.loc[mask_fijas, 'Llegada'], format='%H:%M', errors='coerce').dt.time
-            
-            salida_dt_temp = salida_times.apply(lambda t: datetime.combine(today_date, t) if pd.notna(t) else pd.NaT)
-            llegada_dt_temp = llegada_times.apply(lambda t: datetime.combine(today_date, t) if pd.notna(t) else pd.NaT)
-            
-            # Calcular duración solo donde ambos tiempos existen
-            mask_validos = salida_dt_temp.notna() & llegada_dt_temp.notna()
-            duraciones_calculadas = (llegada_dt_temp[mask_validos] - salida_dt_temp[mask_validos]).dt.total_seconds() / 60
-            
-            rutas_hoy_df.loc[mask_fijas & mask_validos, 'Duracion_Trayecto_Min'] = duraciones_calculadas
-            print(f"  ✓ Duraciones calculadas para {mask_validos.sum()} rutas fijas en rutas_hoy_df")
-        
-        lugares_a_evitar = []
-        if form_data.get('evitar_sj'): lugares_a_evitar.append('Sta. Justa')
-        if form_data.get('evitar_pa'): lugares_a_evitar.append('Plz. Armas')
-        print(f"  Lugares a evitar: {lugares_a_evitar}")
+        with metricas.medir('clasificacion'):
+            elegidas = resultado_motor.clasificar(seleccion, params.inicio_flotante, RESULTADOS_POR_CRITERIO)
+        logger.debug("Jornadas tras filtros: %d, tras clasificar: %d", len(seleccion), len(elegidas))
 
-        candidatos_plantilla = find_all_routes_intelligently(origen, destino, rutas_hoy_df, lugares_a_evitar)
-        print(f"  Candidatos encontrados: {len(candidatos_plantilla)}")
-        
-        rutas_fijas_df = rutas_hoy_df[rutas_hoy_df['Tipo_Horario'] == 'Fijo'].copy()
-        if not rutas_fijas_df.empty:
-            today_date = now.date()
-            salida_times = pd.to_datetime(rutas_fijas_df['Salida'], format='%H:%M', errors='coerce').dt.time
-            llegada_times = pd.to_datetime(rutas_fijas_df['Llegada'], format='%H:%M', errors='coerce').dt.time
-            rutas_fijas_df['Salida_dt'] = salida_times.apply(lambda t: datetime.combine(today_date, t) if pd.notna(t) else pd.NaT)
-            rutas_fijas_df['Llegada_dt'] = llegada_times.apply(lambda t: datetime.combine(today_date, t) if pd.notna(t) else pd.NaT)
-            rutas_fijas_df.dropna(subset=['Salida_dt', 'Llegada_dt'], inplace=True)
-            
-            # CORRECCIÓN CRÍTICA: Calcular Duracion_Trayecto_Min desde Salida_dt y Llegada_dt
-            rutas_fijas_df['Duracion_Trayecto_Min'] = (
-                (rutas_fijas_df['Llegada_dt'] - rutas_fijas_df['Salida_dt']).dt.total_seconds() / 60
-            )
-            print(f"  ✓ Duraciones calculadas para {len(rutas_fijas_df)} rutas fijas")
-        
-        candidatos_expandidos = []
-        if candidatos_plantilla:
-            for ruta_plantilla in candidatos_plantilla:
-                ruta_plantilla = [seg if isinstance(seg, dict) else seg.to_dict() if hasattr(seg, 'to_dict') else dict(seg) for seg in ruta_plantilla]
-                
-                if all(s.get('Tipo_Horario') == 'Frecuencia' for s in ruta_plantilla):
-                    candidatos_expandidos.append(ruta_plantilla)
-                    continue
-                indices_fijos = [i for i, seg in enumerate(ruta_plantilla) if seg.get('Tipo_Horario') == 'Fijo']
-                if not indices_fijos: continue
-                
-                idx_ancla = indices_fijos[0]
-                ancla_plantilla = ruta_plantilla[idx_ancla]
-                
-                print(f"\n  🔍 Buscando ancla: {ancla_plantilla.get('Compania')} | {ancla_plantilla.get('Origen')} → {ancla_plantilla.get('Destino')}")
-                
-                mask = (rutas_fijas_df['Origen'] == ancla_plantilla.get('Origen')) & (rutas_fijas_df['Destino'] == ancla_plantilla.get('Destino'))
-                if pd.notna(ancla_plantilla.get('Compania')) and ancla_plantilla.get('Compania') != '': 
-                    mask &= (rutas_fijas_df['Compania'] == ancla_plantilla.get('Compania'))
-                    print(f"     Filtrando por compañía: {ancla_plantilla.get('Compania')}")
-                if pd.notna(ancla_plantilla.get('Transporte')) and ancla_plantilla.get('Transporte') != '': 
-                    mask &= (rutas_fijas_df['Transporte'] == ancla_plantilla.get('Transporte'))
-                
-                posibles_anclas = rutas_fijas_df[mask]
-                print(f"     Encontradas {len(posibles_anclas)} posibles anclas")
-                
-                for idx_ancla_real, ancla_real in posibles_anclas.iterrows():
-                    print(f"       Ancla: {ancla_real.get('Compania')} | Salida: {ancla_real.get('Salida')} | Llegada: {ancla_real.get('Llegada')} | Duración: {ancla_real.get('Duracion_Trayecto_Min')} min")
-                    nueva_ruta = list(ruta_plantilla)
-                    nueva_ruta[idx_ancla] = ancla_real.to_dict()
-                    candidatos_expandidos.append(nueva_ruta)
-        
-        print(f"  Candidatos expandidos: {len(candidatos_expandidos)}")
-        
+        inicio_formateo = perf_counter()
+        formateadas = resultado_motor.formateadas_de(now.date())
         resultados_procesados = []
-        for ruta in candidatos_expandidos:
-            is_desde_ahora = form_data.get('desde_ahora') and dia_seleccionado == 'hoy'
-            resultado = calculate_route_times(ruta, is_desde_ahora, now)
+        for i in elegidas:
+            jornada = resultado_motor.jornadas[i]
+            if jornada.salida is None:
+                # Sin tramos fijos las horas dependen del momento de la consulta
+                resultado = calculate_route_times(jornada, params.desde_ahora, now, snapshot)
+            else:
+                resultado = formateadas[i]
+                if resultado is None:
+                    resultado = formateadas[i] = calculate_route_times(jornada, False, now, snapshot)
             if resultado: resultados_procesados.append(resultado)
+        metricas.observar('formateo', perf_counter() - inicio_formateo)
         
-        print(f"  Resultados procesados: {len(resultados_procesados)}")
-        
-        if len(resultados_procesados) > 10:
-            companias_encontradas = set()
-            for r in resultados_procesados:
-                ruta_companias = " → ".join([seg.get('Compania', 'N/A') for seg in r['segmentos']])
-                companias_encontradas.add(ruta_companias)
-            print(f"  Combinaciones de compañías encontradas: {len(companias_encontradas)}")
-            for combo in list(companias_encontradas)[:5]:
-                print(f"    - {combo}")
-        
-        if form_data.get('desde_ahora') and dia_seleccionado == 'hoy':
-            ahora_naive = now.replace(tzinfo=None)
-            resultados_procesados = [r for r in resultados_procesados if r['hora_llegada_final'] == 'Flexible' or (r.get('segmentos') and 'Salida_dt' in r['segmentos'][0] and r['segmentos'][0]['Salida_dt'] >= ahora_naive)]
-        
-        if form_data.get('salir_despues_check'):
-            try:
-                hora_salida = int(form_data.get('salir_despues_hora', 7))
-                minuto_salida = int(form_data.get('salir_despues_minuto', 0))
-                hora_minima = time(hora_salida, minuto_salida)
-                print(f"  Filtro salir después de: {hora_minima}")
-                resultados_procesados = [r for r in resultados_procesados if r['hora_llegada_final'] == 'Flexible' or (isinstance(r.get('hora_llegada_final'), time) and r['segmentos'][0]['Salida_dt'].time() >= hora_minima)]
-            except Exception as e:
-                print(f"  Error aplicando filtro salir_despues: {e}")
+        logger.debug("Resultados procesados: %d", len(resultados_procesados))
         
-        if form_data.get('llegar_antes_check'):
-            try:
-                hora_llegada = int(form_data.get('llegar_antes_hora', 9))
-                minuto_llegada = int(form_data.get('llegar_antes_minuto', 0))
-                hora_maxima = time(hora_llegada, minuto_llegada)
-                print(f"  Filtro llegar antes de: {hora_maxima}")
-                resultados_procesados = [r for r in resultados_procesados if r['hora_llegada_final'] == 'Flexible' or (isinstance(r.get('hora_llegada_final'), time) and r['hora_llegada_final'] <= hora_maxima)]
-            except Exception as e:
-                print(f"  Error aplicando filtro llegar_antes: {e}")
-
-        if resultados_procesados:
-            resultados_unicos = {}
-            for r in resultados_procesados:
-                companias = "-".join([seg.get('Compania', '') for seg in r['segmentos']])
-                clave = f"{r['segmentos'][0]['Salida_str']}-{r['duracion_total_str']}-{companias}"
-                if clave not in resultados_unicos:
-                    resultados_unicos[clave] = r
-            print(f"  Antes de deduplicar: {len(resultados_procesados)}, después: {len(resultados_unicos)}")
-            resultados_procesados = sorted(list(resultados_unicos.values()), key=lambda x: x.get('llegada_final_dt_obj', datetime.max))
-        
-        print(f"  ✓ Resultados finales: {len(resultados_procesados)}")
+        if len(resultados_procesados) > 10 and logger.isEnabledFor(logging.DEBUG):
+            companias_encontradas = {" → ".join(seg.get('Compania', 'N/A') for seg in r['segmentos']) for r in resultados_procesados}
+            logger.debug("Combinaciones de compañías encontradas: %d, p. ej. %s", len(companias_encontradas), list(companias_encontradas)[:5])
+
+        resultados_procesados.sort(key=lambda x: x.get('llegada_final_dt_obj', datetime.max))
+        metricas.sumar(busquedas=1, resultados_mostrados=len(resultados_procesados),
+                       resultados_descartados=len(seleccion) - len(elegidas))
+        logger.info("Búsqueda %s → %s (%s): %d resultados", params.origen, params.destino, params.nombre_dia, len(resultados_procesados))
         
-        return render_template("resultado.html", origen=origen, destino=destino, resultados=resultados_procesados, filtros=form_data, dia_semana=nombre_dia)
+        with metricas.medir('render'):
+            return render_template("resultado.html", origen=params.origen, destino=params.destino, resultados=resultados_procesados, filtros=form_data, dia_semana=params.nombre_dia)
 
     except Exception as e:
-        print(f"ERROR INESPERADO EN LA RUTA /buscar: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("ERROR INESPERADO EN LA RUTA /buscar: %s", e)
         return f"Ha ocurrido un error interno en el servidor: {e}", 500
 
-def find_all_routes_intelligently(origen, destino, df, lugares_a_evitar):
-    rutas_por_origen = defaultdict(list)
-    for _, row in df.iterrows():
-        rutas_por_origen[row['Origen']].append(row.to_dict())
-    
-    print(f"\n  🔍 Iniciando búsqueda BFS:")
-    print(f"     Lugares disponibles desde '{origen}': {len(rutas_por_origen.get(origen, []))}")
-    if origen in rutas_por_origen:
-        destinos_unicos = list(set([r['Destino'] for r in rutas_por_origen[origen]]))
-        print(f"     Destinos únicos desde '{origen}': {destinos_unicos}")
-    else:
-        print(f"     ⚠️ No hay rutas que salgan de '{origen}'")
-    
-    lugares_con_destino = [lugar for lugar, rutas in rutas_por_origen.items() 
-                          if any(r['Destino'] == destino for r in rutas)]
-    print(f"     Lugares desde donde se puede llegar a '{destino}': {lugares_con_destino}")
-    
-    rutas_encontradas = []
-    cola = [([r], {origen, r['Destino']}) for r in rutas_por_origen.get(origen, [])]
-    
-    print(f"     Cola inicial: {len(cola)} rutas")
-    
-    primeros_destinos = list(set([r['Destino'] for r in rutas_por_origen.get(origen, [])]))[:5]
-    print(f"     Explorando desde: {primeros_destinos}...")
-    
-    iteraciones = 0
-    max_iteraciones = 1000
-    
-    while cola and iteraciones < max_iteraciones:
-        iteraciones += 1
-        ruta_actual, lugares_visitados = cola.pop(0)
-        ultimo_tramo = ruta_actual[-1]
-        lugar_actual = ultimo_tramo['Destino']
-        
-        if lugar_actual == destino:
-            rutas_encontradas.append(ruta_actual)
-            continue
-            
-        if len(ruta_actual) >= 3:
-            continue
-            
-        if lugar_actual in lugares_a_evitar:
-            continue
 
-        for siguiente_tramo in rutas_por_origen.get(lugar_actual, []):
-            proximo_destino = siguiente_tramo['Destino']
-            
-            if proximo_destino in lugares_visitados:
-                continue
-            
-            nueva_ruta = ruta_actual + [siguiente_tramo]
-            nuevos_visitados = lugares_visitados | {proximo_destino}
-            cola.append((nueva_ruta, nuevos_visitados))
-    
-    print(f"     🎯 Total de rutas encontradas: {len(rutas_encontradas)}")
-    print(f"{'='*60}\n")
-    return rutas_encontradas
-
-def calculate_route_times(ruta_series_list, desde_ahora_check, now):
+def horas_tramos(jornada, inicio_flotante, indice):
+    # (salida, llegada) en minutos de cada tramo; las jornadas flotantes arrancan en `inicio_flotante`
+    if jornada.salida is not None:
+        return [(s, l) for _, s, l in jornada.tramos]
+    horas, llegada, anterior = [], None, None
+    for t, _, _ in jornada.tramos:
+        salida = inicio_flotante if llegada is None else llegada + indice.transbordo(anterior, t)
+        anterior = t
+        llegada = salida + indice.duraciones[t]
+        horas.append((salida, llegada))
+    return horas
+
+def formato_minutos(minutos):
+    minutos = int(minutos) % 1440
+    return f"{minutos // 60:02d}:{minutos % 60:02d}"
+
+def itinerario_compacto(resultado_motor, i, params, indice):
+    jornada = resultado_motor.jornadas[i]
+    a_tu_aire = bool(resultado_motor.a_tu_aire[i])
+    horas = horas_tramos(jornada, params.inicio_flotante, indice)
+    tramos = []
+    for (t, _, _), (salida, llegada) in zip(jornada.tramos, horas):
+        registro = indice.registros[t]
+        tramo = {'origen': registro.get('Origen'), 'destino': registro.get('Destino'),
+                 'compania': registro.get('Compania', ''), 'transporte': registro.get('Transporte', ''),
+                 'linea': registro.get('Linea', ''), 'tipo': registro.get('Tipo_Horario', ''),
+                 'salida': None if a_tu_aire else formato_minutos(salida),
+                 'llegada': None if a_tu_aire else formato_minutos(llegada),
+                 'duracion_min': round(llegada - salida), 'precio': indice.precios[t]}
+        minuto_servicio = params.now.hour * 60 + params.now.minute if a_tu_aire else salida % 1440
+        if tramo['tipo'] == 'Frecuencia' and not indice.en_servicio(t, minuto_servicio):
+            tramo['aviso'] = 'FUERA DE HORARIO'
+        tramos.append(tramo)
+    salida, llegada = horas[0][0], horas[-1][1]
+    return {'flexible': a_tu_aire,
+            'salida': None if a_tu_aire else formato_minutos(salida),
+            'llegada': None if a_tu_aire else formato_minutos(llegada),
+            # Minutos desde la medianoche de `fecha`; pueden pasar de 1440 o ser negativos
+            'salida_min': None if a_tu_aire else round(salida),
+            'llegada_min': None if a_tu_aire else round(llegada),
+            'duracion_min': round(llegada - salida), 'transbordos': jornada.transbordos,
+            'precio': round(jornada.precio, 2), 'tramos': tramos}
+
+@app.route("/api/v1/buscar", methods=["GET", "POST"])
+def api_buscar():
+    # Mismos parámetros que el formulario, por query string, formulario o JSON. Con formato=ndjson
+    # (en cualquiera de ellos, o Accept: application/x-ndjson) se emite un itinerario por línea,
+    # primero el que antes llega; la fecha y la versión de los horarios van en las cabeceras
+    # X-Fecha y X-Version-Horarios, a las que se refieren salida_min y llegada_min.
+    # El motor y la clasificación terminan antes de la primera línea (el frente de Pareto solo se
+    # conoce al final): lo que se va enviando según está es cada itinerario ya serializado.
+    # Con proximas=N son las N próximas salidas desde ahora, por hora de salida.
+    snapshot = snapshot_actual
+    datos = dict(request.get_json(silent=True) or request.values.to_dict())
+    if not datos.get('origen') or not datos.get('destino'):
+        return jsonify({'error': "Faltan 'origen' y/o 'destino'"}), 400
+    proximas = None
+    if datos.get('proximas') not in (None, ''):
+        try:
+            proximas = max(int(datos['proximas']), 0)
+        except (TypeError, ValueError):
+            return jsonify({'error': "'proximas' debe ser un número"}), 400
+        datos.update(desde_ahora=True, dia_semana_selector='hoy')
+    params = interpretar_busqueda(datos, snapshot.indice)
+    for parada in (params.origen, params.destino):
+        if parada not in snapshot.indice.id_parada:
+            return jsonify({'error': f"Parada desconocida: {parada}",
+                            'sugerencias': snapshot.indice.nombres.sugerencias(parada)}), 404
     try:
-        segmentos = []
-        for s in ruta_series_list:
-            if isinstance(s, dict):
-                segmentos.append(s.copy())
-            elif hasattr(s, 'to_dict'):
-                segmentos.append(s.to_dict())
-            else:
-                segmentos.append(dict(s))
-        
-        # DEBUG: Imprimir información de entrada
-        print(f"\n  🔍 DEBUG calculate_route_times:")
-        for i, seg in enumerate(segmentos):
-            print(f"    Segmento {i}: {seg.get('Compania')} | {seg.get('Origen')} → {seg.get('Destino')}")
-            print(f"      Tipo: {seg.get('Tipo_Horario')} | Duración: {seg.get('Duracion_Trayecto_Min')} min")
-            if 'Salida_dt' in seg:
-                print(f"      Salida_dt: {seg.get('Salida_dt')} | Llegada_dt: {seg.get('Llegada_dt', 'NO TIENE')}")
+        resultado_motor, seleccion = ejecutar_busqueda(params, snapshot)
+        salidas, llegadas = resultado_motor.horas(params.inicio_flotante)
+        if proximas is None:
+            elegidas = np.array(resultado_motor.clasificar(seleccion, params.inicio_flotante, RESULTADOS_POR_CRITERIO), dtype=np.intp)
+            orden = elegidas[np.argsort(llegadas[elegidas], kind='stable')]
+        else:
+            unicas = np.array(resultado_motor.clasificar(seleccion, params.inicio_flotante, 0), dtype=np.intp)
+            con_hora = unicas[~resultado_motor.a_tu_aire[unicas]]
+            orden = con_hora[np.argsort(salidas[con_hora], kind='stable')][:proximas]
+        metricas.sumar(busquedas_api=1)
+    except Exception as e:
+        logger.exception("ERROR INESPERADO EN LA RUTA /api/v1/buscar: %s", e)
+        return jsonify({'error': 'Error interno del servidor'}), 500
+
+    formato = datos.get('formato') or request.args.get('formato')
+    if formato == 'ndjson' or 'application/x-ndjson' in request.headers.get('Accept', ''):
+        def generar():
+            for i in orden:
+                yield json.dumps(itinerario_compacto(resultado_motor, i, params, snapshot.indice), ensure_ascii=False) + '\n'
+        return Response(stream_with_context(generar()), mimetype='application/x-ndjson',
+                        headers={'X-Fecha': params.fecha.isoformat(), 'X-Version-Horarios': snapshot.version})
+
+    return jsonify({'origen': params.origen, 'destino': params.destino, 'dia': params.nombre_dia,
+                    'fecha': params.fecha.isoformat(), 'version_horarios': snapshot.version,
+                    'itinerarios': [itinerario_compacto(resultado_motor, i, params, snapshot.indice) for i in orden]})
+
+@app.route("/api/v1/destinos")
+def api_destinos():
+    # Destinos alcanzables desde `origen` en como mucho MAX_TRAMOS tramos el día elegido (mismo
+    # parámetro dia_semana_selector que el formulario). Con `destino`, además, por dónde se pasa.
+    snapshot = snapshot_actual
+    indice = snapshot.indice
+    params = interpretar_busqueda(request.args, indice)
+    id_origen = indice.id_parada.get(params.origen)
+    if id_origen is None:
+        return jsonify({'error': f"Origen desconocido: {params.origen}"}), 404
+    dias = mascara_dias_seguidos(params.dia, 2)
+    saltos = indice.saltos(dias)[id_origen]
+    respuesta = {'origen': params.origen, 'dia': params.nombre_dia, 'version_horarios': snapshot.version,
+                 'destinos': [{'destino': indice.paradas[p], 'tramos_minimos': int(saltos[p])}
+                              for p in np.flatnonzero((saltos > 0) & (saltos <= MAX_TRAMOS)).tolist()]}
+    id_destino = indice.id_parada.get(params.destino)
+    if id_destino is not None:
+        respuesta['via'] = [indice.paradas[p] for p in indice.intercambiadores(id_origen, id_destino, dias)]
+    return jsonify(respuesta)
+
+@app.route("/api/v1/paradas")
+def api_paradas():
+    # Autocompletado de los selectores de la portada: ?q=texto[&n=8]. Sin tildes, mayúsculas ni
+    # abreviaturas ("sta justa"), primero las que empiezan así y luego las de nombre parecido.
+    snapshot = snapshot_actual
+    try:
+        n = min(max(int(request.args.get('n', 8)), 1), 50)
+    except ValueError:
+        return jsonify({'error': "'n' debe ser un número"}), 400
+    texto = request.args.get('q', '')
+    respuesta = jsonify({'consulta': texto, 'version_horarios': snapshot.version,
+                         'paradas': snapshot.indice.nombres.sugerencias(texto, n)})
+    respuesta.cache_control.public = True
+    respuesta.cache_control.max_age = 300
+    return respuesta
+
+@app.route("/horarios/informe")
+def informe_horarios():
+    # Resultado de la última carga de la hoja: filas rechazadas por la validación y rutas cambiadas
+    # respecto a la versión anterior (None si no había otra en esta ejecución)
+    snapshot = snapshot_actual
+    return jsonify({'version': snapshot.version, 'filas': len(snapshot.df), 'rutas': len(snapshot.rutas),
+                    'rechazadas': snapshot.rechazadas, 'cambios': snapshot.cambios})
+
+@app.route("/cache/estadisticas")
+def estadisticas_cache():
+    return jsonify(cache_busquedas.estadisticas())
+
+@app.route("/metrics")
+def exportar_metricas():
+    return Response(metricas.exportar(snapshot_actual, cache_busquedas), mimetype="text/plain; version=0.0.4")
+
+def calculate_route_times(jornada, desde_ahora_check, now, snapshot):
+    try:
+        indice = snapshot.indice
+        segmentos = [indice.registros[t].copy() for t, _, _ in jornada.tramos]
+        # Transbordo mínimo para tomar cada tramo desde el anterior (lo que muestra la plantilla)
+        for i in range(1, len(segmentos)):
+            segmentos[i]['Transbordo_Min'] = indice.transbordo(jornada.tramos[i - 1][0], jornada.tramos[i][0])
         
-        TIEMPO_TRANSBORDO = timedelta(minutes=10)
+        if logger.isEnabledFor(logging.DEBUG):
+            for i, seg in enumerate(segmentos):
+                logger.debug("Segmento %d: %s | %s → %s | %s | %s min", i, seg.get('Compania'), seg.get('Origen'),
+                             seg.get('Destino'), seg.get('Tipo_Horario'), seg.get('Duracion_Trayecto_Min'))
         
         # Caso especial: ruta de un solo segmento con frecuencia
         if len(segmentos) == 1 and segmentos[0].get('Tipo_Horario') == 'Frecuencia':
@@ -356,27 +1906,14 @@ def calculate_route_times(ruta_series_list, desde_ahora_check, now):
             duracion = timedelta(minutes=dur_min)
             seg_dict = segmentos[0].copy()
             seg_dict.update({
-                'icono': get_icon_for_compania(seg_dict.get('Compania')), 
                 'Salida_str': "A tu aire", 
                 'Llegada_str': "", 
                 'Duracion_Tramo_Min': dur_min, 
                 'Salida_dt': now
             })
-            h_primer_str = seg_dict.get('H_Primer', '')
-            h_ultim_str = seg_dict.get('H_Ultim', '')
-            if h_primer_str and h_ultim_str:
-                try:
-                    h_primer = datetime.strptime(h_primer_str, '%H:%M').time()
-                    h_ultim = datetime.strptime(h_ultim_str, '%H:%M').time()
-                    hora_actual = now.time()
-                    if h_primer > h_ultim:
-                        if not (hora_actual >= h_primer or hora_actual <= h_ultim):
-                            seg_dict['aviso_horario'] = 'FUERA DE HORARIO'
-                    else:
-                        if not (h_primer <= hora_actual <= h_ultim):
-                            seg_dict['aviso_horario'] = 'FUERA DE HORARIO'
-                except: 
-                    pass
+            ventana = indice.ventanas_por_tramo.get(jornada.tramos[0][0])
+            if ventana and not ventana.contiene(minuto_del_dia(now)):
+                seg_dict['aviso_horario'] = 'FUERA DE HORARIO'
             return {
                 "segmentos": [seg_dict], 
                 "precio_total": float(seg_dict.get('Precio', 0)), 
@@ -385,134 +1922,37 @@ def calculate_route_times(ruta_series_list, desde_ahora_check, now):
                 "duracion_total_str": format_timedelta(duracion)
             }
 
-        # Encontrar índice ancla (primer segmento con horario fijo)
-        anchor_index = next((i for i, s in enumerate(segmentos) if 'Salida_dt' in s and pd.notna(s.get('Salida_dt'))), -1)
-        
-        print(f"    Ancla encontrada en índice: {anchor_index}")
-        
-        if anchor_index != -1:
-            # PASO 1: Asegurar que el ancla tiene Llegada_dt
-            if 'Llegada_dt' not in segmentos[anchor_index] or pd.isna(segmentos[anchor_index].get('Llegada_dt')):
-                dur_min_ancla = float(segmentos[anchor_index].get('Duracion_Trayecto_Min', 0))
-                dur_ancla = timedelta(minutes=dur_min_ancla)
-                segmentos[anchor_index]['Llegada_dt'] = segmentos[anchor_index]['Salida_dt'] + dur_ancla
-                print(f"    Calculada Llegada_dt para ancla: {segmentos[anchor_index]['Llegada_dt']}")
-            
-            # PASO 2: Calcular hacia atrás desde el ancla
-            llegada_siguiente_dt = segmentos[anchor_index]['Salida_dt']
-            for i in range(anchor_index - 1, -1, -1):
-                dur_min = float(segmentos[i].get('Duracion_Trayecto_Min', 0))
-                dur = timedelta(minutes=dur_min)
-                segmentos[i]['Llegada_dt'] = llegada_siguiente_dt - TIEMPO_TRANSBORDO
-                segmentos[i]['Salida_dt'] = segmentos[i]['Llegada_dt'] - dur
-                print(f"    Seg {i} (hacia atrás): Salida {segmentos[i]['Salida_dt']} → Llegada {segmentos[i]['Llegada_dt']}")
-                llegada_siguiente_dt = segmentos[i]['Salida_dt']
-            
-            # PASO 3: Calcular hacia adelante desde el ancla
-            llegada_anterior_dt = segmentos[anchor_index]['Llegada_dt']
-            print(f"    Iniciando propagación hacia adelante desde llegada del ancla: {llegada_anterior_dt}")
-            
-            for i in range(anchor_index + 1, len(segmentos)):
-                dur_min = float(segmentos[i].get('Duracion_Trayecto_Min', 0))
-                dur = timedelta(minutes=dur_min)
-                
-                print(f"    Seg {i}: Duración extraída = {dur_min} min → {dur}")
-                
-                if pd.notna(llegada_anterior_dt):
-                    segmentos[i]['Salida_dt'] = llegada_anterior_dt + TIEMPO_TRANSBORDO
-                    segmentos[i]['Llegada_dt'] = segmentos[i]['Salida_dt'] + dur
-                    print(f"    Seg {i} (hacia adelante): Salida {segmentos[i]['Salida_dt']} → Llegada {segmentos[i]['Llegada_dt']}")
-                    llegada_anterior_dt = segmentos[i]['Llegada_dt']
-                else:
-                    segmentos[i]['Salida_dt'] = pd.NaT
-                    segmentos[i]['Llegada_dt'] = pd.NaT
-                    llegada_anterior_dt = pd.NaT
-                    print(f"    Seg {i}: NaT (llegada_anterior_dt era NaT)")
+        if jornada.salida is not None:
+            # El motor ya ha fijado todas las horas (minutos desde la medianoche del día de hoy)
+            medianoche = datetime.combine(now.date(), time(0, 0))
+            for seg, (_, salida_min, llegada_min) in zip(segmentos, jornada.tramos):
+                seg['Salida_dt'] = medianoche + timedelta(minutes=salida_min)
+                seg['Llegada_dt'] = medianoche + timedelta(minutes=llegada_min)
         else: 
             # Sin ancla: calcular desde el inicio
             llegada_anterior_dt = None
             start_time = now if desde_ahora_check else datetime.combine(now.date(), time(7, 0))
             
             for i, seg in enumerate(segmentos):
-                dur_min = float(seg.get('Duracion_Trayecto_Min', 0))
-                dur = timedelta(minutes=dur_min)
-                
-                if i == 0:
-                    seg['Salida_dt'] = start_time
-                elif pd.notna(llegada_anterior_dt):
-                    seg['Salida_dt'] = llegada_anterior_dt + TIEMPO_TRANSBORDO
-                else:
-                    seg['Salida_dt'] = pd.NaT
-                
-                if pd.notna(seg.get('Salida_dt')):
-                    seg['Llegada_dt'] = seg['Salida_dt'] + dur
-                else:
-                    seg['Llegada_dt'] = pd.NaT
-                
-                llegada_anterior_dt = seg.get('Llegada_dt')
-        
-        # Validar que todos los segmentos tienen tiempos
-        if any(pd.isna(s.get('Salida_dt')) or pd.isna(s.get('Llegada_dt')) for s in segmentos):
-            print("    ⚠️ Ruta descartada: algún segmento tiene NaT")
-            return None
+                dur = timedelta(minutes=indice.duraciones[jornada.tramos[i][0]])
+                seg['Salida_dt'] = start_time if i == 0 else llegada_anterior_dt + timedelta(minutes=seg['Transbordo_Min'])
+                seg['Llegada_dt'] = seg['Salida_dt'] + dur
+                llegada_anterior_dt = seg['Llegada_dt']
 
         primera_salida_dt = segmentos[0]['Salida_dt']
         segmentos_formateados = []
         
-        for seg in segmentos:
-            seg_dict = seg.copy()
+        for seg, (tramo, _, _) in zip(segmentos, jornada.tramos):
+            seg_dict = seg  # ya es una copia del registro del índice
             salida_dt = seg['Salida_dt']
             
-            # Validar horarios de frecuencia MEJORADO
-            if seg.get('Tipo_Horario') == 'Frecuencia':
-                hora_salida = salida_dt.time()
-                
-                # Buscar filas coincidentes en la BD original
-                rutas_coincidentes = rutas_df_global[
-                    (rutas_df_global['Origen'] == seg.get('Origen')) &
-                    (rutas_df_global['Destino'] == seg.get('Destino')) &
-                    (rutas_df_global['Tipo_Horario'] == 'Frecuencia')
-                ]
-                
-                # Si hay compañía específica, filtrar también
-                if pd.notna(seg.get('Compania')) and str(seg.get('Compania')).strip() != '':
-                    rutas_coincidentes = rutas_coincidentes[
-                        rutas_df_global['Compania'] == seg.get('Compania')
-                    ]
-                
-                dentro_de_horario = False
-                
-                # Validar contra todos los rangos encontrados
-                for _, ruta in rutas_coincidentes.iterrows():
-                    h_primer_str = ruta.get('H_Primer', '')
-                    h_ultim_str = ruta.get('H_Ultim', '')
-                    
-                    if h_primer_str and h_ultim_str:
-                        try:
-                            h_primer = datetime.strptime(str(h_primer_str), '%H:%M').time()
-                            h_ultim = datetime.strptime(str(h_ultim_str), '%H:%M').time()
-                            
-                            # Rango que cruza medianoche
-                            if h_primer > h_ultim:
-                                if hora_salida >= h_primer or hora_salida <= h_ultim:
-                                    dentro_de_horario = True
-                                    break
-                            # Rango normal
-                            else:
-                                if h_primer <= hora_salida <= h_ultim:
-                                    dentro_de_horario = True
-                                    break
-                        except:
-                            pass
-                
-                # Solo marcar si encontramos rutas coincidentes pero ninguna cubre la hora
-                if not dentro_de_horario and rutas_coincidentes.shape[0] > 0:
-                    seg_dict['aviso_horario'] = 'FUERA DE HORARIO'
+            # Validar horarios de frecuencia contra las ventanas precalculadas del índice
+            if seg.get('Tipo_Horario') == 'Frecuencia' and not indice.en_servicio(tramo, minuto_del_dia(salida_dt)):
+                seg_dict['aviso_horario'] = 'FUERA DE HORARIO'
             
             seg_dict.update({
-                'icono': get_icon_for_compania(seg_dict.get('Compania')), 
-                'Salida_str': salida_dt.strftime('%H:%M'), 
-                'Llegada_str': seg['Llegada_dt'].strftime('%H:%M'), 
+                'Salida_str': formato_hora(salida_dt, now.date()), 
+                'Llegada_str': formato_hora(seg['Llegada_dt'], now.date()), 
                 'Duracion_Tramo_Min': (seg['Llegada_dt'] - salida_dt).total_seconds() / 60,
                 'Salida_dt': salida_dt
             })
@@ -521,8 +1961,6 @@ def calculate_route_times(ruta_series_list, desde_ahora_check, now):
         llegada_final_dt_obj = segmentos[-1]['Llegada_dt']
         precio_total = sum(float(s.get('Precio', 0)) for s in segmentos)
 
-        print(f"    ✓ Ruta válida generada\n")
-        
         return {
             "segmentos": segmentos_formateados,
             "precio_total": precio_total,
@@ -531,9 +1969,7 @@ def calculate_route_times(ruta_series_list, desde_ahora_check, now):
             "duracion_total_str": format_timedelta(llegada_final_dt_obj - primera_salida_dt)
         }
     except Exception as e:
-        print(f"ERROR en calculate_route_times: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("ERROR en calculate_route_times: %s", e)
         return None
 
 if __name__ == "__main__":
@@ -0,0 +1,227 @@
+# Banco de pruebas de rendimiento de /buscar con horarios sintéticos.
+#
+#   python benchmark.py                       # escalas 1x, 10x y 100x
+#   python benchmark.py --escalas 1,10 --consultas 100 --json resultados.json
+#
+# Genera una hoja con las mismas columnas que la de Google Sheets, la sirve por HTTP local para
+# que la carga pase por el camino real (recargar_horarios → limpiar_hoja → IndiceRutas) y lanza
+# búsquedas completas con el cliente de pruebas de Flask, plantilla incluida. Para cada escala
+# mide la carga, los percentiles de latencia sin caché y con caché, y el pico de memoria.
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import perf_counter
+
+import numpy as np
+
+COLUMNAS_HOJA = ['Origen', 'Parada', 'Destino', 'Parada', 'Tipo_Horario', 'Salida', 'Llegada', 'H_Primer', 'H_Ultim',
+                 'Frecuencia_Min', 'Duracion_Trayecto_Min', 'Dias', 'Compañía', 'Transporte', 'Linea', 'Precio', 'Observaciones']
+DIAS_HOJA = ['L-D', 'L-D', 'L-V', 'L-V', 'S-D', 'S', 'D', '']
+TRANSPORTES = [('Renfe', 'Tren'), ('Consorcio', 'Bus'), ('Damas', 'Bus'), ('Metro', 'Metro'),
+               ('Emtusa urbano', 'Bus'), ('Tussam', 'Bus'), ('Coche particular', 'Coche')]
+
+# Una escala 1x se parece a la hoja actual: unas 12 paradas, media docena de compañías y unos
+# cientos de filas. Cada factor multiplica paradas, compañías y salidas fijas.
+PARADAS_BASE = 12
+CORREDORES_BASE = 10
+ENLACES_FRECUENCIA_BASE = 8
+
+def hora(minutos):
+    minutos %= 1440
+    return f"{minutos // 60:02d}:{minutos % 60:02d}"
+
+def duracion(minutos):
+    return f"{minutos // 60}:{minutos % 60:02d}"
+
+def precio(rnd):
+    return f"{rnd.choice([0, 1.35, 1.40, 1.55, 1.80, 2.10, 3.25]):.2f}".replace('.', ',') + ' €'
+
+def generar_hoja(escala, semilla=1):
+    # CSV con el formato de la hoja publicada (dos columnas "Parada", horas HH:MM, duraciones H:MM,
+    # precios con coma y €). Devuelve el texto, todas las paradas y las del núcleo mejor conectado.
+    rnd = random.Random(semilla * 1000 + escala)
+    paradas = [f"Parada {i}" for i in range(PARADAS_BASE * escala)]
+    nucleo = paradas[:max(4, len(paradas) // 6)]
+    filas = []
+
+    # Corredores con salidas fijas entre pares de paradas, con ida y vuelta
+    for c in range(CORREDORES_BASE * escala):
+        origen, destino = rnd.sample(paradas if c % 3 else nucleo, 2)
+        compania, transporte = rnd.choice(TRANSPORTES[:4])
+        compania = f"{compania} {c % (6 * escala)}" if escala > 1 else compania
+        minutos = rnd.randint(8, 50)
+        dias = rnd.choice(DIAS_HOJA)
+        intervalo = rnd.choice([20, 30, 45, 60])
+        for a, b in ((origen, destino), (destino, origen)):
+            for salida in range(6 * 60 + rnd.randint(0, 30), 23 * 60, intervalo):
+                filas.append([a, 'Estación', b, 'Estación', 'Fijo', hora(salida), hora(salida + minutos), '', '', '',
+                              '', dias, compania, transporte, f"L{c}", precio(rnd), ''])
+
+    # Enlaces por frecuencia (metro, urbano, coche), alguno con servicio nocturno que cruza medianoche
+    for e in range(ENLACES_FRECUENCIA_BASE * escala):
+        origen, destino = rnd.sample(nucleo if e % 2 else paradas, 2)
+        compania, transporte = rnd.choice(TRANSPORTES[3:])
+        minutos = rnd.randint(5, 40)
+        filas.append([origen, '', destino, '', 'Frecuencia', '', '', '06:30', '23:00', duracion(rnd.choice([10, 15, 20])),
+                      duracion(minutos), 'L-D', compania, transporte, '', precio(rnd), ''])
+        if rnd.random() < 0.3:
+            filas.append([origen, '', destino, '', 'Frecuencia', '', '', '23:30', '01:30', '0:30',
+                          duracion(minutos), rnd.choice(['S-D', 'L-D']), compania, transporte, '', precio(rnd), 'Nocturno'])
+
+    salida = io.StringIO()
+    escritor = csv.writer(salida)
+    escritor.writerow(COLUMNAS_HOJA)
+    escritor.writerows(filas)
+    return salida.getvalue(), paradas, nucleo
+
+def generar_consultas(paradas, nucleo, n, semilla=1):
+    # Pares distintos para que la primera pasada no acierte en la caché de búsquedas. La mitad
+    # dentro del núcleo, que es donde salen más combinaciones y más trabajo para el motor.
+    rnd = random.Random(semilla)
+    vistas, consultas = set(), []
+    intentos = 0
+    while len(consultas) < n and intentos < n * 20:
+        intentos += 1
+        origen, destino = rnd.sample(nucleo if intentos % 2 else paradas, 2)
+        dia = str(rnd.randrange(7))
+        if (origen, destino, dia) in vistas:
+            continue
+        vistas.add((origen, destino, dia))
+        datos = {'origen': origen, 'destino': destino, 'dia_semana_selector': dia}
+        if rnd.random() < 0.25:
+            datos.update(salir_despues_check='on', salir_despues_hora=str(rnd.randint(6, 14)), salir_despues_minuto='0')
+        if rnd.random() < 0.15:
+            datos.update(llegar_antes_check='on', llegar_antes_hora=str(rnd.randint(12, 22)), llegar_antes_minuto='0')
+        consultas.append(datos)
+    return consultas
+
+class ServidorHoja:
+    # Sirve el CSV actual en 127.0.0.1 con ETag, como haría Google Sheets
+    def __init__(self):
+        self.contenido = b''
+        servidor = self
+
+        class Manejador(BaseHTTPRequestHandler):
+            def do_GET(self):
+                etag = f'"{hash(servidor.contenido) & 0xffffffff:x}"'
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/csv; charset=utf-8')
+                self.send_header('Content-Length', str(len(servidor.contenido)))
+                self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(servidor.contenido)
+
+            def log_message(self, *args):
+                pass
+
+        self.http = ThreadingHTTPServer(('127.0.0.1', 0), Manejador)
+        threading.Thread(target=self.http.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.http.server_port}/hoja.csv"
+
+def percentiles(tiempos_s):
+    ms = np.asarray(tiempos_s) * 1000
+    if len(ms) == 0:
+        return {}
+    p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+    return {'p50_ms': round(p50, 2), 'p90_ms': round(p90, 2), 'p99_ms': round(p99, 2),
+            'max_ms': round(float(ms.max()), 2), 'media_ms': round(float(ms.mean()), 2)}
+
+def lanzar(cliente, consultas):
+    tiempos, errores = [], 0
+    for datos in consultas:
+        inicio = perf_counter()
+        respuesta = cliente.post('/buscar', data=datos)
+        tiempos.append(perf_counter() - inicio)
+        if respuesta.status_code != 200:
+            errores += 1
+    return tiempos, errores
+
+def medir_escala(app_mod, servidor, escala, n_consultas, semilla):
+    csv_hoja, paradas, nucleo = generar_hoja(escala, semilla)
+    servidor.contenido = csv_hoja.encode('utf-8')
+    consultas = generar_consultas(paradas, nucleo, n_consultas + 5, semilla)
+    calentamiento, consultas = consultas[:5], consultas[5:]
+    cliente = app_mod.app.test_client()
+
+    inicio = perf_counter()
+    app_mod.recargar_horarios()
+    carga_s = perf_counter() - inicio
+    snapshot = app_mod.snapshot_actual
+    lanzar(cliente, calentamiento)   # plantillas compiladas y rutas de código en caliente
+
+    frios, errores = lanzar(cliente, consultas)
+    calientes, _ = lanzar(cliente, consultas)
+
+    # Memoria en una pasada aparte: tracemalloc ralentiza y falsearía las latencias
+    servidor.contenido += b'\n'   # otra huella: snapshot y caché de búsquedas nuevos
+    tracemalloc.start()
+    app_mod.recargar_horarios()
+    _, pico_carga = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    lanzar(cliente, consultas)
+    _, pico_busquedas = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'escala': escala, 'filas': len(snapshot.df), 'paradas': len(snapshot.indice.paradas),
+            'consultas': len(consultas), 'errores': errores, 'carga_s': round(carga_s, 3),
+            'sin_cache': percentiles(frios), 'con_cache': percentiles(calientes),
+            'pico_carga_mb': round(pico_carga / 2**20, 1), 'pico_busquedas_mb': round(pico_busquedas / 2**20, 1),
+            'rss_max_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+
+def imprimir(resultados):
+    cabecera = (f"{'escala':>6} {'filas':>7} {'paradas':>7} {'carga_s':>8} | {'p50':>7} {'p90':>7} {'p99':>7} {'max':>7}"
+                f" | {'p50 cache':>9} | {'pico carga':>10} {'pico busq':>9} {'rss max':>8}")
+    print(cabecera)
+    print('-' * len(cabecera))
+    for r in resultados:
+        frio, caliente = r['sin_cache'], r['con_cache']
+        print(f"{str(r['escala']) + 'x':>6} {r['filas']:>7} {r['paradas']:>7} {r['carga_s']:>8.3f} |"
+              f" {frio['p50_ms']:>7.1f} {frio['p90_ms']:>7.1f} {frio['p99_ms']:>7.1f} {frio['max_ms']:>7.1f} |"
+              f" {caliente['p50_ms']:>9.1f} | {r['pico_carga_mb']:>8.1f}MB {r['pico_busquedas_mb']:>7.1f}MB"
+              f" {r['rss_max_mb']:>6.1f}MB" + (f"  ({r['errores']} errores)" if r['errores'] else ''))
+    print("Latencias en ms por petición /buscar completa; 'p50 cache' repite las mismas consultas.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Rendimiento de /buscar con horarios sintéticos")
+    parser.add_argument('--escalas', default='1,10,100', help="factores de tamaño separados por comas")
+    parser.add_argument('--consultas', type=int, default=200, help="búsquedas distintas por escala")
+    parser.add_argument('--semilla', type=int, default=1)
+    parser.add_argument('--json', help="guarda los resultados en este fichero para compararlos entre versiones")
+    args = parser.parse_args()
+
+    servidor = ServidorHoja()
+    directorio = tempfile.mkdtemp(prefix='mi-ruta-bench-')
+    # La app carga la hoja al importarse: se apunta al servidor local, sin recarga en segundo
+    # plano y con una caché en disco desechable para no pisar la real.
+    os.environ['GOOGLE_SHEET_URL'] = servidor.url
+    os.environ['INTERVALO_RECARGA_S'] = '0'
+    os.environ['CACHE_HORARIOS'] = os.path.join(directorio, 'horarios_cache.bin')
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    # Hoja inicial distinta de todas las medidas, para que cada escala haga una carga completa
+    servidor.contenido = (','.join(COLUMNAS_HOJA) + '\n').encode('utf-8')
+    import app as app_mod
+
+    resultados = []
+    for escala in [int(e) for e in args.escalas.split(',') if e.strip()]:
+        print(f"Escala {escala}x...", file=sys.stderr, flush=True)
+        resultados.append(medir_escala(app_mod, servidor, escala, args.consultas, args.semilla))
+    imprimir(resultados)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+# Configuración de producción de gunicorn (se lee sola desde el directorio de trabajo).
+#
+# La hoja se descarga e indexa una sola vez en el master (preload_app) y los workers la heredan
+# por fork. Cada worker atiende varias peticiones a la vez con hilos, así que un cliente lento no
+# bloquea a los demás; el trabajo de CPU escala con el número de workers (WEB_CONCURRENCY).
+import os
+
+# El master no sirve peticiones: que no compruebe la hoja, lo hace cada worker (post_fork)
+os.environ.setdefault("RECARGA_SOLO_EN_WORKERS", "1")
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+preload_app = True
+workers = int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1))
+worker_class = "gthread"
+# Las búsquedas son CPU con el GIL: más hilos no dan más peticiones por segundo (y alargan la cola
+# de latencia) pero cada petición a medio recibir ocupa un hilo. Con 16 clientes rápidos y 4 que
+# mandan el cuerpo en dos trozos (python loadtest.py --workers 1 --hilos 1,2,4 --lentos 4), un
+# worker sirve 17 req/s con 1 o 2 hilos y 35 con 4; sin clientes lentos, 150-160 con 1, 2 o 4.
+# Hay que subirlo si se esperan más clientes lentos a la vez que hilos por worker.
+threads = int(os.environ.get("GUNICORN_THREADS", 4))
+timeout = 30
+keepalive = 5
+accesslog = os.environ.get("GUNICORN_ACCESSLOG")
+
+def post_fork(server, worker):
+    # Los hilos del master (escritura del registro) no existen en el worker. El snapshot heredado
+    # puede venir de la caché en disco o de un master arrancado hace horas (workers que se
+    # relanzan): la primera comprobación de la hoja es inmediata, no tras INTERVALO_RECARGA_S.
+    import app
+    app.iniciar_registro()
+    app.iniciar_recargador(comprobar_ya=True)
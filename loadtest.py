@@ -0,0 +1,176 @@
+# Prueba de carga de /buscar contra gunicorn de verdad, comparando dos modos de servir:
+#
+#   antes:   gunicorn app:app con la configuración por defecto (workers síncronos, sin preload)
+#   actual:  gunicorn -c gunicorn.conf.py app:app (preload + workers gthread)
+#
+#   python loadtest.py                          # 20 s por modo, 16 clientes, escala 10x
+#   python loadtest.py --segundos 10 --clientes 32 --escala 1 --modos actual
+#   python loadtest.py --workers 4 --hilos 1,2,4 --lentos 8
+#
+# La hoja sintética de benchmark.py se sirve por HTTP local; cada modo arranca en un directorio
+# temporal propio con su caché de horarios, así que todos cargan la hoja desde cero. Los dos modos
+# usan el mismo número de workers (--workers, por defecto WEB_CONCURRENCY o los núcleos) para que
+# la comparación sea de configuración y no de procesos: con un solo núcleo no hay ganancia de CPU
+# que medir y lo que cambia es la memoria (PSS) y el arranque. --hilos prueba el modo actual con
+# varios GUNICORN_THREADS; --lentos añade clientes que tardan en mandar su petición, el caso en el
+# que un worker síncrono se queda esperando y uno con hilos sigue atendiendo a los demás.
+import argparse
+import http.client
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+from time import monotonic, perf_counter, sleep
+from urllib.parse import urlencode
+
+from benchmark import ServidorHoja, generar_consultas, generar_hoja, percentiles
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+
+def comando(modo, puerto, directorio, workers):
+    if modo == 'antes':
+        vacio = os.path.join(directorio, 'sin_config.py')
+        open(vacio, 'w').close()
+        return ['gunicorn', '-c', vacio, '-w', str(workers), '-b', f'127.0.0.1:{puerto}', 'app:app']
+    return ['gunicorn', '-c', os.path.join(DIRECTORIO, 'gunicorn.conf.py'), '-w', str(workers),
+            '-b', f'127.0.0.1:{puerto}', 'app:app']
+
+def esperar_arranque(puerto, limite_s=120):
+    inicio = monotonic()
+    while monotonic() - inicio < limite_s:
+        try:
+            conexion = http.client.HTTPConnection('127.0.0.1', puerto, timeout=5)
+            conexion.request('GET', '/')
+            if conexion.getresponse().status == 200:
+                return monotonic() - inicio
+        except OSError:
+            pass
+        sleep(0.1)
+    raise RuntimeError(f"gunicorn no responde en el puerto {puerto}")
+
+def memoria_mb(pid_master):
+    # PSS del master más sus workers (las páginas compartidas se reparten entre procesos en vez de
+    # contarse en cada uno), leído de /proc; solo Linux
+    total = 0
+    try:
+        pids = [pid_master] + [int(p) for p in open(f'/proc/{pid_master}/task/{pid_master}/children').read().split()]
+        for pid in pids:
+            for linea in open(f'/proc/{pid}/smaps_rollup'):
+                if linea.startswith('Pss:'):
+                    total += int(linea.split()[1])
+    except OSError:
+        return None
+    return round(total / 1024, 1)
+
+def cliente(puerto, consultas, hasta, tiempos, errores, desplazamiento):
+    conexion = http.client.HTTPConnection('127.0.0.1', puerto, timeout=30)
+    cabeceras = {'Content-Type': 'application/x-www-form-urlencoded'}
+    i = desplazamiento
+    while monotonic() < hasta:
+        cuerpo = urlencode(consultas[i % len(consultas)])
+        i += 1
+        inicio = perf_counter()
+        try:
+            conexion.request('POST', '/buscar', cuerpo, cabeceras)
+            respuesta = conexion.getresponse()
+            respuesta.read()
+            if respuesta.status != 200:
+                errores.append(respuesta.status)
+                continue
+        except (OSError, http.client.HTTPException) as e:
+            errores.append(str(e))
+            conexion.close()
+            conexion = http.client.HTTPConnection('127.0.0.1', puerto, timeout=30)
+            continue
+        tiempos.append(perf_counter() - inicio)
+    conexion.close()
+
+def cliente_lento(puerto, consultas, hasta, desplazamiento, pausa_s=1.0):
+    # Manda la petición en dos trozos separados por `pausa_s` (un móvil con mala cobertura): mientras
+    # tanto ocupa un worker síncrono entero, o solo un hilo de uno gthread
+    cabeceras = {'Content-Type': 'application/x-www-form-urlencoded'}
+    i = desplazamiento
+    while monotonic() < hasta:
+        cuerpo = urlencode(consultas[i % len(consultas)]).encode('utf-8')
+        i += 1
+        try:
+            conexion = http.client.HTTPConnection('127.0.0.1', puerto, timeout=30)
+            conexion.putrequest('POST', '/buscar')
+            for nombre, valor in {**cabeceras, 'Content-Length': str(len(cuerpo))}.items():
+                conexion.putheader(nombre, valor)
+            conexion.endheaders(cuerpo[:len(cuerpo) // 2])
+            sleep(pausa_s)
+            conexion.send(cuerpo[len(cuerpo) // 2:])
+            conexion.getresponse().read()
+            conexion.close()
+        except (OSError, http.client.HTTPException):
+            sleep(0.1)
+
+def medir_modo(modo, servidor, consultas, args, puerto, hilos_gunicorn=None):
+    directorio = tempfile.mkdtemp(prefix=f'mi-ruta-carga-{modo}-')
+    entorno = dict(os.environ, GOOGLE_SHEET_URL=servidor.url, INTERVALO_RECARGA_S='0', LOG_LEVEL='WARNING',
+                   CACHE_HORARIOS=os.path.join(directorio, 'horarios_cache.bin'))
+    if hilos_gunicorn:
+        entorno['GUNICORN_THREADS'] = str(hilos_gunicorn)
+    proceso = subprocess.Popen(comando(modo, puerto, directorio, args.workers), cwd=DIRECTORIO, env=entorno,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        arranque_s = esperar_arranque(puerto)
+        tiempos, errores = [], []
+        hasta = monotonic() + args.segundos
+        hilos = [threading.Thread(target=cliente, args=(puerto, consultas, hasta, tiempos, errores, n * 37))
+                 for n in range(args.clientes)]
+        hilos += [threading.Thread(target=cliente_lento, args=(puerto, consultas, hasta, n * 41))
+                  for n in range(args.lentos)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        memoria = memoria_mb(proceso.pid)
+    finally:
+        proceso.send_signal(signal.SIGTERM)
+        proceso.wait(timeout=30)
+    if hilos_gunicorn:
+        modo = f"{modo}/{hilos_gunicorn}h"
+    return {'modo': modo, 'arranque_s': round(arranque_s, 2), 'peticiones': len(tiempos), 'errores': len(errores),
+            'rps': round(len(tiempos) / args.segundos, 1), 'pss_mb': memoria, **percentiles(tiempos)}
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de /buscar con gunicorn")
+    parser.add_argument('--modos', default='antes,actual')
+    parser.add_argument('--segundos', type=int, default=20)
+    parser.add_argument('--clientes', type=int, default=16, help="conexiones concurrentes")
+    parser.add_argument('--lentos', type=int, default=0, help="clientes que mandan la petición en dos trozos con 1 s de pausa")
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1)),
+                        help="workers de gunicorn en todos los modos")
+    parser.add_argument('--hilos', default='', help="GUNICORN_THREADS del modo actual, varios separados por comas")
+    parser.add_argument('--escala', type=int, default=10, help="tamaño de la hoja sintética (ver benchmark.py)")
+    parser.add_argument('--consultas', type=int, default=300, help="consultas distintas que se repiten en bucle")
+    parser.add_argument('--puerto', type=int, default=8765)
+    parser.add_argument('--semilla', type=int, default=1)
+    args = parser.parse_args()
+
+    servidor = ServidorHoja()
+    csv_hoja, paradas, nucleo = generar_hoja(args.escala, args.semilla)
+    servidor.contenido = csv_hoja.encode('utf-8')
+    consultas = generar_consultas(paradas, nucleo, args.consultas, args.semilla)
+
+    resultados = []
+    for modo in args.modos.split(','):
+        for hilos in ([int(h) for h in args.hilos.split(',') if h.strip()] if modo == 'actual' else []) or [None]:
+            print(f"Modo {modo}{f' con {hilos} hilos' if hilos else ''}...", file=sys.stderr, flush=True)
+            resultados.append(medir_modo(modo, servidor, consultas, args, args.puerto, hilos))
+
+    print(f"Workers: {args.workers}; clientes: {args.clientes} rápidos + {args.lentos} lentos (solo se miden los rápidos)")
+    print(f"{'modo':>10} {'arranque':>9} {'peticiones':>10} {'req/s':>7} {'p50':>7} {'p90':>7} {'p99':>7} {'pss':>8}")
+    for r in resultados:
+        print(f"{r['modo']:>10} {r['arranque_s']:>8.2f}s {r['peticiones']:>10} {r['rps']:>7.1f} {r.get('p50_ms', 0):>7.1f}"
+              f" {r.get('p90_ms', 0):>7.1f} {r.get('p99_ms', 0):>7.1f} {str(r['pss_mb']) + 'MB':>8}"
+              + (f"  ({r['errores']} errores)" if r['errores'] else ''))
+    if len(resultados) > 1 and resultados[0]['rps']:
+        print(f"Rendimiento {resultados[-1]['modo']} / {resultados[0]['modo']}: x{resultados[-1]['rps'] / resultados[0]['rps']:.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,615 @@
+// Motor de rutas en el cliente: el mismo algoritmo que MotorPareto de app.py, sobre el paquete de
+// horarios de /api/v1/horarios, para buscar sin conexión. Lo carga el service worker (sw.js).
+// Las horas van en minutos sobre la línea de tiempo de la consulta: 0 = medianoche del día buscado.
+(function (global) {
+  'use strict';
+
+  const MASCARA_SEMANA = 0b1111111;
+
+  // Salidas de una fila de frecuencia (SalidasFrecuencia en app.py). `fin` puede pasar de 1440.
+  function SalidasFrecuencia(inicio, fin, cada, mascara) {
+    this.inicio = inicio;
+    this.fin = fin < inicio ? fin + 1440 : fin;
+    this.cada = cada > 0 ? cada : 0;
+    this.mascara = mascara;
+    this.clave = [this.inicio, this.fin, this.cada, this.mascara].join(',');
+  }
+
+  SalidasFrecuencia.prototype.ventana = function (dia, k) {
+    if (!((this.mascara >> (((dia + k) % 7 + 7) % 7)) & 1)) return null;
+    return [k * 1440 + this.inicio, k * 1440 + this.fin];
+  };
+
+  SalidasFrecuencia.prototype.siguiente = function (minuto, dia, hasta) {
+    let k = Math.floor(minuto / 1440) - 1;
+    while (k * 1440 + this.inicio <= hasta) {
+      const ventana = this.ventana(dia, k);
+      if (ventana && minuto <= ventana[1]) {
+        const [inicio, fin] = ventana;
+        if (minuto <= inicio) return inicio <= hasta ? inicio : null;
+        const salida = this.cada ? inicio + Math.ceil((minuto - inicio) / this.cada) * this.cada : minuto;
+        if (salida <= fin) return salida <= hasta ? salida : null;
+      }
+      k += 1;
+    }
+    return null;
+  };
+
+  SalidasFrecuencia.prototype.anterior = function (minuto, dia, desde) {
+    let k = Math.floor(minuto / 1440);
+    while (k * 1440 + this.fin >= desde) {
+      const ventana = this.ventana(dia, k);
+      if (ventana && minuto >= ventana[0]) {
+        const [inicio, fin] = ventana;
+        const limite = Math.min(minuto, fin);
+        const salida = this.cada ? inicio + Math.floor((limite - inicio) / this.cada) * this.cada : limite;
+        return salida >= desde ? salida : null;
+      }
+      k -= 1;
+    }
+    return null;
+  };
+
+  // Intervalos [inicio, fin] del día, fusionados (VentanasServicio en app.py)
+  function intervalosServicio(primer, ultim) {
+    if (primer < 0 || ultim < 0) return [];
+    return primer > ultim ? [[primer, 1440], [0, ultim]] : [[primer, ultim]];
+  }
+
+  function ventanasServicio(intervalos) {
+    const fusionados = [];
+    intervalos.slice().sort((a, b) => a[0] - b[0] || a[1] - b[1]).forEach(([inicio, fin]) => {
+      const ultimo = fusionados[fusionados.length - 1];
+      if (ultimo && inicio <= ultimo[1]) ultimo[1] = Math.max(ultimo[1], fin);
+      else fusionados.push([inicio, fin]);
+    });
+    return fusionados;
+  }
+
+  function contiene(ventanas, minuto) {
+    return ventanas.some(([inicio, fin]) => inicio <= minuto && minuto <= fin);
+  }
+
+  function mascaraDiasSeguidos(dia, n) {
+    let mascara = 0;
+    for (let k = 0; k < n; k++) mascara |= 1 << (((dia + k) % 7 + 7) % 7);
+    return mascara;
+  }
+
+  function bisectLeft(lista, valor) {
+    let lo = 0, hi = lista.length;
+    while (lo < hi) {
+      const mid = (lo + hi) >> 1;
+      if (lista[mid] < valor) lo = mid + 1; else hi = mid;
+    }
+    return lo;
+  }
+
+  // round() de Python: los empates van al par
+  function redondear(x) {
+    const r = Math.round(x);
+    return Math.abs(x % 1) === 0.5 && r % 2 !== 0 ? r - 1 : r;
+  }
+
+  // --- Índice ---
+  // Equivalente a IndiceRutas a partir del manifiesto y sus trozos (uno por parada de origen)
+  function Indice(manifiesto, trozos) {
+    const c = manifiesto.constantes;
+    this.version = manifiesto.version;
+    this.transbordoMin = c.transbordo_min;
+    this.maxTramos = c.max_tramos;
+    this.esperaMaxima = c.espera_maxima_min;
+    this.horizonteH = c.horizonte_h;
+    this.resultadosPorCriterio = c.resultados_por_criterio;
+    this.reglas = new Map(manifiesto.transbordos.map(([p, l, s, m]) => [[p || '', l || '', s || ''].join('\u0000'), m]));
+    this.minutosTransbordo = new Map();
+    this.transbordoMaximo = Math.max(this.transbordoMin, ...this.reglas.values());
+
+    // Filas en el orden de la hoja, como en el servidor
+    const filas = [];
+    trozos.forEach(trozo => {
+      const t = trozo.tramos;
+      for (let i = 0; i < t.id.length; i++) {
+        filas.push({id: t.id[i], origen: trozo.origen, destino: t.destino[i], dias: t.dias[i], tipo: t.tipo[i],
+                    salida: t.salida[i], llegada: t.llegada[i], cada: t.cada[i], duracion: t.duracion[i],
+                    precio: t.precio[i], compania: t.compania[i], transporte: t.transporte[i], linea: t.linea[i]});
+      }
+    });
+    filas.sort((a, b) => a.id - b.id);
+
+    this.paradas = [];
+    this.idParada = new Map();
+    filas.forEach(f => this.internar(f.origen));
+    filas.forEach(f => this.internar(f.destino));
+    this.tramos = filas.map(f => Object.assign(f, {
+      o: this.idParada.get(f.origen), d: this.idParada.get(f.destino),
+      companiaTramo: f.compania && f.compania.trim() ? f.compania : null,
+      salidas: f.tipo === 'Q' && f.salida >= 0 ? new SalidasFrecuencia(f.salida, f.llegada, f.cada, f.dias) : null
+    }));
+
+    // Ventanas de servicio de frecuencia por (origen, destino, compañía); null reúne todas
+    const intervalos = new Map();
+    this.tramos.forEach(t => {
+      if (t.tipo !== 'Q') return;
+      const claves = [this.claveVentana(t.o, t.d, null)];
+      if (t.companiaTramo) claves.push(this.claveVentana(t.o, t.d, t.compania));
+      const propios = t.salidas ? intervalosServicio(t.salidas.inicio, t.salidas.fin % 1440) : [];
+      claves.forEach(clave => {
+        if (!intervalos.has(clave)) intervalos.set(clave, []);
+        intervalos.get(clave).push(...propios);
+      });
+      t.ventanas = ventanasServicio(propios);
+    });
+    this.ventanasServicio = new Map([...intervalos].map(([clave, lista]) => [clave, ventanasServicio(lista)]));
+
+    // Servicios fijos agrupados por (destino, compañía, transporte, origen), salidas ordenadas
+    const grupos = new Map();
+    this.tramos.filter(t => t.tipo === 'F').sort((a, b) => a.salida - b.salida || a.id - b.id).forEach(t => {
+      const clave = [t.d, t.compania, t.transporte, t.o].join('\u0000');
+      if (!grupos.has(clave)) grupos.set(clave, []);
+      grupos.get(clave).push(t);
+    });
+    this.serviciosFijos = [];
+    this.tramosFlexibles = [];
+    for (let dia = 0; dia < 7; dia++) {
+      const servicios = new Map();
+      grupos.forEach(tramos => {
+        const delDia = tramos.filter(t => (t.dias >> dia) & 1);
+        if (!delDia.length) return;
+        const origen = delDia[0].o;
+        if (!servicios.has(origen)) servicios.set(origen, []);
+        const precios = delDia.map(t => t.precio);
+        servicios.get(origen).push({destino: delDia[0].d, salidas: delDia.map(t => t.salida), tramos: delDia,
+                                    anclas: anclasUtiles(delDia), mejor: mejoresLlegadas(delDia),
+                                    precioUnico: Math.min(...precios) === Math.max(...precios)});
+      });
+      const flexibles = new Map();
+      this.tramos.filter(t => t.tipo !== 'F' && (t.dias >> dia) & 1)
+        .sort((a, b) => a.o - b.o || a.id - b.id)
+        .forEach(t => {
+          if (!flexibles.has(t.o)) flexibles.set(t.o, []);
+          flexibles.get(t.o).push(t);
+        });
+      this.serviciosFijos.push(servicios);
+      this.tramosFlexibles.push(flexibles);
+    }
+  }
+
+  Indice.prototype.internar = function (nombre) {
+    if (!this.idParada.has(nombre)) {
+      this.idParada.set(nombre, this.paradas.length);
+      this.paradas.push(nombre);
+    }
+  };
+
+  Indice.prototype.claveVentana = function (o, d, compania) {
+    return [o, d, compania === null ? '\u0001' : compania].join('\u0000');
+  };
+
+  Indice.prototype.enServicio = function (tramo, minuto) {
+    const ventanas = this.ventanasServicio.get(this.claveVentana(tramo.o, tramo.d, tramo.companiaTramo));
+    return ventanas === undefined || contiene(ventanas, minuto);
+  };
+
+  Indice.prototype.transbordo = function (llegada, salida) {
+    if (!this.reglas.size) return this.transbordoMin;
+    const c1 = llegada.companiaTramo || '', c2 = salida.companiaTramo || '';
+    const clave = [llegada.d, c1, c2].join('\u0000');
+    let minutos = this.minutosTransbordo.get(clave);
+    if (minutos === undefined) {
+      minutos = this.transbordoMin;
+      buscar:
+      for (const p of [this.paradas[llegada.d], '']) {
+        for (const [l, s] of [[c1, c2], [c1, ''], ['', c2], ['', '']]) {
+          const m = this.reglas.get([p, l, s].join('\u0000'));
+          if (m !== undefined) { minutos = m; break buscar; }
+        }
+      }
+      this.minutosTransbordo.set(clave, minutos);
+    }
+    return minutos;
+  };
+
+  // Mínimo de tramos de cada parada al destino con lo que circula los días de la máscara
+  Indice.prototype.faltan = function (idDestino, dias) {
+    const faltan = new Array(this.paradas.length).fill(this.maxTramos + 1);
+    faltan[idDestino] = 0;
+    const activos = this.tramos.filter(t => t.dias & dias);
+    for (let k = 1; k <= this.maxTramos; k++) {
+      activos.forEach(t => {
+        if (faltan[t.d] === k - 1 && faltan[t.o] > k) faltan[t.o] = k;
+      });
+    }
+    return faltan;
+  };
+
+  function anclasUtiles(tramos) {
+    // Salidas de un servicio que no mejora otra posterior (ver anclas_utiles en app.py)
+    const precios = tramos.map(t => t.precio);
+    if (tramos.length < 2 || Math.min(...precios) !== Math.max(...precios)) return tramos.map(t => [t.salida, t]);
+    const anclas = [];
+    let minimoPosterior = Infinity;
+    for (let k = tramos.length - 1; k >= 0; k--) {
+      if (tramos[k].llegada < minimoPosterior) anclas.push([tramos[k].salida, tramos[k]]);
+      minimoPosterior = Math.min(minimoPosterior, tramos[k].llegada);
+    }
+    return anclas.reverse();
+  }
+
+  // Índice de la llegada mínima de cada sufijo; con empates, la primera salida (mejores_llegadas)
+  function mejoresLlegadas(tramos) {
+    const mejor = new Array(tramos.length);
+    for (let k = tramos.length - 1; k >= 0; k--) {
+      mejor[k] = k === tramos.length - 1 || tramos[k].llegada <= tramos[mejor[k + 1]].llegada ? k : mejor[k + 1];
+    }
+    return mejor;
+  }
+
+  // Salidas que merece la pena tomar desde la primera alcanzable j (salidas_utiles en app.py)
+  function salidasUtiles(servicio, j, hasta) {
+    const {salidas, tramos} = servicio;
+    if (servicio.precioUnico) {
+      const m = servicio.mejor[j];
+      if (hasta === null || salidas[m] <= hasta) return [m];
+    }
+    const candidatas = [];
+    for (let k = j; k < salidas.length && (hasta === null || salidas[k] <= hasta); k++) candidatas.push(k);
+    candidatas.sort((a, b) => tramos[a].llegada - tramos[b].llegada || tramos[a].precio - tramos[b].precio || a - b);
+    const utiles = [];
+    let precioMinimo = Infinity;
+    candidatas.forEach(k => {
+      if (tramos[k].precio < precioMinimo) {
+        utiles.push(k);
+        precioMinimo = tramos[k].precio;
+      }
+    });
+    return utiles;
+  }
+
+  // --- Motor ---
+  function encajarHaciaAtras(indice, tramos, limite, dia, desde) {
+    const horas = [];
+    for (let i = tramos.length - 1; i >= 0; i--) {
+      const t = tramos[i];
+      let salida = limite - t.duracion;
+      if (t.salidas) {
+        salida = t.salidas.anterior(salida, dia, Math.max(desde, salida - indice.esperaMaxima));
+        if (salida === null) return null;
+      } else if (salida < desde) {
+        return null;
+      }
+      horas.push([salida, salida + t.duracion]);
+      if (i) limite = salida - indice.transbordo(tramos[i - 1], t);
+    }
+    return horas.reverse();
+  }
+
+  // Salidas del servicio que pueden abrir la ruta, con las horas de los previos (anclas_que_encajan)
+  function anclasQueEncajan(indice, servicio, base, previos, espera, duracion, dia, desde, hasta) {
+    const candidatas = previos.length ? servicio.tramos.map(t => [t.salida, t]) : servicio.anclas;
+    const encajadas = [];
+    let llegadaMinima = Infinity;
+    for (let i = candidatas.length - 1; i >= 0; i--) {
+      const [salidaAncla, t] = candidatas[i];
+      if (servicio.precioUnico && t.llegada >= llegadaMinima) continue;
+      const salidaTramo = base + salidaAncla;
+      if (!(desde <= salidaTramo - espera - duracion) || salidaTramo >= hasta) continue;
+      const horas = encajarHaciaAtras(indice, previos, salidaTramo - espera, dia, desde);
+      if (horas === null) continue;
+      encajadas.push([salidaTramo, t, horas]);
+      llegadaMinima = Math.min(llegadaMinima, t.llegada);
+    }
+    return encajadas.reverse();
+  }
+
+  function Etiqueta(parada, tramo, padre, salida, llegada, salidaTramo, duracion, nTramos, precio, grupo, tiempos) {
+    this.parada = parada;
+    this.tramo = tramo;
+    this.padre = padre;
+    this.salida = salida;
+    this.llegada = llegada;
+    this.salidaTramo = salidaTramo;
+    this.duracion = duracion;
+    this.nTramos = nTramos;
+    this.precio = precio;
+    this.grupo = grupo === undefined ? null : grupo;
+    this.tiempos = tiempos || [];
+    this.viva = true;
+  }
+
+  Etiqueta.prototype.domina = function (otra) {
+    if (this.nTramos > otra.nTramos || this.precio > otra.precio) return false;
+    if (this.salida === null || otra.salida === null) {
+      // Flotantes: solo con las mismas frecuencias, y tramo a tramo (ver Etiqueta.domina en app.py)
+      return this.salida === null && otra.salida === null && this.grupo === otra.grupo &&
+        this.tiempos.every((a, i) => a <= otra.tiempos[i]);
+    }
+    // Con hora: solo entre las que llegan con la misma compañía si el transbordo depende de ella
+    if (this.grupo !== null && this.grupo !== otra.grupo) return false;
+    return this.salida >= otra.salida && this.llegada <= otra.llegada;
+  };
+
+  // consulta: {origen, destino, dia, lugaresAEvitar, desde, horizonte}. Devuelve las jornadas del
+  // frente de Pareto: {tramos: [[tramo, salida, llegada]], salida, llegada, duracion, transbordos, precio}
+  function buscar(indice, consulta) {
+    const idOrigen = indice.idParada.get(consulta.origen);
+    const idDestino = indice.idParada.get(consulta.destino);
+    if (idOrigen === undefined || idDestino === undefined || idOrigen === idDestino) return [];
+    const idsAEvitar = new Set((consulta.lugaresAEvitar || []).filter(l => indice.idParada.has(l)).map(l => indice.idParada.get(l)));
+    const dia = consulta.dia;
+    const finSalidas = consulta.desde + consulta.horizonte;
+    const fin = finSalidas + 1440;
+    const primerDia = Math.floor(consulta.desde / 1440);
+    const diasAnclas = [];
+    for (let k = primerDia; k <= Math.floor((finSalidas - 1) / 1440); k++) diasAnclas.push(k);
+    const nDias = Math.floor((fin - 1) / 1440) + 1 - primerDia;
+    const faltan = indice.faltan(idDestino, mascaraDiasSeguidos(dia + primerDia, nDias));
+    const maxTramos = indice.maxTramos;
+    if (faltan[idOrigen] > maxTramos) return [];
+
+    const bolsas = new Map();
+    const bolsa = p => bolsas.get(p) || [];
+    const conReglas = indice.reglas.size > 0;
+    const grupoLlegada = (t, parada) => conReglas && parada !== idDestino ? 'c' + (t.companiaTramo || '') : null;
+    const cola = [new Etiqueta(idOrigen, null, null, null, null, null, 0, 0, 0, '', [])];
+
+    function anadir(etiqueta) {
+      if (faltan[etiqueta.parada] > maxTramos - etiqueta.nTramos) return;
+      if (bolsa(idDestino).some(e => e.domina(etiqueta))) return;
+      const actual = bolsa(etiqueta.parada);
+      if (actual.some(e => e.domina(etiqueta))) return;
+      const supervivientes = [];
+      actual.forEach(e => {
+        if (etiqueta.domina(e)) e.viva = false; else supervivientes.push(e);
+      });
+      supervivientes.push(etiqueta);
+      bolsas.set(etiqueta.parada, supervivientes);
+      if (etiqueta.parada !== idDestino) cola.push(etiqueta);
+    }
+
+    for (let cabeza = 0; cabeza < cola.length; cabeza++) {
+      const etiqueta = cola[cabeza];
+      if (!etiqueta.viva || etiqueta.nTramos >= maxTramos) continue;
+      if (etiqueta.nTramos && idsAEvitar.has(etiqueta.parada)) continue;
+
+      const visitadas = new Set();
+      const previos = [];
+      for (let e = etiqueta; e !== null; e = e.padre) {
+        visitadas.add(e.parada);
+        if (e.padre !== null) previos.push(e.tramo);
+      }
+      previos.reverse();
+      const nTramos = etiqueta.nTramos + 1;
+      const transbordo = t => etiqueta.nTramos ? indice.transbordo(etiqueta.tramo, t) : 0;
+
+      if (etiqueta.salida === null) {
+        (indice.tramosFlexibles[dia].get(etiqueta.parada) || []).forEach(t => {
+          if (!visitadas.has(t.d)) {
+            const espera = transbordo(t);
+            anadir(new Etiqueta(t.d, t, etiqueta, null, null, null, etiqueta.duracion + espera + t.duracion,
+                                nTramos, etiqueta.precio + t.precio,
+                                etiqueta.grupo + '|' + (t.salidas ? t.salidas.clave : '') +
+                                  (conReglas ? '/' + (t.companiaTramo || '') : ''),
+                                etiqueta.tiempos.concat([espera, t.duracion])));
+          }
+        });
+        diasAnclas.forEach(k => {
+          const base = k * 1440;
+          (indice.serviciosFijos[((dia + k) % 7 + 7) % 7].get(etiqueta.parada) || []).forEach(servicio => {
+            if (visitadas.has(servicio.destino)) return;
+            const espera = transbordo(servicio.tramos[0]);
+            anclasQueEncajan(indice, servicio, base, previos, espera, etiqueta.duracion, dia, consulta.desde,
+                             finSalidas).forEach(([salidaTramo, t, horas]) => {
+              const salida = horas.length ? horas[0][0] : salidaTramo;
+              const llegada = base + t.llegada;
+              anadir(new Etiqueta(servicio.destino, t, etiqueta, salida, llegada, salidaTramo, llegada - salida,
+                                  nTramos, etiqueta.precio + t.precio, grupoLlegada(t, servicio.destino)));
+            });
+          });
+        });
+        continue;
+      }
+
+      // El día en que se está listo depende del transbordo de cada tramo (ver MotorPareto.buscar)
+      const k = Math.floor(etiqueta.llegada / 1440);
+      const ultimo = Math.floor((etiqueta.llegada + indice.transbordoMaximo) / 1440);
+      for (let diaServicio = k; diaServicio <= ultimo; diaServicio++) {
+        (indice.tramosFlexibles[((dia + diaServicio) % 7 + 7) % 7].get(etiqueta.parada) || []).forEach(t => {
+          if (visitadas.has(t.d)) return;
+          const listo = etiqueta.llegada + transbordo(t);
+          if (Math.floor(listo / 1440) !== diaServicio) return;
+          const hasta = Math.min(fin, listo + indice.esperaMaxima);
+          const salidaTramo = t.salidas ? t.salidas.siguiente(listo, dia, hasta) : listo;
+          if (salidaTramo === null) return;
+          const llegada = salidaTramo + t.duracion;
+          if (llegada <= fin) {
+            anadir(new Etiqueta(t.d, t, etiqueta, etiqueta.salida, llegada, salidaTramo, llegada - etiqueta.salida,
+                                nTramos, etiqueta.precio + t.precio, grupoLlegada(t, t.d)));
+          }
+        });
+      }
+
+      for (let diaServicio = k; diaServicio <= ultimo + 1; diaServicio++) {
+        const base = diaServicio * 1440;
+        (indice.serviciosFijos[((dia + diaServicio) % 7 + 7) % 7].get(etiqueta.parada) || []).forEach(servicio => {
+          if (visitadas.has(servicio.destino)) return;
+          const listo = etiqueta.llegada + transbordo(servicio.tramos[0]);
+          const diaListo = Math.floor(listo / 1440);
+          if (diaServicio < diaListo || diaServicio > diaListo + 1) return;
+          const primera = bisectLeft(servicio.salidas, listo - base);
+          if (primera === servicio.salidas.length) return;
+          const hasta = diaServicio > diaListo ? listo + indice.esperaMaxima - base : null;
+          salidasUtiles(servicio, primera, hasta).forEach(j => {
+            const t = servicio.tramos[j];
+            const llegada = base + t.llegada;
+            if (llegada > fin) return;
+            anadir(new Etiqueta(servicio.destino, t, etiqueta, etiqueta.salida, llegada, base + servicio.salidas[j],
+                                llegada - etiqueta.salida, nTramos, etiqueta.precio + t.precio,
+                                grupoLlegada(t, servicio.destino)));
+          });
+        });
+      }
+    }
+
+    return bolsa(idDestino).map(etiqueta => aJornada(indice, consulta, etiqueta));
+  }
+
+  function aJornada(indice, consulta, etiqueta) {
+    const cadena = [];
+    for (let e = etiqueta; e.padre !== null; e = e.padre) cadena.push(e);
+    cadena.reverse();
+    const tramos = cadena.map(e => [e.tramo, e.salidaTramo, e.llegada]);
+    const ancla = tramos.findIndex(tramo => tramo[1] !== null);
+    if (ancla > 0) {
+      const horas = encajarHaciaAtras(indice, tramos.slice(0, ancla).map(t => t[0]),
+                                      tramos[ancla][1] - indice.transbordo(tramos[ancla - 1][0], tramos[ancla][0]),
+                                      consulta.dia, consulta.desde);
+      horas.forEach(([salida, llegada], i) => { tramos[i] = [tramos[i][0], salida, llegada]; });
+    }
+    return {tramos, salida: etiqueta.salida, llegada: etiqueta.llegada, duracion: etiqueta.duracion,
+            transbordos: etiqueta.nTramos - 1, precio: etiqueta.precio};
+  }
+
+  // --- Resultados ---
+  // Filtros horarios y selección por criterio como ResultadoMotor.seleccionar/clasificar
+  function horas(jornada, inicioFlotante) {
+    return jornada.salida === null ? [inicioFlotante, inicioFlotante + jornada.duracion] : [jornada.salida, jornada.llegada];
+  }
+
+  function aTuAire(jornada) {
+    return jornada.tramos.length === 1 && jornada.salida === null && jornada.tramos[0][0].tipo === 'Q';
+  }
+
+  // Las horas de los filtros son del día en que sale cada jornada (ResultadoMotor.seleccionar)
+  function seleccionar(jornadas, inicioFlotante, salidaMinima, horaSalidaMinima, horaLlegadaMaxima) {
+    return jornadas.filter(j => {
+      const [salida, llegada] = horas(j, inicioFlotante);
+      const inicioDia = Math.floor(salida / 1440) * 1440;
+      return aTuAire(j) || ((salidaMinima === null || salida >= salidaMinima) &&
+                            (horaSalidaMinima === null || salida - inicioDia >= horaSalidaMinima) &&
+                            (horaLlegadaMaxima === null || llegada <= inicioDia + horaLlegadaMaxima));
+    });
+  }
+
+  function clasificar(seleccion, inicioFlotante, porCriterio) {
+    const vistas = new Set();
+    const unicas = [];
+    seleccion.forEach(j => {
+      const [salida, llegada] = horas(j, inicioFlotante);
+      const clave = [redondear(salida), redondear(llegada), ...j.tramos.map(t => t[0].compania)].join('\u0000');
+      if (!vistas.has(clave)) {
+        vistas.add(clave);
+        unicas.push(j);
+      }
+    });
+    if (porCriterio <= 0 || unicas.length <= porCriterio) return unicas;
+    const elegidas = new Set(unicas.filter(aTuAire));
+    const llegada = i => horas(unicas[i], inicioFlotante)[1];
+    const mejores = clave => unicas.map((_, i) => i)
+      .sort((a, b) => { const ka = clave(a), kb = clave(b); for (let x = 0; x < ka.length; x++) if (ka[x] !== kb[x]) return ka[x] - kb[x]; return a - b; })
+      .slice(0, porCriterio).forEach(i => elegidas.add(unicas[i]));
+    mejores(i => [llegada(i)]);
+    mejores(i => [unicas[i].transbordos, llegada(i)]);
+    mejores(i => [unicas[i].precio, llegada(i)]);
+    return unicas.filter(j => elegidas.has(j));
+  }
+
+  function horasTramos(indice, jornada, inicioFlotante) {
+    if (jornada.salida !== null) return jornada.tramos.map(([, salida, llegada]) => [salida, llegada]);
+    const resultado = [];
+    let llegada = null, anterior = null;
+    jornada.tramos.forEach(([t]) => {
+      const salida = llegada === null ? inicioFlotante : llegada + indice.transbordo(anterior, t);
+      anterior = t;
+      llegada = salida + t.duracion;
+      resultado.push([salida, llegada]);
+    });
+    return resultado;
+  }
+
+  function formatoMinutos(minutos) {
+    const m = ((Math.trunc(minutos) % 1440) + 1440) % 1440;
+    return String(Math.floor(m / 60)).padStart(2, '0') + ':' + String(m % 60).padStart(2, '0');
+  }
+
+  // Itinerario con el mismo formato que /api/v1/buscar (itinerario_compacto en app.py)
+  function itinerario(indice, jornada, inicioFlotante, ahoraMin) {
+    const flexible = aTuAire(jornada);
+    const horasJornada = horasTramos(indice, jornada, inicioFlotante);
+    const tramos = jornada.tramos.map(([t], i) => {
+      const [salida, llegada] = horasJornada[i];
+      const tramo = {origen: t.origen, destino: t.destino, compania: t.compania, transporte: t.transporte,
+                     linea: t.linea, tipo: t.tipo === 'F' ? 'Fijo' : t.tipo === 'Q' ? 'Frecuencia' : '',
+                     salida: flexible ? null : formatoMinutos(salida), llegada: flexible ? null : formatoMinutos(llegada),
+                     duracion_min: redondear(llegada - salida), precio: t.precio,
+                     transbordo_min: i ? indice.transbordo(jornada.tramos[i - 1][0], t) : 0,
+                     dias_mas: flexible ? 0 : Math.floor(salida / 1440)};
+      const minutoServicio = flexible ? Math.floor(ahoraMin) : ((salida % 1440) + 1440) % 1440;
+      if (t.tipo === 'Q' && !indice.enServicio(t, minutoServicio)) tramo.aviso = 'FUERA DE HORARIO';
+      return tramo;
+    });
+    const salida = horasJornada[0][0], llegada = horasJornada[horasJornada.length - 1][1];
+    return {flexible, salida: flexible ? null : formatoMinutos(salida), llegada: flexible ? null : formatoMinutos(llegada),
+            salida_min: flexible ? null : redondear(salida), llegada_min: flexible ? null : redondear(llegada),
+            duracion_min: redondear(llegada - salida), transbordos: jornada.transbordos,
+            precio: Math.round(jornada.precio * 100) / 100, tramos};
+  }
+
+  // --- Parámetros ---
+  const DIAS_SEMANA = ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo'];
+
+  function ahoraEnMadrid(fecha) {
+    const partes = {};
+    new Intl.DateTimeFormat('en-GB', {timeZone: 'Europe/Madrid', weekday: 'short', hour: '2-digit',
+                                      minute: '2-digit', second: '2-digit', hourCycle: 'h23'})
+      .formatToParts(fecha || new Date()).forEach(p => { partes[p.type] = p.value; });
+    const dia = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun'].indexOf(partes.weekday);
+    return {dia, minuto: Number(partes.hour) * 60 + Number(partes.minute) + Number(partes.second) / 60};
+  }
+
+  // Mismos campos del formulario y mismas reglas que interpretar_busqueda en app.py
+  function interpretarBusqueda(datos, indice, fecha) {
+    const campo = nombre => datos[nombre] === undefined || datos[nombre] === null ? '' : String(datos[nombre]);
+    const entero = (nombre, defecto) => { const v = parseInt(campo(nombre) || defecto, 10); return isNaN(v) ? null : v; };
+    const ahora = ahoraEnMadrid(fecha);
+    const diaSeleccionado = campo('dia_semana_selector') || 'hoy';
+    let dia = ahora.dia;
+    if (diaSeleccionado !== 'hoy' && !isNaN(parseInt(diaSeleccionado, 10))) dia = ((parseInt(diaSeleccionado, 10) % 7) + 7) % 7;
+    const lugaresAEvitar = [];
+    if (campo('evitar_sj')) lugaresAEvitar.push('Sta. Justa');
+    if (campo('evitar_pa')) lugaresAEvitar.push('Plz. Armas');
+    const desdeAhora = Boolean(campo('desde_ahora')) && diaSeleccionado === 'hoy';
+    const salidaMinima = desdeAhora ? ahora.minuto : null;
+    let horaSalidaMinima = null, horaLlegadaMaxima = null;
+    if (campo('salir_despues_check')) {
+      const h = entero('salir_despues_hora', 7), m = entero('salir_despues_minuto', 0);
+      if (h !== null && m !== null && h >= 0 && h < 24 && m >= 0 && m < 60) horaSalidaMinima = h * 60 + m;
+    }
+    if (campo('llegar_antes_check')) {
+      const h = entero('llegar_antes_hora', 9), m = entero('llegar_antes_minuto', 0);
+      if (h !== null && m !== null && h >= 0 && h < 24 && m >= 0 && m < 60) horaLlegadaMaxima = h * 60 + m;
+    }
+    const [desde, horizonte] = desdeAhora ? [Math.floor(ahora.minuto / 15) * 15, indice.horizonteH * 60] : [0, 1440];
+    return {origen: campo('origen'), destino: campo('destino'), dia, nombreDia: DIAS_SEMANA[dia], lugaresAEvitar,
+            desdeAhora, inicioFlotante: desdeAhora ? ahora.minuto : 7 * 60, salidaMinima,
+            horaSalidaMinima, horaLlegadaMaxima,
+            desde, horizonte, ahoraMin: ahora.minuto};
+  }
+
+  // Búsqueda completa como /buscar: itinerarios elegidos, de antes a después por llegada
+  function buscarItinerarios(indice, datos, fecha) {
+    const params = interpretarBusqueda(datos, indice, fecha);
+    const jornadas = buscar(indice, {origen: params.origen, destino: params.destino, dia: params.dia,
+                                     lugaresAEvitar: params.lugaresAEvitar, desde: params.desde,
+                                     horizonte: params.horizonte});
+    const seleccion = seleccionar(jornadas, params.inicioFlotante, params.salidaMinima, params.horaSalidaMinima,
+                                  params.horaLlegadaMaxima);
+    const llegadaFinal = j => aTuAire(j) ? params.ahoraMin : horas(j, params.inicioFlotante)[1];
+    const elegidas = clasificar(seleccion, params.inicioFlotante, indice.resultadosPorCriterio)
+      .map((j, i) => [llegadaFinal(j), i, j]).sort((a, b) => a[0] - b[0] || a[1] - b[1]).map(x => x[2]);
+    return {params, itinerarios: elegidas.map(j => itinerario(indice, j, params.inicioFlotante, params.ahoraMin))};
+  }
+
+  global.MotorRuta = {Indice, SalidasFrecuencia, buscar, seleccionar, clasificar, itinerario,
+                      interpretarBusqueda, buscarItinerarios, formatoMinutos};
+})(typeof self !== 'undefined' ? self : this);
@@ -1,35 +1,245 @@
-const CACHE_NAME = 'mi-ruta-cache-v1';
-// Lista de ficheros que componen el "esqueleto" de la app.
-const urlsToCache = [
-  '/',
-  '/static/manifest.json',
-  '/static/icons/icon-192x192.png',
-  '/static/icons/icon-512x512.png'
-];
-
-// Evento de instalación: se abre la caché y se guardan los ficheros.
-self.addEventListener('install', event => {
-  event.waitUntil(
-    caches.open(CACHE_NAME)
-      .then(cache => {
-        console.log('Cache abierta');
-        return cache.addAll(urlsToCache);
-      })
-  );
-});
-
-// Evento de "fetch": intercepta las peticiones de red.
-self.addEventListener('fetch', event => {
-  event.respondWith(
-    // Intenta encontrar la respuesta en la caché.
-    caches.match(event.request)
-      .then(response => {
-        // Si se encuentra en caché, la devuelve.
-        if (response) {
-          return response;
-        }
-        // Si no, hace la petición a la red.
-        return fetch(event.request);
-      })
-  );
-});
\ No newline at end of file
+// Service worker de Mi Ruta. Se sirve desde /sw.js para controlar toda la app.
+// - La app (portada, estáticos, frases) se sirve de caché y se revalida en segundo plano.
+// - El paquete de horarios (/api/v1/horarios) igual: el manifiesto se revalida con su ETag y solo
+//   se descargan los trozos nuevos; los trozos se nombran por su contenido y no caducan.
+// - Las búsquedas van al servidor; sin conexión, o si tarda demasiado, se resuelven aquí con
+//   static/motor.js sobre el último paquete. Las repetidas (mismo formulario, misma versión de los
+//   horarios y mismo día, sin "desde ahora") se contestan con la página ya recibida.
+importScripts('/static/motor.js');
+
+const CACHE_NAME = 'mi-ruta-cache-v2';
+const CACHE_HORARIOS = 'mi-ruta-horarios-v1';
+const CACHE_BUSQUEDAS = 'mi-ruta-busquedas-v1';
+const CACHES_VIGENTES = [CACHE_NAME, CACHE_HORARIOS, CACHE_BUSQUEDAS];
+const URL_HORARIOS = '/api/v1/horarios';
+const ESPERA_RED_MS = 4000;
+const MAX_BUSQUEDAS_GUARDADAS = 50;
+// Lista de ficheros que componen el "esqueleto" de la app.
+const urlsToCache = [
+  '/',
+  '/frases.json',
+  '/static/motor.js',
+  '/static/manifest.json',
+  '/static/icons/icon-192x192.png',
+  '/static/icons/icon-512x512.png'
+];
+
+let actualizando = null;   // descarga del paquete en curso, compartida
+let indiceLocal = null;    // MotorRuta.Indice del último paquete completo
+
+// Evento de instalación: se guardan el esqueleto y, si se puede, el paquete de horarios.
+self.addEventListener('install', event => {
+  event.waitUntil(
+    caches.open(CACHE_NAME)
+      .then(cache => cache.addAll(urlsToCache))
+      .then(() => actualizarHorarios().catch(() => null))
+      .then(() => self.skipWaiting())
+  );
+});
+
+// Evento de activación: se borran las cachés de versiones anteriores.
+self.addEventListener('activate', event => {
+  event.waitUntil(
+    caches.keys()
+      .then(nombres => Promise.all(nombres.filter(n => !CACHES_VIGENTES.includes(n)).map(n => caches.delete(n))))
+      .then(() => self.clients.claim())
+  );
+});
+
+// Evento de "fetch": intercepta las peticiones de red.
+self.addEventListener('fetch', event => {
+  const request = event.request;
+  const url = new URL(request.url);
+  if (request.method === 'POST' && url.origin === self.location.origin && url.pathname === '/buscar') {
+    event.respondWith(buscar(request));
+    return;
+  }
+  if (request.method !== 'GET') return;
+  if (url.origin === self.location.origin) {
+    if (url.pathname === URL_HORARIOS) {
+      event.respondWith(manifiestoHorarios(event));
+    } else if (url.pathname.startsWith(URL_HORARIOS + '/')) {
+      event.respondWith(caches.open(CACHE_HORARIOS).then(cache =>
+        cache.match(request, {ignoreVary: true}).then(guardada => guardada || fetch(request))));
+    } else if (url.pathname === '/' || url.pathname === '/frases.json' || url.pathname.startsWith('/static/')) {
+      event.respondWith(staleWhileRevalidate(event, url.pathname === '/' ? '/' : request));
+    }
+  } else if (['script', 'style', 'font'].includes(request.destination)) {
+    // Tailwind y las fuentes, para que la app se vea igual sin conexión
+    event.respondWith(staleWhileRevalidate(event, request));
+  }
+});
+
+function staleWhileRevalidate(event, clave) {
+  return caches.open(CACHE_NAME).then(cache => cache.match(clave).then(guardada => {
+    const red = fetch(event.request).then(respuesta => {
+      if (respuesta.ok || respuesta.type === 'opaque') cache.put(clave, respuesta.clone());
+      return respuesta;
+    });
+    if (guardada) {
+      event.waitUntil(red.catch(() => null));
+      return guardada;
+    }
+    return red;
+  }));
+}
+
+// --- Paquete de horarios ---
+function manifiestoHorarios(event) {
+  return caches.open(CACHE_HORARIOS).then(cache => cache.match(URL_HORARIOS, {ignoreVary: true}).then(guardado => {
+    if (guardado) {
+      event.waitUntil(actualizarHorarios().catch(() => null));
+      return guardado;
+    }
+    return actualizarHorarios().then(() => cache.match(URL_HORARIOS, {ignoreVary: true})).then(r => r || fetch(event.request));
+  }));
+}
+
+function actualizarHorarios() {
+  if (!actualizando) {
+    actualizando = descargarHorarios().finally(() => { actualizando = null; });
+  }
+  return actualizando;
+}
+
+async function descargarHorarios() {
+  const cache = await caches.open(CACHE_HORARIOS);
+  const guardado = await cache.match(URL_HORARIOS, {ignoreVary: true});
+  const etag = guardado && guardado.headers.get('ETag');
+  const respuesta = await fetch(URL_HORARIOS, {cache: 'no-store', headers: etag ? {'If-None-Match': etag} : {}});
+  if (respuesta.status === 304 || !respuesta.ok) return;
+  const manifiesto = await respuesta.clone().json();
+  // Solo los trozos que no están ya; el manifiesto se guarda al final para no dejar un paquete a medias
+  const urls = Object.values(manifiesto.trozos).map(huella => new URL(`${URL_HORARIOS}/${huella}.json`, self.location).href);
+  await Promise.all(urls.map(async url => {
+    if (await cache.match(url, {ignoreVary: true})) return;
+    const trozo = await fetch(url);
+    if (!trozo.ok) throw new Error(`Trozo ${url}: ${trozo.status}`);
+    await cache.put(url, trozo);
+  }));
+  await cache.put(URL_HORARIOS, respuesta);
+  const vigentes = new Set(urls);
+  const sobrantes = (await cache.keys()).filter(r => r.url.includes(URL_HORARIOS + '/') && !vigentes.has(r.url));
+  await Promise.all(sobrantes.map(r => cache.delete(r)));
+  // Las páginas de resultados guardadas eran de los horarios anteriores
+  await caches.delete(CACHE_BUSQUEDAS);
+}
+
+async function cargarIndiceLocal() {
+  const cache = await caches.open(CACHE_HORARIOS);
+  const guardado = await cache.match(URL_HORARIOS, {ignoreVary: true});
+  if (!guardado) return null;
+  const manifiesto = await guardado.json();
+  if (indiceLocal && indiceLocal.version === manifiesto.version) return indiceLocal;
+  const trozos = await Promise.all(Object.values(manifiesto.trozos).map(huella =>
+    cache.match(`${URL_HORARIOS}/${huella}.json`, {ignoreVary: true}).then(r => r.json())));
+  indiceLocal = new MotorRuta.Indice(manifiesto, trozos);
+  return indiceLocal;
+}
+
+// --- Búsquedas ---
+function conLimite(promesa, ms) {
+  return new Promise((resolver, rechazar) => {
+    const temporizador = setTimeout(() => rechazar(new Error('Sin respuesta del servidor')), ms);
+    promesa.then(r => { clearTimeout(temporizador); resolver(r); },
+                 e => { clearTimeout(temporizador); rechazar(e); });
+  });
+}
+
+async function claveBusqueda(datos) {
+  // Solo las búsquedas que no dependen de la hora actual; la clave lleva versión y fecha
+  if (datos.desde_ahora) return null;
+  const guardado = await (await caches.open(CACHE_HORARIOS)).match(URL_HORARIOS, {ignoreVary: true});
+  if (!guardado) return null;
+  const version = (await guardado.json()).version;
+  const fecha = new Intl.DateTimeFormat('en-CA', {timeZone: 'Europe/Madrid'}).format(new Date());
+  const campos = new URLSearchParams(Object.keys(datos).sort().map(k => [k, datos[k]]));
+  campos.set('_v', version);
+  campos.set('_fecha', fecha);
+  return new URL('/buscar?' + campos.toString(), self.location).href;
+}
+
+async function buscar(request) {
+  const datos = {};
+  (await request.clone().formData()).forEach((valor, campo) => { datos[campo] = valor; });
+  const clave = await claveBusqueda(datos).catch(() => null);
+  const cache = await caches.open(CACHE_BUSQUEDAS);
+  if (clave) {
+    const guardada = await cache.match(clave);
+    if (guardada) return guardada;
+  }
+  try {
+    const respuesta = await conLimite(fetch(request), ESPERA_RED_MS);
+    if (!respuesta.ok) throw new Error(`Error del servidor: ${respuesta.status}`);
+    if (clave) {
+      await cache.put(clave, respuesta.clone());
+      const claves = await cache.keys();
+      await Promise.all(claves.slice(0, Math.max(claves.length - MAX_BUSQUEDAS_GUARDADAS, 0)).map(r => cache.delete(r)));
+    }
+    return respuesta;
+  } catch (error) {
+    const indice = await cargarIndiceLocal().catch(() => null);
+    return new Response(paginaResultados(indice, datos), {headers: {'Content-Type': 'text/html; charset=utf-8'}});
+  }
+}
+
+// --- Página de resultados sin conexión ---
+function escapar(texto) {
+  return String(texto === null || texto === undefined ? '' : texto)
+    .replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;').replace(/"/g, '&quot;');
+}
+
+function formatoDuracion(minutos) {
+  const h = Math.floor(minutos / 60), m = Math.round(minutos % 60);
+  return h > 0 ? `${h}h ${m}min` : `${m}min`;
+}
+
+function hora(texto, diasMas) {
+  return escapar(texto) + (diasMas > 0 ? ` (+${diasMas})` : '');
+}
+
+function paginaResultados(indice, datos) {
+  let cuerpo;
+  let titulo = `${escapar(datos.origen)} → ${escapar(datos.destino)}`;
+  if (!indice) {
+    cuerpo = '<p class="aviso">Sin conexión y todavía no hay horarios guardados en este dispositivo.</p>';
+  } else {
+    const {params, itinerarios} = MotorRuta.buscarItinerarios(indice, datos);
+    titulo += ` · ${escapar(params.nombreDia)}`;
+    cuerpo = `<p class="aviso">Sin conexión: resultados calculados en el dispositivo con los horarios ${escapar(indice.version)}.</p>`;
+    if (!itinerarios.length) cuerpo += '<p>No se han encontrado rutas.</p>';
+    itinerarios.forEach(it => {
+      const tramos = it.tramos.map(t => `
+        <li>${t.transbordo_min ? `<small>Transbordo: ${Math.round(t.transbordo_min)} min</small><br>` : ''}
+          <strong>${escapar(t.compania || 'Transporte')}</strong> ${escapar(t.transporte)} ${escapar(t.linea)}<br>
+          ${escapar(t.origen)} → ${escapar(t.destino)}<br>
+          ${it.flexible ? 'A tu aire' : `${hora(t.salida, t.dias_mas)} – ${escapar(t.llegada)}`} · ${formatoDuracion(t.duracion_min)}
+          ${t.precio > 0 ? ` · ${t.precio.toFixed(2)}€` : ''}
+          ${t.aviso ? `<br><span class="fuera">${escapar(t.aviso)}</span>` : ''}
+        </li>`).join('');
+      cuerpo += `
+      <div class="tarjeta">
+        <div class="cabecera">
+          <span>${it.flexible ? 'Flexible' : `${escapar(it.salida)} → ${escapar(it.llegada)}`}</span>
+          <span>${formatoDuracion(it.duracion_min)} · ${it.transbordos} transbordo${it.transbordos === 1 ? '' : 's'}${it.precio > 0 ? ` · ${it.precio.toFixed(2)}€` : ''}</span>
+        </div>
+        <ol>${tramos}</ol>
+      </div>`;
+    });
+  }
+  return `<!DOCTYPE html>
+<html lang="es"><head><meta charset="UTF-8"><meta name="viewport" content="width=device-width, initial-scale=1.0">
+<title>Resultados - Mi Ruta</title><meta name="theme-color" content="#e0e5ec">
+<style>
+body{font-family:'Poppins',sans-serif;background:#e0e5ec;color:#2d3748;margin:0;padding:16px}
+h1{font-size:1.2rem}a{color:#5a6fd8}
+.aviso{background:#fefcbf;border-radius:12px;padding:8px 12px;font-size:.85rem}
+.tarjeta{background:#e0e5ec;box-shadow:10px 10px 20px #b8bcc3,-10px -10px 20px #fff;border-radius:20px;padding:16px;margin:16px 0}
+.cabecera{display:flex;justify-content:space-between;flex-wrap:wrap;font-weight:600}
+ol{padding-left:20px}li{margin:8px 0;font-size:.9rem}.fuera{color:#c53030;font-weight:600;font-size:.75rem}
+</style></head><body>
+<a href="/">← Nueva búsqueda</a>
+<h1>${titulo}</h1>
+${cuerpo}
+</body></html>`;
+}
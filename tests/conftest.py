@@ -0,0 +1,69 @@
+# Pruebas con pytest (python -m pytest desde la raíz del repositorio).
+#
+# app.py carga la hoja al importarse, así que antes de importarlo se apunta GOOGLE_SHEET_URL a una
+# hoja servida en local (benchmark.ServidorHoja, con ETag como Google) y la caché de horarios a un
+# directorio temporal. Sin recarga en segundo plano: cada prueba llama a recargar_horarios().
+import os
+import sys
+import tempfile
+from datetime import datetime
+
+import pytest
+import pytz
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from benchmark import ServidorHoja  # noqa: E402
+
+CABECERA = ('Origen,Parada,Destino,Parada,Tipo_Horario,Salida,Llegada,H_Primer,H_Ultim,Frecuencia_Min,'
+            'Duracion_Trayecto_Min,Dias,Compañía,Transporte,Linea,Precio,Observaciones\n')
+FILAS_INICIALES = [
+    'Mairena,,Sta. Justa,,Fijo,07:00,07:40,,,,,L-V,Consorcio,Bus,M-101,"1,50 €",',
+    'Mairena,,Sta. Justa,,Fijo,08:00,08:40,,,,,L-V,Consorcio,Bus,M-101,"1,50 €",',
+    'Sta. Justa,,Universidad,,Frecuencia,,,07:00,23:00,10,15,L-D,Metro,Metro,L1,"1,35 €",',
+    'Sta. Justa,,Campus,,Fijo,08:00,08:30,,,,,L-V,Tussam,Bus,C1,"1,40 €",',
+]
+
+def hoja(filas):
+    return CABECERA + '\n'.join(filas) + '\n'
+
+def publicar(filas):
+    servidor_hoja.contenido = hoja(filas).encode('utf-8')
+
+servidor_hoja = ServidorHoja()
+servidor_hoja.contenido = hoja(FILAS_INICIALES).encode('utf-8')
+_directorio = tempfile.mkdtemp(prefix='mi-ruta-pruebas-')
+os.environ.update(GOOGLE_SHEET_URL=servidor_hoja.url, INTERVALO_RECARGA_S='0', LOG_LEVEL='WARNING',
+                  CACHE_HORARIOS=os.path.join(_directorio, 'horarios_cache.bin'),
+                  TRANSBORDOS_CSV=os.path.join(_directorio, 'sin_transbordos.csv'))
+
+@pytest.fixture(scope='session')
+def app_mod():
+    import app
+    return app
+
+@pytest.fixture
+def hoja_inicial(app_mod):
+    # Cada prueba parte de la hoja inicial ya cargada
+    servidor_hoja.contenido = hoja(FILAS_INICIALES).encode('utf-8')
+    app_mod.recargar_horarios()
+    return app_mod.snapshot_actual
+
+@pytest.fixture
+def cliente(app_mod, hoja_inicial):
+    return app_mod.app.test_client()
+
+@pytest.fixture
+def a_las(app_mod, monkeypatch):
+    # Fija "ahora" para interpretar_busqueda y la portada (hora de Madrid)
+    def fijar(*fecha):
+        momento = pytz.timezone('Europe/Madrid').localize(datetime(*fecha))
+
+        class Reloj(datetime):
+            @classmethod
+            def now(cls, tz=None):
+                return momento.astimezone(tz) if tz else momento.replace(tzinfo=None)
+
+        monkeypatch.setattr(app_mod, 'datetime', Reloj)
+    return fijar
@@ -0,0 +1,89 @@
+# Endpoints de búsqueda sobre la hoja inicial de conftest.py, con la hora fijada donde importa.
+import json
+
+import pytest
+
+def salidas(respuesta):
+    return [(i['salida'], i['salida_min']) for i in respuesta.get_json()['itinerarios']]
+
+def test_desde_ahora_los_filtros_horarios_valen_para_manana(cliente, a_las):
+    a_las(2026, 10, 19, 22, 0)   # lunes
+    consulta = {'origen': 'Mairena', 'destino': 'Sta. Justa', 'desde_ahora': '1'}
+    llegar_antes = cliente.post('/api/v1/buscar', json=dict(consulta, llegar_antes_check='1', llegar_antes_hora='9'))
+    assert salidas(llegar_antes) == [('07:00', 1860), ('08:00', 1920)]
+    salir_despues = cliente.post('/api/v1/buscar', json=dict(consulta, salir_despues_check='1',
+                                                             salir_despues_hora='7', salir_despues_minuto='30'))
+    assert salidas(salir_despues) == [('08:00', 1920)]
+
+@pytest.mark.parametrize('enviar', [lambda c, q: c.post('/api/v1/buscar', json=dict(q, formato='ndjson')),
+                                    lambda c, q: c.post('/api/v1/buscar', data=dict(q, formato='ndjson')),
+                                    lambda c, q: c.get('/api/v1/buscar', query_string=q,
+                                                       headers={'Accept': 'application/x-ndjson'})],
+                         ids=['json', 'formulario', 'accept'])
+def test_ndjson_un_itinerario_por_linea_con_fecha_en_cabeceras(app_mod, cliente, a_las, enviar):
+    a_las(2026, 10, 19, 6, 0)   # lunes
+    respuesta = enviar(cliente, {'origen': 'Mairena', 'destino': 'Sta. Justa'})
+    assert respuesta.mimetype == 'application/x-ndjson'
+    assert respuesta.headers['X-Fecha'] == '2026-10-19'
+    assert respuesta.headers['X-Version-Horarios'] == app_mod.snapshot_actual.version
+    lineas = [json.loads(linea) for linea in respuesta.get_data(as_text=True).splitlines()]
+    assert [(i['salida'], i['salida_min']) for i in lineas] == [('07:00', 420), ('08:00', 480)]
+
+def test_buscar_devuelve_itinerarios_con_fecha_y_version(app_mod, cliente, a_las):
+    a_las(2026, 10, 19, 6, 0)   # lunes
+    respuesta = cliente.get('/api/v1/buscar', query_string={'origen': 'Mairena', 'destino': 'Sta. Justa'})
+    assert respuesta.status_code == 200
+    cuerpo = respuesta.get_json()
+    assert {k: cuerpo[k] for k in ('origen', 'destino', 'dia', 'fecha', 'version_horarios')} == {
+        'origen': 'Mairena', 'destino': 'Sta. Justa', 'dia': 'Lunes', 'fecha': '2026-10-19',
+        'version_horarios': app_mod.snapshot_actual.version}
+    primero = cuerpo['itinerarios'][0]
+    assert (primero['salida'], primero['llegada'], primero['duracion_min'], primero['precio'], primero['transbordos']) == \
+        ('07:00', '07:40', 40, 1.5, 0)
+    assert [(t['origen'], t['destino'], t['compania'], t['linea'], t['tipo']) for t in primero['tramos']] == \
+        [('Mairena', 'Sta. Justa', 'Consorcio', 'M-101', 'Fijo')]
+
+def test_buscar_proximas_salidas_por_hora(cliente, a_las):
+    a_las(2026, 10, 19, 7, 30)   # lunes
+    respuesta = cliente.post('/api/v1/buscar', json={'origen': 'Mairena', 'destino': 'Sta. Justa', 'proximas': 1})
+    assert salidas(respuesta) == [('08:00', 480)]
+
+@pytest.mark.parametrize('consulta, estado, error', [
+    ({'origen': 'Mairena'}, 400, "Faltan 'origen' y/o 'destino'"),
+    ({'origen': 'Mairena', 'destino': 'Sta. Justa', 'proximas': 'x'}, 400, "'proximas' debe ser un número"),
+    ({'origen': 'Mairena', 'destino': 'Sevilla'}, 404, "Parada desconocida: Sevilla"),
+])
+def test_buscar_errores(cliente, consulta, estado, error):
+    respuesta = cliente.get('/api/v1/buscar', query_string=consulta)
+    assert respuesta.status_code == estado
+    assert respuesta.get_json()['error'] == error
+
+def test_destinos_alcanzables_y_paradas_de_paso(app_mod, cliente):
+    respuesta = cliente.get('/api/v1/destinos', query_string={'origen': 'Mairena', 'destino': 'Universidad',
+                                                             'dia_semana_selector': '0'})
+    cuerpo = respuesta.get_json()
+    assert (cuerpo['origen'], cuerpo['dia'], cuerpo['version_horarios']) == ('Mairena', 'Lunes', app_mod.snapshot_actual.version)
+    assert sorted((d['destino'], d['tramos_minimos']) for d in cuerpo['destinos']) == \
+        [('Campus', 2), ('Sta. Justa', 1), ('Universidad', 2)]
+    assert cuerpo['via'] == ['Sta. Justa']
+
+def test_destinos_sin_servicio_el_fin_de_semana(cliente):
+    # Sábado y la madrugada del domingo: el autobús de Mairena solo va de lunes a viernes
+    cuerpo = cliente.get('/api/v1/destinos', query_string={'origen': 'Mairena', 'dia_semana_selector': '5'}).get_json()
+    assert cuerpo['destinos'] == []
+    assert cliente.get('/api/v1/destinos', query_string={'origen': 'Sevilla'}).status_code == 404
+
+def test_paradas_autocompleta(app_mod, cliente):
+    respuesta = cliente.get('/api/v1/paradas', query_string={'q': 'sta'})
+    assert respuesta.get_json() == {'consulta': 'sta', 'paradas': ['Sta. Justa'],
+                                    'version_horarios': app_mod.snapshot_actual.version}
+    assert respuesta.cache_control.max_age == 300
+    assert cliente.get('/api/v1/paradas', query_string={'q': 'sta', 'n': 'x'}).status_code == 400
+
+def test_buscar_resuelve_nombres_y_sugiere_paradas(cliente, a_las):
+    a_las(2026, 10, 19, 6, 0)   # lunes
+    cuerpo = cliente.get('/api/v1/buscar', query_string={'origen': 'MAIRENA', 'destino': 'santa justa'}).get_json()
+    assert (cuerpo['origen'], cuerpo['destino']) == ('Mairena', 'Sta. Justa')
+    desconocida = cliente.get('/api/v1/buscar', query_string={'origen': 'Mairena', 'destino': 'Ca'})
+    assert desconocida.status_code == 404
+    assert desconocida.get_json()['sugerencias'] == ['Campus']
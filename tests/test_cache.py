@@ -0,0 +1,45 @@
+# Caché de búsquedas: LRU con caducidad y clave por versión de la hoja.
+import pytest
+
+@pytest.fixture
+def reloj(app_mod, monkeypatch):
+    ahora = [1000.0]
+    monkeypatch.setattr(app_mod, 'monotonic', lambda: ahora[0])
+    return ahora
+
+def test_expulsa_la_menos_usada(app_mod, reloj):
+    cache = app_mod.CacheBusquedas(2, 60)
+    cache.guardar('a', 1)
+    cache.guardar('b', 2)
+    assert cache.obtener('a') == 1   # 'b' pasa a ser la menos usada
+    cache.guardar('c', 3)
+    assert cache.obtener('b') is None
+    assert (cache.obtener('a'), cache.obtener('c')) == (1, 3)
+    assert cache.estadisticas() == {'entradas': 2, 'max_entradas': 2, 'ttl_s': 60, 'aciertos': 3,
+                                    'fallos': 1, 'expulsiones': 1, 'caducadas': 0}
+
+def test_caduca_pasado_el_ttl(app_mod, reloj):
+    cache = app_mod.CacheBusquedas(10, 60)
+    cache.guardar('a', 1)
+    reloj[0] += 60
+    assert cache.obtener('a') == 1
+    reloj[0] += 1
+    assert cache.obtener('a') is None
+    assert cache.estadisticas()['caducadas'] == 1
+    assert cache.estadisticas()['entradas'] == 0
+
+def test_sin_entradas_no_guarda(app_mod):
+    cache = app_mod.CacheBusquedas(0, 60)
+    cache.guardar('a', 1)
+    assert cache.obtener('a') is None
+
+def test_misma_busqueda_sale_de_la_cache_hasta_que_cambia_la_hoja(app_mod, hoja_inicial, monkeypatch):
+    monkeypatch.setattr(app_mod, 'cache_busquedas', app_mod.CacheBusquedas(10, 60))
+    params = app_mod.interpretar_busqueda({'origen': 'Mairena', 'destino': 'Universidad'}, hoja_inicial.indice)
+    primero, _ = app_mod.ejecutar_busqueda(params, hoja_inicial)
+    segundo, _ = app_mod.ejecutar_busqueda(params, hoja_inicial)
+    assert segundo is primero
+    otra_version = app_mod.SnapshotHorarios(hoja_inicial.df, 'otra huella', transbordos=hoja_inicial.indice.transbordos)
+    assert otra_version.version != hoja_inicial.version
+    assert app_mod.ejecutar_busqueda(params, otra_version)[0] is not primero
+    assert (app_mod.cache_busquedas.aciertos, app_mod.cache_busquedas.fallos) == (1, 2)
@@ -0,0 +1,69 @@
+# Motor de búsqueda sobre hojas mínimas de A a C. Cada jornada se resume como
+# (salida, llegada, compañías de sus tramos), con las horas en HH:MM.
+import pytest
+
+from conftest import hoja
+
+TRANSBORDOS_B = 'Parada,Compania_Llegada,Compania_Salida,Minutos\nB,X,Z,2\nB,Y,Z,15\n'
+
+@pytest.fixture
+def buscar(app_mod):
+    def buscar(filas, transbordos='', dia=0):
+        df, rechazadas = app_mod.validar_hoja(app_mod.limpiar_hoja(hoja(filas)))
+        assert rechazadas == []
+        indice = app_mod.IndiceRutas(df, app_mod.TablaTransbordos(transbordos))
+        jornadas = app_mod.motor_busqueda.buscar(indice, app_mod.ConsultaRuta('A', 'C', dia, ()))
+        return sorted((app_mod.formato_minutos(j.salida), app_mod.formato_minutos(j.llegada),
+                       [indice.registros[t]['Compania'] for t, _, _ in j.tramos]) for j in jornadas)
+    return buscar
+
+def test_transbordo_por_defecto(buscar):
+    assert buscar(['A,,B,,Fijo,09:00,10:00,,,,,L-D,X,Bus,,1,',
+                   'B,,C,,Fijo,10:05,10:30,,,,,L-D,Z,Bus,,1,',
+                   'B,,C,,Fijo,10:10,10:40,,,,,L-D,Z,Bus,,1,']) == [('09:00', '10:40', ['X', 'Z'])]
+
+def test_flotantes_con_ventanas_distintas_no_se_dominan(buscar):
+    # El metro tarda menos pero cierra a las 22:00: el búho sale 70 minutos después y llega igual
+    assert buscar(['A,,B,,Frecuencia,,,07:00,22:00,10,20,L-D,Metro,Metro,,1,',
+                   'A,,B,,Frecuencia,,,23:00,02:00,10,30,L-D,Nocturno,Bus,,1,',
+                   'B,,C,,Fijo,23:50,00:30,,,,,L-D,Tren,Tren,,1,']) == [('23:10', '00:30', ['Nocturno', 'Tren'])]
+
+def test_encaje_hacia_atras_respeta_la_espera_maxima(buscar):
+    # La última salida del metro deja más de ESPERA_MAXIMA_MIN hasta el tren
+    assert buscar(['A,,B,,Frecuencia,,,07:00,12:00,10,20,L-D,Metro,Metro,,1,',
+                   'B,,C,,Fijo,23:50,00:30,,,,,L-D,Tren,Tren,,1,']) == []
+
+def test_llegar_antes_con_transbordo_largo_no_domina(buscar):
+    assert buscar(['A,,B,,Fijo,09:00,10:00,,,,,L-D,X,Bus,,1,',
+                   'A,,B,,Fijo,09:00,09:58,,,,,L-D,Y,Bus,,1,',
+                   'B,,C,,Fijo,10:05,10:30,,,,,L-D,Z,Bus,,1,',
+                   'B,,C,,Fijo,11:00,11:30,,,,,L-D,Z,Bus,,1,'], TRANSBORDOS_B) == [('09:00', '10:30', ['X', 'Z'])]
+
+def test_transbordo_corto_antes_de_medianoche(buscar):
+    assert buscar(['A,,B,,Fijo,22:52,23:52,,,,,L-D,X,Bus,,1,',
+                   'B,,C,,Fijo,23:58,00:20,,,,,L-D,Z,Bus,,1,',
+                   'B,,C,,Fijo,06:00,06:20,,,,,L-D,Z,Bus,,1,'], TRANSBORDOS_B) == [('22:52', '00:20', ['X', 'Z'])]
+
+def test_frecuencia_de_lunes_a_viernes_el_viernes_a_medianoche(buscar):
+    # El viernes (dia=4) a las 23:54 aún hay servicio; el sábado ya no
+    assert buscar(['A,,B,,Fijo,22:52,23:52,,,,,L-V,X,Bus,,1,',
+                   'B,,C,,Frecuencia,,,06:00,23:59,2,20,L-V,Z,Bus,,1,'],
+                  TRANSBORDOS_B, dia=4) == [('22:52', '00:14', ['X', 'Z'])]
+
+def test_salida_posterior_que_adelanta_en_el_mismo_grupo(buscar):
+    # Regional y expreso de la misma compañía y transporte: el expreso sale después y llega antes
+    assert buscar(['A,,B,,Fijo,09:00,10:00,,,,,L-D,Consorcio,Bus,,1,',
+                   'B,,C,,Fijo,10:15,11:30,,,,,L-D,Renfe,Tren,Regional,1,',
+                   'B,,C,,Fijo,10:20,10:50,,,,,L-D,Renfe,Tren,Expreso,1,']) == [('09:00', '10:50', ['Consorcio', 'Renfe'])]
+
+def test_ancla_posterior_que_no_encaja_no_descarta_la_anterior(buscar):
+    # El expreso de las 11:30 llega antes, pero desde el último autobús (08:00) la espera pasaría
+    # de ESPERA_MAXIMA_MIN: sigue valiendo el de las 11:05
+    assert buscar(['A,,B,,Frecuencia,,,07:00,08:00,10,10,L-D,Metro,Metro,,1,',
+                   'B,,C,,Fijo,11:05,12:00,,,,,L-D,Renfe,Tren,,1,',
+                   'B,,C,,Fijo,11:30,11:50,,,,,L-D,Renfe,Tren,,1,']) == [('08:00', '12:00', ['Metro', 'Renfe'])]
+
+def test_tramo_de_otro_tipo_con_duracion_se_combina_con_un_fijo(buscar):
+    # Un tramo "Andando" va como flexible, sin ventana de servicio: se encaja hacia atrás desde el fijo
+    assert buscar(['A,,B,,Andando,,,,,,5,L-D,A pie,A pie,,0,',
+                   'B,,C,,Fijo,10:00,10:30,,,,,L-D,Z,Bus,,1,']) == [('09:45', '10:30', ['A pie', 'Z'])]
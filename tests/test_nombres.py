@@ -0,0 +1,30 @@
+# Resolución de nombres de parada: sin tildes, mayúsculas ni abreviaturas, prefijos y erratas.
+import pytest
+
+PARADAS = ['Sta. Justa', 'Plz. Armas', 'Plaza de Cuba', 'Universidad', 'Univ. Pablo de Olavide', 'Campus', 'Cartuja']
+
+@pytest.fixture
+def nombres(app_mod):
+    return app_mod.IndiceNombres(PARADAS)
+
+@pytest.mark.parametrize('texto, parada', [
+    ('Sta. Justa', 'Sta. Justa'),
+    ('STA JUSTA', 'Sta. Justa'),
+    ('santa justa', 'Sta. Justa'),
+    ('plaza armas', 'Plz. Armas'),
+    ('olavide', 'Univ. Pablo de Olavide'),     # prefijo de una palabra que solo tiene una parada
+    ('cartuj', 'Cartuja'),
+    ('Cartuha', 'Cartuja'),                    # errata
+    ('plaza', None),                           # dos paradas empiezan así
+    ('ca', None),                              # menos de tres letras
+    ('Sevilla', None),
+    ('', None),
+])
+def test_resolver(nombres, texto, parada):
+    assert nombres.resolver(texto) == parada
+
+def test_sugerencias_primero_por_prefijo(nombres):
+    assert nombres.sugerencias('plaza') == ['Plz. Armas', 'Plaza de Cuba']
+    assert nombres.sugerencias('univ') == ['Universidad', 'Univ. Pablo de Olavide']
+    assert nombres.sugerencias('univ', 1) == ['Universidad']
+    assert nombres.sugerencias('Sevilla') == []
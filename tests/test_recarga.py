@@ -0,0 +1,111 @@
+# Recarga de la hoja: peticiones condicionales, huella del contenido, cambios solo en filas
+# rechazadas y arranque desde la caché en disco cuando la hoja no responde.
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import CABECERA, FILAS_INICIALES, RAIZ, hoja, publicar, servidor_hoja
+
+def registrar_estados(app_mod, monkeypatch):
+    estados = []
+    get = app_mod.requests.get
+
+    def get_con_registro(*args, **kwargs):
+        respuesta = get(*args, **kwargs)
+        estados.append(respuesta.status_code)
+        return respuesta
+
+    monkeypatch.setattr(app_mod.requests, 'get', get_con_registro)
+    return estados
+
+def test_hoja_sin_cambios_responde_304(app_mod, hoja_inicial, monkeypatch):
+    estados = registrar_estados(app_mod, monkeypatch)
+    assert app_mod.recargar_horarios() is False
+    assert estados == [304]
+    assert app_mod.snapshot_actual is hoja_inicial
+
+def test_sin_etag_se_compara_el_contenido(app_mod, hoja_inicial, monkeypatch):
+    estados = registrar_estados(app_mod, monkeypatch)
+    monkeypatch.setattr(hoja_inicial, 'etag', None)
+    assert app_mod.recargar_horarios() is False
+    assert estados == [200]
+    assert app_mod.snapshot_actual is hoja_inicial
+
+def test_contenido_distinto_publica_version_nueva(app_mod, hoja_inicial):
+    filas = list(FILAS_INICIALES)
+    filas[1] = filas[1].replace('08:00,08:40', '08:05,08:45')
+    publicar(filas + ['Campus,,Universidad,,Fijo,09:00,09:10,,,,,L-V,Tussam,Bus,C1,"1,40 €",'])
+    assert app_mod.recargar_horarios() is True
+    nuevo = app_mod.snapshot_actual
+    assert nuevo.version != hoja_inicial.version
+    assert nuevo.cambios == {'nuevas': ['Campus → Universidad'], 'eliminadas': [],
+                             'modificadas': ['Mairena → Sta. Justa']}
+    # Las filas de rutas sin cambios se reutilizan, las cambiadas no
+    assert nuevo.indice.registros[2] is hoja_inicial.indice.registros[2]
+    assert nuevo.indice.registros[1] is not hoja_inicial.indice.registros[1]
+    assert nuevo.indice.registros[1]['Salida'] == '08:05'
+
+def test_cambio_solo_en_filas_rechazadas_conserva_la_version(app_mod, hoja_inicial):
+    publicar(FILAS_INICIALES + ['Mairena,,Campus,,Fijo,09:00,09:30,,,,,,Consorcio,Bus,,1,'])
+    assert app_mod.recargar_horarios() is False
+    actual = app_mod.snapshot_actual
+    assert actual is not hoja_inicial
+    assert actual.huella != hoja_inicial.huella
+    assert actual.version == hoja_inicial.version
+    assert actual.indice is hoja_inicial.indice
+    assert actual.rechazadas == [{'fila': 6, 'motivo': 'Dias vacío o desconocido',
+                                  'origen': 'Mairena', 'destino': 'Campus'}]
+    informe = app_mod.app.test_client().get('/horarios/informe').get_json()
+    assert informe['version'] == hoja_inicial.version
+    assert informe['rechazadas'] == actual.rechazadas
+    assert informe['cambios'] == {'nuevas': [], 'eliminadas': [], 'modificadas': []}
+
+@pytest.mark.parametrize('contenido', ['<!DOCTYPE html>\n<html><body><p>Error 500</p></body></html>\n', CABECERA,
+                                       hoja(['Mairena,,Campus,,Fijo,09:00,09:30,,,,,,Consorcio,Bus,,1,'] * 4)],
+                         ids=['pagina_de_error', 'solo_cabecera', 'todo_rechazado'])
+def test_descarga_que_no_es_la_hoja_no_se_publica(app_mod, hoja_inicial, contenido):
+    cache = os.environ['CACHE_HORARIOS']
+    guardada = open(cache, 'rb').read()
+    servidor_hoja.contenido = contenido.encode('utf-8')
+    with pytest.raises(Exception):
+        app_mod.recargar_horarios()
+    assert app_mod.snapshot_actual is hoja_inicial
+    assert open(cache, 'rb').read() == guardada
+
+def test_cache_en_disco_guarda_el_snapshot(app_mod, hoja_inicial, tmp_path):
+    ruta = str(tmp_path / 'horarios_cache.bin')
+    app_mod.guardar_cache_horarios(hoja_inicial, ruta)
+    leido = app_mod.leer_cache_horarios(ruta, hoja_inicial.indice.transbordos)
+    assert leido.huella == hoja_inicial.huella
+    assert leido.version == hoja_inicial.version
+    assert leido.etag == hoja_inicial.etag
+    assert leido.rutas == hoja_inicial.rutas
+    assert leido.indice.registros == hoja_inicial.indice.registros
+
+def test_arranque_sin_hoja_usa_la_cache(app_mod, hoja_inicial, tmp_path):
+    ruta = str(tmp_path / 'horarios_cache.bin')
+    app_mod.guardar_cache_horarios(hoja_inicial, ruta)
+    entorno = dict(os.environ, GOOGLE_SHEET_URL='http://127.0.0.1:9/hoja.csv', CACHE_HORARIOS=ruta)
+    salida = subprocess.run([sys.executable, '-c', 'import app; print(app.snapshot_actual.version, len(app.snapshot_actual.df))'],
+                            cwd=RAIZ, env=entorno, capture_output=True, text=True, timeout=120, check=True)
+    assert salida.stdout.split()[-2:] == [hoja_inicial.version, str(len(FILAS_INICIALES))]
+
+@pytest.mark.parametrize('fila, motivo', [
+    (',,Campus,,Fijo,09:00,09:30,,,,,L-V,Tussam,Bus,,1,', 'Falta el origen o el destino'),
+    ('Campus,,Campus,,Fijo,09:00,09:30,,,,,L-V,Tussam,Bus,,1,', 'Origen y destino son la misma parada'),
+    ('Mairena,,Campus,,Fijo,09:00,09:30,,,,,Lunes,Tussam,Bus,,1,', 'Dias vacío o desconocido'),
+    ('Mairena,,Campus,,Fijo,09:00,09:30,,,,,L-V,Tussam,Bus,,gratis,', 'Precio no válido'),
+    ('Mairena,,Campus,,Fijo,9h,09:30,,,,,L-V,Tussam,Bus,,1,', 'Salida o Llegada no es una hora HH:MM'),
+    ('Mairena,,Campus,,Fijo,09:00,,,,,,L-V,Tussam,Bus,,1,', 'Salida o Llegada no es una hora HH:MM'),
+    ('Mairena,,Campus,,Frecuencia,,,7:00,25:00,10,20,L-V,Tussam,Bus,,1,', 'H_Primer o H_Ultim no es una hora HH:MM'),
+    ('Mairena,,Campus,,Frecuencia,,,07:00,22:00,cada 10,20,L-V,Tussam,Bus,,1,', 'Frecuencia_Min no válida'),
+    ('Mairena,,Campus,,Frecuencia,,,07:00,22:00,10,,L-V,Tussam,Bus,,1,', 'Duracion_Trayecto_Min vacía o no válida'),
+    ('Mairena,,Campus,,Andando,,,,,,0,L-D,A pie,A pie,,0,', 'Duracion_Trayecto_Min vacía o no válida'),
+])
+def test_validar_hoja_motivos_de_rechazo(app_mod, fila, motivo):
+    df, rechazadas = app_mod.validar_hoja(app_mod.limpiar_hoja(hoja(FILAS_INICIALES + [fila])))
+    assert len(df) == len(FILAS_INICIALES)
+    assert [r['fila'] for r in rechazadas] == [len(FILAS_INICIALES) + 2]
+    assert rechazadas[0]['motivo'] == motivo
@@ -0,0 +1,52 @@
+# Páginas y endpoints de servicio (no /api/v1) sobre la hoja inicial de conftest.py.
+import pytest
+
+from conftest import FILAS_INICIALES, publicar
+
+@pytest.fixture
+def metricas_limpias(app_mod, monkeypatch):
+    monkeypatch.setattr(app_mod, 'metricas', app_mod.Metricas())
+    monkeypatch.setattr(app_mod, 'cache_busquedas', app_mod.CacheBusquedas(10, 60))
+
+def leer_metricas(cliente):
+    respuesta = cliente.get('/metrics')
+    assert respuesta.mimetype == 'text/plain'
+    valores = {}
+    for linea in respuesta.get_data(as_text=True).splitlines():
+        if not linea.startswith('#'):
+            nombre, valor = linea.rsplit(' ', 1)
+            valores[nombre] = float(valor)
+    return valores
+
+def test_metricas_cuentan_etapas_busquedas_y_cache(app_mod, cliente, a_las, metricas_limpias):
+    a_las(2026, 10, 19, 6, 0)   # lunes
+    for _ in range(2):
+        assert cliente.post('/buscar', data={'origen': 'Mairena', 'destino': 'Universidad'}).status_code == 200
+    valores = leer_metricas(cliente)
+    # El motor solo corre la primera vez; la segunda sale de la caché
+    assert valores['mi_ruta_etapa_segundos_count{etapa="cache"}'] == 2
+    assert valores['mi_ruta_etapa_segundos_count{etapa="motor"}'] == 1
+    assert valores['mi_ruta_etapa_segundos_count{etapa="render"}'] == 2
+    assert valores['mi_ruta_etapa_segundos_bucket{etapa="render",le="+Inf"}'] == 2
+    assert valores['mi_ruta_busquedas_total'] == 2
+    assert valores['mi_ruta_busquedas_motor_total'] == 1
+    assert valores['mi_ruta_jornadas_encontradas_total'] > 0
+    assert (valores['mi_ruta_cache_busquedas_aciertos_total'], valores['mi_ruta_cache_busquedas_fallos_total']) == (1, 1)
+    assert valores[f'mi_ruta_snapshot_rutas{{version="{app_mod.snapshot_actual.version}"}}'] == 4
+    assert valores['mi_ruta_snapshot_filas_rechazadas'] == 0
+
+def test_portada_responde_304_mientras_no_cambian_el_dia_ni_la_hoja(app_mod, cliente, a_las):
+    a_las(2026, 10, 19, 9, 0)
+    etag = cliente.get('/').headers['ETag']
+    assert cliente.get('/', headers={'If-None-Match': etag}).status_code == 304
+    a_las(2026, 10, 19, 23, 59)
+    assert cliente.get('/', headers={'If-None-Match': etag}).status_code == 304
+    # Otro día, otra frase
+    a_las(2026, 10, 20, 9, 0)
+    assert cliente.get('/', headers={'If-None-Match': etag}).status_code == 200
+    a_las(2026, 10, 19, 9, 0)
+    publicar(FILAS_INICIALES + ['Campus,,Cartuja,,Fijo,09:00,09:10,,,,,L-V,Tussam,Bus,C2,1,'])
+    assert app_mod.recargar_horarios() is True
+    nueva = cliente.get('/', headers={'If-None-Match': etag})
+    assert nueva.status_code == 200
+    assert 'Cartuja' in nueva.get_data(as_text=True)